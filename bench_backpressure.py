@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Slow-consumer benchmark
+
+Starts the server once per engine and overflow policy, registers a client
+that joins a group and then never reads, and posts a stream of messages to
+that group. A healthy member of the same group timestamps every
+notification it receives. Reports post round trips, notification delay at
+the healthy member, server memory, and whether the stalled client was
+still connected at the end. A stalled client is handled well when the
+healthy numbers match the run without one.
+
+Usage: python3 bench_backpressure.py [--posts N] [--buffer KB] [--policies P ...]
+"""
+
+import argparse
+import socket
+import threading
+import time
+
+from bench_engines import percentile, request, server_rss_mb, start_server
+from protocol import FrameReader, send_frame
+from server import OVERFLOW_POLICIES
+
+GROUP_ID = "tech"
+
+# Pads each subject so the stalled client's buffers fill quickly
+SUBJECT_PADDING = "x" * 2048
+
+
+def member(port: int, username: str, receive_buffer: int = None):
+    """Register a client and join the benchmark group"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if receive_buffer:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+    sock.settimeout(30)
+    sock.connect(("localhost", port))
+    reader = FrameReader(sock)
+    request(sock, reader, {"command": "REGISTER", "username": username})
+    request(sock, reader, {"command": "GROUPJOIN", "group_id": GROUP_ID})
+    return sock, reader
+
+
+def watch(reader: FrameReader, expected: int, delays: list):
+    """Record how long each post notification took to arrive"""
+    while len(delays) < expected:
+        try:
+            frame = reader.read()
+        except OSError:
+            return
+        if frame is None:
+            return
+        received = time.perf_counter()
+        for text in frame.get("messages") or [frame.get("message", "")]:
+            if "| @" in text:
+                sent = float(text.split("| @", 1)[1].split()[0])
+                delays.append(received - sent)
+
+
+def run(engine: str, policy: str, port: int, posts: int, buffer_kb: int, stalled: bool):
+    """Benchmark one engine and policy and return a result row"""
+    process = start_server(engine, port, "--coalesce-window", "0",
+                           "--outbound-buffer", str(buffer_kb), "--overflow-policy", policy)
+    try:
+        if stalled:
+            stalled_sock, _ = member(port, "stalled", receive_buffer=4096)
+        watcher, watcher_reader = member(port, "watcher")
+        poster, poster_reader = member(port, "poster")
+
+        delays = []
+        thread = threading.Thread(target=watch, args=(watcher_reader, posts, delays))
+        thread.daemon = True
+        thread.start()
+
+        round_trips = []
+        for i in range(posts):
+            start = time.perf_counter()
+            send_frame(poster, {"command": "GROUPPOST", "group_id": GROUP_ID,
+                                "subject": f"@{start:.6f} {SUBJECT_PADDING}", "content": str(i)})
+            # Notifications for the poster's own posts arrive ahead of some responses
+            while poster_reader.read().get("type") == "NOTIFICATION":
+                pass
+            round_trips.append(time.perf_counter() - start)
+        thread.join(timeout=10)
+
+        users = request(poster, poster_reader, {"command": "GROUPUSERS", "group_id": GROUP_ID})
+        rss = server_rss_mb(process.pid)
+        for sock in (watcher, poster) + ((stalled_sock,) if stalled else ()):
+            sock.close()
+
+        return {
+            "engine": engine,
+            "policy": policy if stalled else "(none stalled)",
+            "post_p50_ms": percentile(round_trips, 50) * 1000,
+            "post_p99_ms": percentile(round_trips, 99) * 1000,
+            "delay_p50_ms": percentile(delays, 50) * 1000,
+            "delay_p99_ms": percentile(delays, 99) * 1000,
+            "delivered": len(delays),
+            "server_rss_mb": rss,
+            "stalled_connected": "stalled" in users.get("users", []) if stalled else None,
+        }
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    """Main benchmark entry point"""
+    parser = argparse.ArgumentParser(description="Measure the effect of one stalled client")
+    parser.add_argument("--posts", type=int, default=5000, help="messages posted per run")
+    parser.add_argument("--buffer", type=int, default=64, metavar="KB",
+                        help="outbound buffer per client given to the server")
+    parser.add_argument("--policies", nargs="+", choices=OVERFLOW_POLICIES, default=list(OVERFLOW_POLICIES))
+    parser.add_argument("--engines", nargs="+", default=["threaded", "asyncio"])
+    parser.add_argument("--port", type=int, default=9300, help="base port for the servers")
+    args = parser.parse_args()
+
+    results = []
+    port = args.port
+    for engine in args.engines:
+        runs = [(args.policies[0], False)] + [(policy, True) for policy in args.policies]
+        for policy, stalled in runs:
+            print(f"Benchmarking {engine} engine, {policy if stalled else 'no'} stalled client...")
+            results.append(run(engine, policy, port, args.posts, args.buffer, stalled))
+            port += 1
+
+    print()
+    print(f"{'Engine':<9} {'Policy':<15} {'post p50':>9} {'post p99':>9} {'notify p50':>11} "
+          f"{'notify p99':>11} {'delivered':>10} {'RSS MB':>7} {'stalled':>8}")
+    print("-" * 98)
+    for row in results:
+        rss = f"{row['server_rss_mb']:.1f}" if row["server_rss_mb"] is not None else "n/a"
+        state = {None: "-", True: "kept", False: "dropped"}[row["stalled_connected"]]
+        print(f"{row['engine']:<9} {row['policy']:<15} {row['post_p50_ms']:>9.2f} {row['post_p99_ms']:>9.2f} "
+              f"{row['delay_p50_ms']:>11.2f} {row['delay_p99_ms']:>11.2f} {row['delivered']:>10} "
+              f"{rss:>7} {state:>8}")
+
+
+if __name__ == "__main__":
+    main()
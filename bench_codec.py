@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Wire codec benchmark
+
+Encodes and decodes representative requests, responses and notifications
+with every codec and reports the frame body size and the time per encode
+and per decode for each message type. Then streams a run of history pages
+through one connection's zlib compression and reports bytes on the wire and
+compression time per page.
+
+Usage: python3 bench_codec.py [--rounds N] [--pages N]
+"""
+
+import argparse
+import time
+
+from protocol import CODECS, HEADER, JSON_CODEC, FrameCompressor, FrameDecoder, encode_frame
+
+MESSAGE = {
+    "msg_id": 4711,
+    "sender": "alice",
+    "subject": "Weekly build status",
+    "content": "All green on main; two flaky tests quarantined until Monday.",
+    "post_date": "2025-12-01 14:30:15",
+    "group_id": "tech",
+}
+
+# (label, payload) pairs covering the high-rate commands
+SAMPLES = [
+    ("GROUPPOST request", {"command": "GROUPPOST", "request_id": 1042, "group_id": "tech",
+                           "subject": MESSAGE["subject"], "content": MESSAGE["content"]}),
+    ("GROUPPOST response", {"status": "SUCCESS", "message": "Message posted successfully",
+                            "msg_id": 4711, "request_id": 1042}),
+    ("GROUPUSERS request", {"command": "GROUPUSERS", "request_id": 1043, "group_id": "tech"}),
+    ("GROUPUSERS response", {"status": "SUCCESS", "request_id": 1043,
+                             "users": [f"user{i}" for i in range(25)]}),
+    ("GROUPMESSAGE response", {"status": "SUCCESS", "message": MESSAGE, "request_id": 1044}),
+    ("HISTORY response (20)", {"status": "SUCCESS", "request_id": 1045, "more": True,
+                               "messages": [dict(MESSAGE, msg_id=4691 + i) for i in range(20)]}),
+    ("Notification", {"type": "NOTIFICATION",
+                      "message": "New message posted: [4711] alice | 2025-12-01 14:30:15 | Weekly build status"}),
+]
+
+
+def time_per_call(function, argument, rounds: int, repeats: int = 5):
+    """Average seconds per call, from the fastest of several runs"""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            function(argument)
+        best = min(best, (time.perf_counter() - start) / rounds)
+    return best
+
+
+def history_pages(count: int):
+    """Consecutive 20-message HISTORY pages with varied subjects and bodies"""
+    pages = []
+    for page in range(count):
+        messages = []
+        for i in range(20):
+            msg_id = page * 20 + i + 1
+            messages.append(dict(
+                MESSAGE, msg_id=msg_id, sender=f"user{msg_id % 37}",
+                subject=f"Release {msg_id % 11} status for team {msg_id % 7}",
+                content=f"Build {msg_id} finished in {msg_id % 97} minutes with {msg_id % 5} warnings; "
+                        f"see ticket #{msg_id * 31 % 1000} for the follow-up items.",
+            ))
+        pages.append({"status": "SUCCESS", "request_id": page, "more": True, "messages": messages})
+    return pages
+
+
+def compression_run(codec, pages: list):
+    """Send pages through one compressed stream; returns (raw, wire bytes, compress us, decompress us)"""
+    frames = [encode_frame(page, codec) for page in pages]
+    compressor = FrameCompressor()
+    decoder = FrameDecoder()
+    decoder.enable_decompression()
+
+    start = time.perf_counter()
+    compressed = [compressor.compress(frame) for frame in frames]
+    compress_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for frame in compressed:
+        decoder.feed(frame)
+    decompress_time = time.perf_counter() - start
+
+    raw = sum(len(frame) - HEADER.size for frame in frames) / len(pages)
+    wire = sum(len(frame) - HEADER.size for frame in compressed) / len(pages)
+    return raw, wire, compress_time / len(pages) * 1e6, decompress_time / len(pages) * 1e6
+
+
+def main():
+    """Main benchmark entry point"""
+    parser = argparse.ArgumentParser(description="Compare wire codecs per message type")
+    parser.add_argument("--rounds", type=int, default=20000, help="encodes/decodes per measurement")
+    parser.add_argument("--pages", type=int, default=200, help="history pages in the compression run")
+    args = parser.parse_args()
+
+    codecs = [JSON_CODEC] + [codec for codec in CODECS.values() if codec is not JSON_CODEC]
+
+    print(f"{'Message':<24} {'Codec':<7} {'bytes':>6} {'encode us':>10} {'decode us':>10}")
+    print("-" * 61)
+    for label, payload in SAMPLES:
+        for codec in codecs:
+            body = codec.encode(payload)
+            assert codec.decode(body) == payload
+            encode = time_per_call(codec.encode, payload, args.rounds)
+            decode = time_per_call(codec.decode, body, args.rounds)
+            print(f"{label:<24} {codec.name:<7} {len(body):>6} {encode * 1e6:>10.2f} {decode * 1e6:>10.2f}")
+        print()
+
+    pages = history_pages(args.pages)
+    print(f"{args.pages} streamed HISTORY pages of 20 messages, zlib per connection\n")
+    print(f"{'Codec':<7} {'raw B/page':>11} {'wire B/page':>12} {'ratio':>6} {'compress us':>12} {'inflate us':>11}")
+    print("-" * 64)
+    for codec in codecs:
+        raw, wire, compress, decompress = compression_run(codec, pages)
+        print(f"{codec.name:<7} {raw:>11.0f} {wire:>12.0f} {raw / wire:>6.1f} {compress:>12.1f} {decompress:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
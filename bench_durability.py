@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Durability benchmark for the message log
+
+Runs concurrent posters against an in-process server backed by a
+MessageLog in each durability mode and reports posts per second and
+per-post latency (each post returns only once it is as durable as the
+mode promises).
+
+Usage: python3 bench_durability.py [--threads N] [--seconds S] [--dir PATH]
+"""
+
+import argparse
+import contextlib
+import io
+import math
+import os
+import tempfile
+import threading
+import time
+
+from protocol import JSON_CODEC
+from server import BulletinBoardServer
+from storage import DEFAULT_COMMIT_WINDOW, MessageLog
+
+
+class NullConnection:
+    """Connection stand-in that discards everything queued on it"""
+
+    address = ("benchmark", 0)
+    codec = JSON_CODEC
+    digest = None
+
+    def send(self, data: bytes):
+        pass
+
+    def notify(self, data: bytes) -> bool:
+        return True
+
+    def close(self):
+        pass
+
+
+def percentile(samples: list, pct: float):
+    """Nearest-rank percentile of a list of samples"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def poster(server: BulletinBoardServer, username: str, stop: threading.Event, latencies: list):
+    """Post to the public board until told to stop, timing every post"""
+    server.register_client(username, NullConnection())
+    server.handle_join(username)
+
+    request = {"command": "POST", "subject": "bench", "content": "x" * 200}
+    samples = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        server.process_command(username, "POST", request)
+        samples.append(time.perf_counter() - start)
+    latencies.extend(samples)
+
+
+def measure(directory: str, durability: str, commit_window: float, threads: int, seconds: float):
+    """Run one durability mode and return (posts/s, p50 ms, p99 ms)"""
+    path = os.path.join(directory, f"bench-{durability}.log")
+    if os.path.exists(path):
+        os.remove(path)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        server = BulletinBoardServer(log=MessageLog(path, durability, commit_window))
+
+        stop = threading.Event()
+        latencies = []
+        workers = [
+            threading.Thread(target=poster, args=(server, f"poster{i}", stop, latencies))
+            for i in range(threads)
+        ]
+        for t in workers:
+            t.start()
+        time.sleep(seconds)
+        stop.set()
+        for t in workers:
+            t.join()
+        server.stop()
+
+    os.remove(path)
+    return (
+        len(latencies) / seconds,
+        percentile(latencies, 50) * 1000,
+        percentile(latencies, 99) * 1000,
+    )
+
+
+def main():
+    """Main benchmark entry point"""
+    parser = argparse.ArgumentParser(description="Compare message log durability modes")
+    parser.add_argument("--threads", type=int, default=16, help="concurrent posting threads")
+    parser.add_argument("--seconds", type=float, default=3.0, help="duration of each run")
+    parser.add_argument("--dir", default=None,
+                        help="directory for the log files (use the production disk for real numbers)")
+    parser.add_argument("--commit-window", type=float, default=DEFAULT_COMMIT_WINDOW * 1000,
+                        metavar="MS", help="group commit window in milliseconds")
+    args = parser.parse_args()
+
+    directory = args.dir or tempfile.mkdtemp(prefix="bulletin-bench-")
+    print(f"{args.threads} posting threads, {args.seconds}s per mode, logs in {directory}\n")
+
+    modes = [
+        ("none", "none", 0.0),
+        ("always", "always", 0.0),
+        ("group (no window)", "group", 0.0),
+        (f"group ({args.commit_window:g} ms)", "group", args.commit_window / 1000),
+    ]
+
+    print(f"{'Mode':<20} {'posts/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    print("-" * 49)
+    for label, durability, window in modes:
+        rate, p50, p99 = measure(directory, durability, window, args.threads, args.seconds)
+        print(f"{label:<20} {rate:>10.0f} {p50:>8.2f} {p99:>8.2f}")
+
+    if not args.dir:
+        os.rmdir(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Engine benchmark for the bulletin board server
+
+Starts the server once per engine, parks a number of idle registered
+connections on it, then measures command latency for a few active clients
+while the idle connections are held open.
+
+Usage: python3 bench_engines.py [--idle N] [--active N] [--requests N]
+"""
+
+import argparse
+import math
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from protocol import FrameReader, send_frame
+
+# Each active client posts to its own group so no notifications reach it
+GROUPS = ["tech", "sports", "music", "books", "movies"]
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def raise_fd_limit():
+    """Raise the open file limit as far as the hard limit allows"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def start_server(engine: str, port: int, *options: str):
+    """Launch server.py with the given engine (and options) and wait until it accepts connections"""
+    process = subprocess.Popen(
+        [sys.executable, "server.py", str(port), "--engine", engine, *options],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        preexec_fn=raise_fd_limit if resource else None
+    )
+
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("localhost", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+
+    process.kill()
+    raise RuntimeError(f"{engine} server did not start on port {port}")
+
+
+def server_rss_mb(pid: int):
+    """Resident memory of a process in MB (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def request(sock: socket.socket, reader: FrameReader, payload: dict):
+    """Send one request and wait for its response"""
+    send_frame(sock, payload)
+    response = reader.read()
+    if response is None:
+        raise ConnectionError("Server closed the connection")
+    return response
+
+
+def open_idle_connections(port: int, count: int):
+    """Open and register idle connections; stops early if the server refuses"""
+    connections = []
+    for i in range(count):
+        try:
+            sock = socket.create_connection(("localhost", port), timeout=10)
+            response = request(sock, FrameReader(sock), {"command": "REGISTER", "username": f"idle{i}"})
+            if response.get("status") != "SUCCESS":
+                sock.close()
+                break
+            connections.append(sock)
+        except OSError:
+            break
+    return connections
+
+
+def active_client(port: int, index: int, requests: int, latencies: list):
+    """Post and list users repeatedly, recording each round trip"""
+    sock = socket.create_connection(("localhost", port), timeout=10)
+    reader = FrameReader(sock)
+    request(sock, reader, {"command": "REGISTER", "username": f"active{index}"})
+    group_id = GROUPS[index % len(GROUPS)]
+    request(sock, reader, {"command": "GROUPJOIN", "group_id": group_id})
+
+    samples = []
+    for i in range(requests):
+        if i % 2:
+            payload = {"command": "GROUPUSERS", "group_id": group_id}
+        else:
+            payload = {"command": "GROUPPOST", "group_id": group_id,
+                       "subject": f"bench {i}", "content": "x" * 64}
+        start = time.perf_counter()
+        request(sock, reader, payload)
+        samples.append(time.perf_counter() - start)
+
+    sock.close()
+    latencies.extend(samples)
+
+
+def percentile(samples: list, pct: float):
+    """Nearest-rank percentile of a list of samples"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def run_engine(engine: str, port: int, idle: int, active: int, requests: int):
+    """Benchmark one engine and return a result row"""
+    process = start_server(engine, port)
+    try:
+        start = time.time()
+        connections = open_idle_connections(port, idle)
+        connect_time = time.time() - start
+
+        latencies = []
+        threads = [
+            threading.Thread(target=active_client, args=(port, i, requests, latencies))
+            for i in range(active)
+        ]
+        start = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - start
+
+        rss = server_rss_mb(process.pid)
+        for sock in connections:
+            sock.close()
+
+        return {
+            "engine": engine,
+            "idle_connections": len(connections),
+            "connect_seconds": connect_time,
+            "server_rss_mb": rss,
+            "requests_per_second": len(latencies) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+        }
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    """Main benchmark entry point"""
+    parser = argparse.ArgumentParser(description="Compare server engines")
+    parser.add_argument("--idle", type=int, default=2000, help="idle connections to hold open")
+    parser.add_argument("--active", type=int, default=len(GROUPS),
+                        help=f"concurrently active clients (at most {len(GROUPS)})")
+    parser.add_argument("--requests", type=int, default=500, help="requests per active client")
+    parser.add_argument("--port", type=int, default=9100, help="base port for the servers")
+    parser.add_argument("--engines", nargs="+", default=["threaded", "asyncio"])
+    args = parser.parse_args()
+    args.active = min(args.active, len(GROUPS))
+
+    raise_fd_limit()
+
+    results = []
+    for offset, engine in enumerate(args.engines):
+        print(f"Benchmarking {engine} engine with {args.idle} idle connections...")
+        results.append(run_engine(engine, args.port + offset, args.idle, args.active, args.requests))
+
+    print()
+    print(f"{'Engine':<10} {'Idle conns':>10} {'Connect s':>10} {'RSS MB':>8} "
+          f"{'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    print("-" * 70)
+    for row in results:
+        rss = f"{row['server_rss_mb']:.1f}" if row["server_rss_mb"] is not None else "n/a"
+        print(f"{row['engine']:<10} {row['idle_connections']:>10} {row['connect_seconds']:>10.2f} "
+              f"{rss:>8} {row['requests_per_second']:>9.0f} {row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
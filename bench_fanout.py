@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Notification fan-out microbenchmark
+
+Times broadcast_notification() for groups of increasing size and reports
+the cost per recipient. Connections are in-memory stand-ins that only keep
+the queued frame, so the numbers cover snapshotting the members, encoding
+and queueing, not socket I/O. The same broadcast is also run with the frame
+encoded separately for every recipient, for comparison. Both run with
+notification coalescing off.
+
+A second run posts bursts to a group and counts the frames each member
+receives with and without the coalescing window.
+
+Usage: python3 bench_fanout.py [--sizes N ...] [--rounds N] [--burst N]
+"""
+
+import argparse
+import contextlib
+import io
+import time
+
+from protocol import JSON_CODEC, encode_frame
+from server import DEFAULT_COALESCE_WINDOW, BulletinBoardServer
+
+
+class CollectingConnection:
+    """Connection stand-in that keeps only the last frame queued on it, and counts them"""
+
+    address = ("benchmark", 0)
+    codec = JSON_CODEC
+    digest = None
+
+    def __init__(self):
+        self.last = None
+        self.frames = 0
+
+    def send(self, data: bytes):
+        self.last = data
+
+    def notify(self, data: bytes) -> bool:
+        self.last = data
+        self.frames += 1
+        return True
+
+    def close(self):
+        pass
+
+
+class PerRecipientServer(BulletinBoardServer):
+    """Server variant that encodes the notification once per recipient"""
+
+    def _fan_out(self, recipients: list, notification: dict):
+        for member, connection in recipients:
+            connection.notify(encode_frame(notification))
+
+
+def build_server(server_class, members: int, coalesce_window: float = 0):
+    """Create a server whose "tech" group has the given number of members"""
+    server = server_class(coalesce_window=coalesce_window)
+    group = server.groups["tech"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(members):
+            username = f"member{i}"
+            server.register_client(username, CollectingConnection())
+            # Join directly: handle_group_join would broadcast every join
+            group.add_member(username)
+            server.client_groups[username].add("tech")
+    return server
+
+
+def time_broadcast(server: BulletinBoardServer, rounds: int):
+    """Average seconds per broadcast to the "tech" group"""
+    header = "[123] someone | 2025-12-01 14:30:15 | A typical subject line for a post"
+    start = time.perf_counter()
+    for _ in range(rounds):
+        server.broadcast_notification("tech", f"New message posted: {header}", exclude="someone")
+    return (time.perf_counter() - start) / rounds
+
+
+def burst_frames(window: float, members: int, posts: int):
+    """Frames per member for a burst of posts, and the time the burst took to deliver"""
+    server = build_server(BulletinBoardServer, members, window)
+    with contextlib.redirect_stdout(io.StringIO()):
+        server.register_client("poster", CollectingConnection())
+        server.handle_group_join("poster", "tech")
+
+        start = time.perf_counter()
+        for i in range(posts):
+            server.handle_post("poster", "tech", f"Burst post {i}", "x" * 100)
+        time.sleep(window * 2 + 0.05)  # let every window close
+        elapsed = time.perf_counter() - start
+
+    frames = sum(server.clients[f"member{i}"].frames for i in range(members))
+    return frames / members, elapsed
+
+
+def main():
+    """Main benchmark entry point"""
+    parser = argparse.ArgumentParser(description="Measure notification fan-out cost per recipient")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000],
+                        help="group sizes to test")
+    parser.add_argument("--rounds", type=int, default=200, help="broadcasts per measurement")
+    parser.add_argument("--burst", type=int, default=500, help="posts in the coalescing burst")
+    args = parser.parse_args()
+
+    print(f"{'Members':>8} {'shared us/recip':>16} {'per-recip us/recip':>19} {'speedup':>8}")
+    print("-" * 55)
+    for size in args.sizes:
+        rounds = max(5, args.rounds * 100 // size)
+        shared = time_broadcast(build_server(BulletinBoardServer, size), rounds)
+        per_recipient = time_broadcast(build_server(PerRecipientServer, size), rounds)
+        print(f"{size:>8} {shared / size * 1e6:>16.3f} {per_recipient / size * 1e6:>19.3f} "
+              f"{per_recipient / shared:>8.2f}")
+
+    members = 100
+    print(f"\nBurst of {args.burst} posts to a group of {members} members\n")
+    print(f"{'Window':>10} {'frames/member':>14} {'delivered in s':>15}")
+    print("-" * 41)
+    for window in (0, DEFAULT_COALESCE_WINDOW):
+        frames, elapsed = burst_frames(window, members, args.burst)
+        print(f"{window * 1000:>7g} ms {frames:>14.1f} {elapsed:>15.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Group scaling benchmark
+
+Creates many empty groups the way CREATEGROUP does, then reports the bytes
+each one costs and how long CREATEGROUP, a GROUPS page (from the start,
+deep into the list, and with a name prefix) and DELETEGROUP take. Runs
+against an in-process server, so the numbers exclude the network.
+
+Usage: python3 bench_groups.py [--groups N] [--page N] [--data-dir DIR]
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+from server import BulletinBoardServer
+
+
+def timed(repeat: int, function, *args):
+    """Average seconds per call of function(*args) over repeat calls"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(*args)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    """Main benchmark entry point"""
+    parser = argparse.ArgumentParser(description="Measure memory and latency with many groups")
+    parser.add_argument("--groups", type=int, default=100000, help="groups to create")
+    parser.add_argument("--page", type=int, default=100, help="groups per GROUPS page")
+    parser.add_argument("--data-dir", help="give the server a data directory, as with --data-dir")
+    args = parser.parse_args()
+
+    server = BulletinBoardServer("localhost", 0, data_dir=args.data_dir)
+    group_ids = [f"room-{i:07d}" for i in range(args.groups)]
+    names = [f"Room {i}" for i in range(args.groups)]
+
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    for group_id, name in zip(group_ids, names):
+        server.handle_create_group("bench", group_id, name)
+    created = time.perf_counter() - start
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+
+    middle = group_ids[args.groups // 2]
+    print(f"{args.groups} empty groups (IDs and names allocated beforehand)\n")
+    print(f"{'bytes/group':<28} {used / args.groups:>10.0f}")
+    print(f"{'CREATEGROUP (us)':<28} {created / args.groups * 1e6:>10.1f}")
+    print(f"{'GROUPS first page (us)':<28} "
+          f"{timed(200, server.handle_list_groups, None, None, args.page) * 1e6:>10.1f}")
+    print(f"{'GROUPS middle page (us)':<28} "
+          f"{timed(200, server.handle_list_groups, None, middle, args.page) * 1e6:>10.1f}")
+    print(f"{'GROUPS prefix page (us)':<28} "
+          f"{timed(200, server.handle_list_groups, middle[:-2], None, args.page) * 1e6:>10.1f}")
+
+    start = time.perf_counter()
+    for group_id in group_ids[:1000]:
+        server.handle_delete_group("bench", group_id)
+    print(f"{'DELETEGROUP (us)':<28} {(time.perf_counter() - start) / 1000 * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+Load generator for the bulletin board server
+
+Connects a number of simulated users, each of which joins the public board
+and a home group, then drives them through a weighted mix of commands for a
+fixed time. Closed loop (the default) sends each user's next command as soon
+as the previous one is answered, after an optional think time. Open loop
+(--rate) sends commands at Poisson-distributed times for a target total
+rate whether or not earlier ones have been answered, and times each one
+from when it was due, so a slow server shows up as latency rather than as
+a lower send rate.
+
+Reports throughput, p50/p99/p999 latency per command, and the delay from a
+post being sent to its notification arriving at the other members. The
+results can be written as JSON and compared against an earlier run, which
+fails (exit status 1) if throughput dropped or p99 latency grew by more
+than a tolerance.
+
+Usage: python3 bench_load.py [--users N] [--duration S] [--mix CMD=W,...]
+                             [--rate R | --think MS] [--json PATH] [--baseline PATH]
+                             [--spawn ENGINE] [--processes N]
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import shlex
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+
+from bench_engines import percentile, raise_fd_limit, start_server
+from protocol import CODECS, JSON_CODEC, FrameError, FrameReader, encode_frame, send_frame
+
+GROUPS = ["tech", "sports", "music", "books", "movies"]
+
+# Commands the mix can contain, and the default weights
+MIX_COMMANDS = ("JOIN", "GROUPJOIN", "GROUPPOST", "GROUPMESSAGE", "USERS", "GROUPHISTORY")
+DEFAULT_MIX = "GROUPPOST=30,GROUPMESSAGE=40,USERS=15,GROUPJOIN=10,JOIN=5"
+
+# How long a closed-loop user waits for an answer, and how long answers may trail the end of a run
+RESPONSE_TIMEOUT = 10
+DRAIN_SECONDS = 5
+
+
+def parse_mix(text: str):
+    """Parse "CMD=weight,..." into (commands, cumulative weights)"""
+    commands, weights = [], []
+    for item in text.split(","):
+        command, _, weight = item.partition("=")
+        command = command.strip().upper()
+        if command not in MIX_COMMANDS:
+            raise ValueError(f"unknown command in mix: {command} (choose from {', '.join(MIX_COMMANDS)})")
+        commands.append(command)
+        weights.append(float(weight or 1))
+    if sum(weights) <= 0:
+        raise ValueError("mix weights must add up to more than 0")
+    return commands, list(itertools.accumulate(weights))
+
+
+class SimulatedUser:
+    """One connection issuing commands from the mix and timing the answers
+
+    A reader thread matches responses to requests by request_id and
+    timestamps notifications; the driver thread decides when to send.
+    """
+
+    def __init__(self, name: str, port: int, codec: str, home_group: str, content: str):
+        self.name = name
+        self.home_group = home_group
+        self.others = [group for group in GROUPS if group != home_group]
+        self.joined = set()  # groups joined on top of the home group
+        self.content = content
+        self.latest = 0  # highest msg_id posted to the home group so far
+
+        self.sock = socket.create_connection(("localhost", port), timeout=30)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = FrameReader(self.sock)
+        self.codec = JSON_CODEC
+        self.request_ids = itertools.count(1)
+        self.pending = {}  # request_id -> (command, time it was due)
+        self.answered = threading.Event()
+        self.closed = False
+
+        # Results, recorded only for requests due after record_from
+        self.record_from = float("inf")
+        self.record_from_wall = float("inf")
+        self.latencies = {}  # command -> [seconds]
+        self.errors = Counter()
+        self.delays = []  # post sent -> notification received, seconds
+        self.sent = 0
+
+        self._handshake(codec)
+
+    def _handshake(self, codec: str):
+        """Register, negotiate the codec, and join the public board and home group"""
+        register = {"command": "REGISTER", "username": self.name}
+        if codec != "json":
+            register["codecs"] = [codec]
+        response = self._call(register)
+        if response.get("status") != "SUCCESS":
+            raise ConnectionError(f"{self.name}: {response.get('message')}")
+        self.codec = self.reader.codec = CODECS.get(response.get("codec"), JSON_CODEC)
+
+        self._call({"command": "JOIN"})
+        self._call({"command": "GROUPJOIN", "group_id": self.home_group})
+
+    def _call(self, request: dict):
+        """Send a request and wait for its response, before the reader thread runs"""
+        send_frame(self.sock, request, self.codec)
+        while True:
+            response = self.reader.read()
+            if response is None:
+                raise ConnectionError("Server closed the connection")
+            if response.get("type") != "NOTIFICATION":
+                return response
+
+    def start(self, record_from: float, deadline: float, commands: list, weights: list,
+              rate: float, think: float):
+        """Start the reader and driver threads"""
+        self.record_from = record_from
+        self.record_from_wall = time.time() + (record_from - time.perf_counter())
+        reader = threading.Thread(target=self._read_loop)
+        reader.daemon = True
+        reader.start()
+        driver = threading.Thread(target=self._drive, args=(deadline, commands, weights, rate, think))
+        driver.daemon = True
+        driver.start()
+        return driver
+
+    def _drive(self, deadline: float, commands: list, weights: list, rate: float, think: float):
+        """Send commands until the deadline, open or closed loop"""
+        due = time.perf_counter()
+        while not self.closed:
+            if rate:
+                due += random.expovariate(rate)
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                due = time.perf_counter()
+            if due >= deadline:
+                break
+
+            command = random.choices(commands, cum_weights=weights)[0]
+            self.answered.clear()
+            try:
+                self._send(self._request(command), due)
+            except OSError:
+                break
+
+            if not rate:
+                self.answered.wait(RESPONSE_TIMEOUT)
+                if think:
+                    time.sleep(random.expovariate(1 / think))
+
+    def _request(self, command: str) -> dict:
+        """Build the next request for a command from the mix"""
+        if command == "GROUPPOST":
+            return {"command": "GROUPPOST", "group_id": self.home_group,
+                    "subject": f"@{time.time():.6f}", "content": self.content}
+        if command == "GROUPMESSAGE":
+            return {"command": "GROUPMESSAGE", "group_id": self.home_group,
+                    "msg_id": random.randint(1, max(1, self.latest))}
+        if command == "GROUPHISTORY":
+            return {"command": "GROUPHISTORY", "group_id": self.home_group, "limit": 20}
+        if command == "GROUPJOIN":
+            # Leave the group again if already in it, so membership churns instead of growing
+            group_id = random.choice(self.others)
+            if group_id in self.joined:
+                self.joined.discard(group_id)
+                return {"command": "GROUPLEAVE", "group_id": group_id}
+            self.joined.add(group_id)
+            return {"command": "GROUPJOIN", "group_id": group_id}
+        return {"command": command}
+
+    def _send(self, request: dict, due: float):
+        """Send a request, remembering when it was due"""
+        request_id = next(self.request_ids)
+        request["request_id"] = request_id
+        self.pending[request_id] = (request["command"], due)
+        self.sock.sendall(encode_frame(request, self.codec))
+        self.sent += 1
+
+    def _read_loop(self):
+        """Match responses to their requests and timestamp notifications"""
+        while True:
+            try:
+                frame = self.reader.read()
+            except (OSError, FrameError):
+                break
+            if frame is None:
+                break
+
+            if frame.get("type") == "NOTIFICATION":
+                self._record_notification(frame, time.time())
+                continue
+
+            received = time.perf_counter()
+            pending = self.pending.pop(frame.get("request_id"), None)
+            if pending is None:
+                continue
+            command, due = pending
+            if frame.get("status") == "SUCCESS" and command == "GROUPPOST":
+                self.latest = max(self.latest, frame.get("msg_id", 0))
+            if due >= self.record_from:
+                self.latencies.setdefault(command, []).append(received - due)
+                if frame.get("status") != "SUCCESS":
+                    self.errors[command] += 1
+            self.answered.set()
+
+        self.closed = True
+        self.answered.set()
+
+    def _record_notification(self, frame: dict, received: float):
+        """Record the delay of every post announced in a (possibly merged) notification"""
+        for text in frame.get("messages") or [frame.get("message", "")]:
+            if "| @" not in text:
+                continue
+            try:
+                sent = float(text.split("| @", 1)[1].split()[0])
+            except (IndexError, ValueError):
+                continue
+            if sent >= self.record_from_wall:
+                self.delays.append(received - sent)
+
+    def close(self):
+        """Close the connection"""
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+def run_worker(config: dict, worker: int, first: int, count: int) -> dict:
+    """Run users [first, first + count) in this process and return their raw samples"""
+    commands, weights = parse_mix(config["mix"])
+    tag = config["tag"]
+    users = []
+    failed = 0
+    for index in range(first, first + count):
+        try:
+            users.append(SimulatedUser(f"load{tag}_{index}", config["port"], config["codec"],
+                                       GROUPS[index % len(GROUPS)], "x" * config["content_bytes"]))
+        except (OSError, FrameError, ConnectionError) as e:
+            failed += 1
+            if failed == 1:
+                print(f"[worker {worker}] could not connect a user: {e}", file=sys.stderr)
+
+    rate = config["rate"] / config["users"] if config["rate"] else 0
+    record_from = time.perf_counter() + config["warmup"]
+    deadline = record_from + config["duration"]
+    drivers = [user.start(record_from, deadline, commands, weights, rate, config["think"]) for user in users]
+    for driver in drivers:
+        driver.join()
+
+    # Give answers to the last requests a moment to arrive
+    drain_until = time.perf_counter() + DRAIN_SECONDS
+    while any(user.pending and not user.closed for user in users) and time.perf_counter() < drain_until:
+        time.sleep(0.05)
+
+    latencies, errors, delays = {}, Counter(), []
+    unanswered = 0
+    for user in users:
+        for command, samples in user.latencies.items():
+            latencies.setdefault(command, []).extend(samples)
+        errors.update(user.errors)
+        delays.extend(user.delays)
+        unanswered += sum(1 for _, due in user.pending.values() if due >= record_from)
+        user.close()
+
+    return {"users": len(users), "failed": failed, "latencies": latencies,
+            "errors": dict(errors), "delays": delays, "unanswered": unanswered}
+
+
+def summarize(samples: list) -> dict:
+    """Count and latency percentiles (ms) of a list of samples (seconds)"""
+    return {
+        "count": len(samples),
+        "mean_ms": sum(samples) / len(samples) * 1000 if samples else 0.0,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "p999_ms": percentile(samples, 99.9) * 1000,
+        "max_ms": max(samples) * 1000 if samples else 0.0,
+    }
+
+
+def build_report(config: dict, results: list) -> dict:
+    """Merge the workers' samples into the report written as JSON"""
+    latencies, errors, delays = {}, Counter(), []
+    for result in results:
+        for command, samples in result["latencies"].items():
+            latencies.setdefault(command, []).extend(samples)
+        errors.update(result["errors"])
+        delays.extend(result["delays"])
+
+    every = [sample for samples in latencies.values() for sample in samples]
+    commands = {}
+    for command in sorted(latencies):
+        commands[command] = dict(summarize(latencies[command]), errors=errors.get(command, 0))
+
+    return {
+        "label": config["label"],
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "config": {key: value for key, value in config.items() if key not in ("tag", "label")},
+        "users": sum(result["users"] for result in results),
+        "failed_users": sum(result["failed"] for result in results),
+        "throughput_rps": len(every) / config["duration"],
+        "unanswered": sum(result["unanswered"] for result in results),
+        "errors": sum(errors.values()),
+        "overall": summarize(every),
+        "commands": commands,
+        "notifications": summarize(delays),
+    }
+
+
+def print_report(report: dict):
+    """Print the report as tables"""
+    config = report["config"]
+    loop = f"open loop at {config['rate']:g} req/s" if config["rate"] else "closed loop"
+    print(f"\n{report['users']} users ({report['failed_users']} failed to connect), {loop}, "
+          f"{config['duration']:g}s measured after {config['warmup']:g}s warmup")
+    print(f"Throughput: {report['throughput_rps']:.0f} req/s, {report['errors']} error responses, "
+          f"{report['unanswered']} unanswered\n")
+
+    print(f"{'Command':<14} {'count':>8} {'errors':>7} {'mean ms':>8} {'p50 ms':>8} "
+          f"{'p99 ms':>8} {'p999 ms':>8} {'max ms':>8}")
+    print("-" * 76)
+    rows = list(report["commands"].items()) + [("(all)", report["overall"]),
+                                                ("(notify)", report["notifications"])]
+    for name, row in rows:
+        errors = row.get("errors", "")
+        print(f"{name:<14} {row['count']:>8} {errors:>7} {row['mean_ms']:>8.2f} {row['p50_ms']:>8.2f} "
+              f"{row['p99_ms']:>8.2f} {row['p999_ms']:>8.2f} {row['max_ms']:>8.2f}")
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions against a baseline report: lower throughput or higher p99 beyond tolerance"""
+    regressions = []
+    if report["throughput_rps"] < baseline["throughput_rps"] * (1 - tolerance):
+        regressions.append(f"throughput {report['throughput_rps']:.0f} req/s, "
+                           f"baseline {baseline['throughput_rps']:.0f}")
+
+    pairs = [("overall", report["overall"], baseline.get("overall")),
+             ("notifications", report["notifications"], baseline.get("notifications"))]
+    pairs += [(command, row, baseline.get("commands", {}).get(command))
+              for command, row in report["commands"].items()]
+    for name, row, before in pairs:
+        if before and before["count"] and row["count"] and row["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{name} p99 {row['p99_ms']:.2f} ms, baseline {before['p99_ms']:.2f} ms")
+    return regressions
+
+
+def main():
+    """Main benchmark entry point"""
+    parser = argparse.ArgumentParser(description="Drive simulated users against the server")
+    parser.add_argument("--port", type=int, default=8888, help="server port (default: 8888)")
+    parser.add_argument("--users", type=int, default=50, help="simulated users")
+    parser.add_argument("--duration", type=float, default=10, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds run before measuring")
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help=f"weighted command mix, from {', '.join(MIX_COMMANDS)} "
+                             f"(default: {DEFAULT_MIX})")
+    loop = parser.add_mutually_exclusive_group()
+    loop.add_argument("--rate", type=float, default=0,
+                      help="open loop: total requests per second, Poisson arrivals")
+    loop.add_argument("--think", type=float, default=0, metavar="MS",
+                      help="closed loop: mean think time between a response and the next request")
+    parser.add_argument("--codec", choices=sorted(CODECS), default="json", help="wire codec to negotiate")
+    parser.add_argument("--content-bytes", type=int, default=64, help="body size of each post")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="split the users over this many load generator processes")
+    parser.add_argument("--spawn", metavar="ENGINE",
+                        help="start server.py with this engine on --port for the run")
+    parser.add_argument("--server-args", default="", help="extra options for the spawned server")
+    parser.add_argument("--json", metavar="PATH", help="write the results as JSON ('-' for stdout)")
+    parser.add_argument("--label", default="", help="name recorded with the JSON results")
+    parser.add_argument("--baseline", metavar="PATH",
+                        help="JSON results of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="allowed fractional regression against --baseline (default: 0.10)")
+    args = parser.parse_args()
+
+    try:
+        parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    config = {
+        "port": args.port, "users": args.users, "duration": args.duration, "warmup": args.warmup,
+        "mix": args.mix, "rate": args.rate, "think": args.think / 1000, "codec": args.codec,
+        "content_bytes": args.content_bytes, "processes": args.processes,
+        "engine": args.spawn, "server_args": args.server_args,
+        "tag": f"{os.getpid()}", "label": args.label,
+    }
+
+    raise_fd_limit()
+    process = start_server(args.spawn, args.port, *shlex.split(args.server_args)) if args.spawn else None
+    try:
+        processes = max(1, min(args.processes, args.users))
+        shares = [args.users // processes + (1 if i < args.users % processes else 0) for i in range(processes)]
+        jobs = [(config, i, sum(shares[:i]), shares[i]) for i in range(processes)]
+        if processes == 1:
+            results = [run_worker(*jobs[0])]
+        else:
+            with multiprocessing.Pool(processes) as pool:
+                results = pool.starmap(run_worker, jobs)
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+    report = build_report(config, results)
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report)
+        if args.json:
+            with open(args.json, "w") as output:
+                json.dump(report, output, indent=2)
+            print(f"\nResults written to {args.json}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        changed = sorted(key for key, value in report["config"].items()
+                         if key not in ("port", "engine") and baseline.get("config", {}).get(key) != value)
+        if changed:
+            print(f"Warning: baseline was run with different {', '.join(changed)}", file=sys.stderr)
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
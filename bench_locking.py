@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Lock contention benchmark for the bulletin board server
+
+Drives the server's command handlers directly (no sockets) from several
+threads, spreading the traffic over a growing number of active groups. Each
+configuration runs twice: once with the per-group locks, and once with every
+command serialized behind a single global lock, as the server used to do.
+
+Usage: python3 bench_locking.py [--threads N] [--members N] [--seconds S]
+"""
+
+import argparse
+import contextlib
+import io
+import threading
+import time
+
+from protocol import JSON_CODEC
+from server import BulletinBoardServer
+
+# Groups available for the benchmark traffic
+GROUP_IDS = ["tech", "sports", "music", "books", "movies", "public"]
+
+
+class NullConnection:
+    """Connection stand-in that discards everything queued on it"""
+
+    address = ("benchmark", 0)
+    codec = JSON_CODEC
+    digest = None
+
+    def send(self, data: bytes):
+        pass
+
+    def notify(self, data: bytes) -> bool:
+        return True
+
+    def close(self):
+        pass
+
+
+class GlobalLockServer(BulletinBoardServer):
+    """Server variant that serializes every command behind one lock"""
+
+    def __init__(self):
+        super().__init__()
+        self.global_lock = threading.Lock()
+
+    def process_command(self, username: str, command: str, request: dict):
+        with self.global_lock:
+            return super().process_command(username, command, request)
+
+
+def populate(server: BulletinBoardServer, group_ids: list, members: int):
+    """Register idle members in every active group so each post fans out"""
+    for group_id in group_ids:
+        for i in range(members):
+            username = f"{group_id}-member{i}"
+            server.register_client(username, NullConnection())
+            server.handle_group_join(username, group_id)
+
+
+def worker(server: BulletinBoardServer, username: str, group_id: str, stop: threading.Event, counts: list):
+    """Alternate posts and reads on one group until told to stop"""
+    server.register_client(username, NullConnection())
+    server.handle_group_join(username, group_id)
+
+    post = {"command": "GROUPPOST", "group_id": group_id, "subject": "bench", "content": "x" * 64}
+    users = {"command": "GROUPUSERS", "group_id": group_id}
+    read = {"command": "GROUPMESSAGE", "group_id": group_id, "msg_id": 1}
+
+    operations = 0
+    while not stop.is_set():
+        server.process_command(username, post["command"], post)
+        server.process_command(username, users["command"], users)
+        server.process_command(username, read["command"], read)
+        operations += 3
+    counts.append(operations)
+
+
+def measure(server_class, active_groups: int, threads: int, members: int, seconds: float):
+    """Return operations per second for one configuration"""
+    # Keep the server's connection log lines out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        return _measure(server_class, active_groups, threads, members, seconds)
+
+
+def _measure(server_class, active_groups: int, threads: int, members: int, seconds: float):
+    """Run one configuration and return its operations per second"""
+    server = server_class()
+    group_ids = GROUP_IDS[:active_groups]
+    populate(server, group_ids, members)
+
+    stop = threading.Event()
+    counts = []
+    workers = [
+        threading.Thread(
+            target=worker,
+            args=(server, f"worker{i}", group_ids[i % active_groups], stop, counts)
+        )
+        for i in range(threads)
+    ]
+
+    for t in workers:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in workers:
+        t.join()
+
+    return sum(counts) / seconds
+
+
+def main():
+    """Main benchmark entry point"""
+    parser = argparse.ArgumentParser(description="Measure throughput as active groups increase")
+    parser.add_argument("--threads", type=int, default=12, help="worker threads issuing commands")
+    parser.add_argument("--members", type=int, default=20, help="idle members per active group")
+    parser.add_argument("--seconds", type=float, default=2.0, help="duration of each run")
+    args = parser.parse_args()
+
+    print(f"{args.threads} threads, {args.members} members per group, {args.seconds}s per run\n")
+    print(f"{'Groups':>6} {'per-group ops/s':>16} {'global ops/s':>14} {'speedup':>8}")
+    print("-" * 48)
+    for active_groups in range(1, len(GROUP_IDS) + 1):
+        fine = measure(BulletinBoardServer, active_groups, args.threads, args.members, args.seconds)
+        coarse = measure(GlobalLockServer, active_groups, args.threads, args.members, args.seconds)
+        print(f"{active_groups:>6} {fine:>16.0f} {coarse:>14.0f} {fine / coarse:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Message memory benchmark
+
+Builds the same number of messages with the original Message layout (an
+instance __dict__, a preformatted date string and a private copy of every
+sender and group ID) and with the current compact Message, and reports the
+bytes per message each one costs. Subjects and contents are allocated
+before measuring, so the numbers are the per-message metadata overhead.
+
+Usage: python3 bench_memory.py [--messages N] [--senders N]
+"""
+
+import argparse
+import gc
+import tracemalloc
+from datetime import datetime
+
+from server import Message
+
+
+class LegacyMessage:
+    """The message layout used before messages were made compact"""
+
+    def __init__(self, msg_id: int, sender: str, subject: str, content: str, group_id: str = "public"):
+        self.msg_id = msg_id
+        self.sender = sender
+        self.subject = subject
+        self.content = content
+        self.post_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.group_id = group_id
+
+
+def bytes_per_message(message_class, count: int, senders: int, subjects: list, contents: list):
+    """Traced allocation per message for `count` messages of one class"""
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+
+    messages = []
+    for i in range(count):
+        # Fresh str objects, as if decoded from each incoming request
+        sender = "".join(["user", str(i % senders)])
+        group_id = "".join(["te", "ch"])
+        messages.append(message_class(i + 1, sender, subjects[i], contents[i], group_id))
+
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    del messages
+    return used / count
+
+
+def main():
+    """Main benchmark entry point"""
+    parser = argparse.ArgumentParser(description="Measure memory per stored message")
+    parser.add_argument("--messages", type=int, default=200000, help="messages to create")
+    parser.add_argument("--senders", type=int, default=500, help="distinct senders")
+    args = parser.parse_args()
+
+    subjects = [f"Subject line {i}" for i in range(args.messages)]
+    contents = [f"Message body {i}" for i in range(args.messages)]
+
+    before = bytes_per_message(LegacyMessage, args.messages, args.senders, subjects, contents)
+    after = bytes_per_message(Message, args.messages, args.senders, subjects, contents)
+
+    print(f"{args.messages} messages from {args.senders} senders "
+          f"(metadata only, excluding subject and content)\n")
+    print(f"{'Layout':<10} {'bytes/message':>14}")
+    print("-" * 25)
+    print(f"{'before':<10} {before:>14.1f}")
+    print(f"{'after':<10} {after:>14.1f}")
+    print(f"\nSaved {before - after:.1f} bytes per message ({(1 - after / before) * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for log replay and snapshots
+
+Fills a message log through an in-process server, then times starting a
+server from it by replaying the whole log and by loading a snapshot and
+replaying only the posts made after it, and checks that both starts agree.
+
+Usage: python3 bench_snapshot.py [--messages N] [--groups N] [--tail N] [--dir PATH]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from server import BulletinBoardServer
+from storage import MessageLog
+
+
+def start(path: str, data_dir: str = None):
+    """A server started from the log at path (printing nothing); returns (server, seconds)"""
+    began = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        server = BulletinBoardServer("localhost", 0, MessageLog(path, "none"), data_dir, snapshot_interval=0)
+    return server, time.perf_counter() - began
+
+
+def post(server: BulletinBoardServer, group_ids: list, count: int, first: int = 0):
+    """Post count messages spread over the groups"""
+    for i in range(first, first + count):
+        group = server.groups[group_ids[i % len(group_ids)]]
+        with group.lock:
+            group.add_message(f"user{i % 50}", f"subject {i}", f"message body number {i} " + "x" * 150)
+
+
+def main():
+    """Main benchmark entry point"""
+    parser = argparse.ArgumentParser(description="Measure startup with and without a snapshot")
+    parser.add_argument("--messages", type=int, default=200000, help="posts in the log")
+    parser.add_argument("--groups", type=int, default=100, help="groups the posts are spread over")
+    parser.add_argument("--tail", type=int, default=1000, help="posts made after the snapshot")
+    parser.add_argument("--dir", help="directory for the log (default: a temporary directory)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        path = os.path.join(directory, "boards.log")
+        server, _ = start(path)
+        group_ids = [f"room-{i}" for i in range(args.groups)]
+        with contextlib.redirect_stdout(io.StringIO()):
+            for group_id in group_ids:
+                server.handle_create_group("bench", group_id, group_id)
+        post(server, group_ids, args.messages)
+        server.log.close()
+        size = os.path.getsize(path)
+
+        server, full = start(path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            server.write_snapshot()
+        post(server, group_ids, args.tail, args.messages)
+        server.log.close()
+        expected = {group_id: [msg.content for msg in server.groups[group_id].iter_messages()]
+                    for group_id in group_ids[:5]}
+
+        server, snapshot = start(path)
+        for group_id, contents in expected.items():
+            assert [msg.content for msg in server.groups[group_id].iter_messages()] == contents
+        server.log.close()
+
+    print(f"{args.messages} posts in {args.groups} groups, {size / 2**20:.1f} MB of log, "
+          f"{args.tail} posts after the snapshot\n")
+    print(f"{'full replay (s)':<28} {full:>10.2f}")
+    print(f"{'snapshot + tail (s)':<28} {snapshot:>10.2f}")
+    print(f"{'speedup':<28} {full / snapshot:>10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
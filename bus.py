@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Bulletin Board Worker Bus
+Links the worker processes of a multi-process server (server.py --workers).
+
+Every worker keeps a full copy of the boards and serves its own share of
+the connections. Whatever a worker changes is sent over a Unix socket to
+the hub in the parent process, which puts the events of all workers in one
+order, writes them to the message log and passes them on:
+
+  post     the hub gives the message its group's next msg_id and sends it
+           to every worker, including the one waiting for that ID
+  create   a new group, or a group being deleted; sent to every worker,
+  delete   unless the ID is taken (or gone), when only the sender hears
+           "refused" (as it does for a post to a group that is gone)
+  join     a membership change, passed to the other workers
+  leave
+  notify   a notification for the group's members on the other workers
+  claim    reserves a username, so names stay unique across workers
+  release
+
+Workers apply each group's events in the order the hub sent them, so every
+copy agrees on msg_ids, members and member counts. Frames use the client
+protocol's length-prefixed JSON framing.
+"""
+
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Dict, Set
+
+from protocol import FrameError, FrameReader, encode_frame
+from storage import LogError
+
+
+class BusError(Exception):
+    """The hub went away"""
+
+
+class _Worker:
+    """The hub's end of one worker's socket"""
+
+    def __init__(self, sock, number: int, pid: int):
+        self.sock = sock
+        self.number = number
+        self.pid = pid
+        self.usernames: Set[str] = set()  # names claimed by this worker's clients
+        self.alive = True
+
+
+class BusHub:
+    """Orders the workers' events, logs them, and relays them to the workers
+
+    Each worker's socket is read by its own thread, and lock is held while an
+    event is handled and relayed, so the order the hub handles events in is
+    the order every worker receives them.
+    """
+
+    def __init__(self, counters: Dict[str, int], log=None):
+        self.counters = dict(counters)  # group_id -> last msg_id handed out, for every group
+        self.members: Dict[str, Set[str]] = {}  # group_id -> members, for logging out a lost worker
+        self.owners: Dict[str, _Worker] = {}  # username -> worker the user is connected to
+        self.workers = []
+        self.log = log
+        self.lock = threading.Lock()
+        self.logged = threading.Condition(self.lock)  # wakes the committer
+        self.synced = 0  # log position the workers have been told is durable
+
+    def add_worker(self, sock, number: int, pid: int):
+        """Take the hub's end of a forked worker's socket"""
+        self.workers.append(_Worker(sock, number, pid))
+
+    def close(self):
+        """Close every worker socket (a forked worker drops the ones it inherited)"""
+        for worker in self.workers:
+            worker.sock.close()
+
+    def start(self):
+        """Start reading the workers and, if the log syncs, committing it"""
+        for worker in self.workers:
+            reader = threading.Thread(target=self._serve, args=(worker,))
+            reader.daemon = True
+            reader.start()
+
+        if self.log and self.log.durability != "none":
+            committer = threading.Thread(target=self._commit_loop)
+            committer.daemon = True
+            committer.start()
+
+    def _serve(self, worker: _Worker):
+        """Handle one worker's events until its socket closes"""
+        reader = FrameReader(worker.sock)
+        try:
+            while True:
+                event = reader.read()
+                if event is None:
+                    break
+                with self.lock:
+                    self._handle(worker, event)
+        except ConnectionResetError:
+            pass  # the worker exited
+        except (OSError, FrameError) as e:
+            print(f"[SERVER] Error reading worker {worker.number}: {e}")
+        finally:
+            with self.lock:
+                self._drop(worker)
+
+    def _handle(self, worker: _Worker, event: dict):
+        """Apply one event to the hub's state and pass it on"""
+        op = event.get("op")
+
+        if op == "claim":
+            username = event["username"]
+            taken = username in self.owners
+            if not taken:
+                self.owners[username] = worker
+                worker.usernames.add(username)
+            self._send(worker, encode_frame({"op": "claimed", "ref": event["ref"], "ok": not taken}))
+
+        elif op == "release":
+            username = event["username"]
+            if self.owners.get(username) is worker:
+                del self.owners[username]
+                worker.usernames.discard(username)
+
+        elif op == "post":
+            group_id = event["group_id"]
+            if group_id not in self.counters:
+                self._send(worker, encode_frame({"op": "refused", "ref": event["ref"]}))
+                return
+            msg_id = self.counters[group_id] + 1
+            self.counters[group_id] = msg_id
+            record = {
+                "op": "post",
+                "group_id": group_id,
+                "msg_id": msg_id,
+                "sender": event["sender"],
+                "subject": event["subject"],
+                "content": event["content"],
+                "posted_at": int(time.time())
+            }
+            position = self._append(record)
+            self._relay(dict(record, ref=event["ref"], origin=worker.number, position=position))
+
+        elif op in ("join", "leave"):
+            members = self.members.setdefault(event["group_id"], set())
+            if op == "join":
+                members.add(event["username"])
+            else:
+                members.discard(event["username"])
+            record = {"op": op, "group_id": event["group_id"], "username": event["username"]}
+            position = self._append(record)
+            self._relay(dict(record, position=position), exclude=worker)
+
+        elif op in ("create", "delete"):
+            group_id = event["group_id"]
+            if (group_id in self.counters) == (op == "create"):
+                self._send(worker, encode_frame({"op": "refused", "ref": event["ref"]}))
+                return
+            if op == "create":
+                self.counters[group_id] = 0
+                record = {"op": op, "group_id": group_id, "name": event["name"], "creator": event["creator"]}
+            else:
+                del self.counters[group_id]
+                self.members.pop(group_id, None)
+                record = {"op": op, "group_id": group_id}
+            position = self._append(record)
+            self._relay(dict(record, ref=event["ref"], origin=worker.number, position=position))
+
+        elif op == "notify":
+            self._relay(event, exclude=worker)
+
+    def _append(self, record: dict) -> int:
+        """Log a record; returns its position in the log (0 without a log)"""
+        if not self.log:
+            return 0
+        self.log.append(record)
+        self.logged.notify()
+        return self.log.appended
+
+    def _send(self, worker: _Worker, frame: bytes):
+        """Write a frame to one worker (a worker that has gone is skipped)"""
+        if not worker.alive:
+            return
+        try:
+            worker.sock.sendall(frame)
+        except OSError:
+            worker.alive = False
+
+    def _relay(self, event: dict, exclude: _Worker = None):
+        """Send an event to every worker but exclude, encoding it once"""
+        frame = encode_frame(event)
+        for worker in self.workers:
+            if worker is not exclude:
+                self._send(worker, frame)
+
+    def _drop(self, worker: _Worker):
+        """Forget a worker whose socket closed, logging its users out of their groups"""
+        worker.alive = False
+        for username in worker.usernames:
+            del self.owners[username]
+            for group_id, members in self.members.items():
+                if username not in members:
+                    continue
+                members.discard(username)
+                record = {"op": "leave", "group_id": group_id, "username": username}
+                self._relay(dict(record, position=self._append(record)))
+                self._relay({"op": "notify", "group_id": group_id,
+                             "message": f"{username} has disconnected", "exclude": username})
+        worker.usernames.clear()
+
+    def _commit_loop(self):
+        """Make logged records durable in batches and tell the workers how far that got"""
+        while True:
+            with self.lock:
+                while self.synced >= self.log.appended:
+                    self.logged.wait()
+                target = self.log.appended
+
+            try:
+                self.log.sync()
+            except LogError as e:
+                with self.lock:
+                    self._relay({"op": "sync_failed", "message": str(e)})
+                return
+
+            with self.lock:
+                self.synced = target
+                self._relay({"op": "synced", "position": target})
+
+
+class BusClient:
+    """A worker's end of the bus
+
+    Stands in for the MessageLog in a worker: append() sends join and leave
+    records to the hub, and sync() waits until the hub has made every record
+    this worker has received durable. Events for a group are queued until
+    the server takes them, and ready(group_id) is called (on the reader
+    thread) whenever new ones arrive.
+    """
+
+    def __init__(self, sock, number: int, durability: str = "none", ready=None, lost=None):
+        self.sock = sock
+        self.number = number  # which worker this is
+        self.durability = durability  # of the hub's log; "none" without one
+        self.ready = ready
+        self.lost = lost  # called once if the hub goes away
+        self.send_lock = threading.Lock()
+        self.cond = threading.Condition()  # guards the state below
+        self.inbox: Dict[str, deque] = {}  # group_id -> events waiting to be applied
+        self.replies = {}  # ref -> the hub's answer to a claim, post, create or delete
+        self.refs = itertools.count(1)
+        self.appended = 0  # log position of the newest record received
+        self.synced = 0  # log position the hub has made durable
+        self.sync_error = None  # why the hub can no longer make records durable
+        self.closed = False
+        self.reader = None
+
+    def start(self):
+        """Start receiving events from the hub"""
+        self.reader = threading.Thread(target=self._read_loop)
+        self.reader.daemon = True
+        self.reader.start()
+
+    def claim(self, username: str) -> bool:
+        """Reserve a username across all workers; False if another client has it"""
+        return self._call({"op": "claim", "username": username})["ok"]
+
+    def release(self, username: str):
+        """Give a username back once its client has disconnected"""
+        self._send({"op": "release", "username": username})
+
+    def post(self, group_id: str, sender: str, subject: str, content: str) -> dict:
+        """Have the hub number a post; returns the post record, already queued in the inbox"""
+        return self._call({
+            "op": "post",
+            "group_id": group_id,
+            "sender": sender,
+            "subject": subject,
+            "content": content
+        })
+
+    def create(self, group_id: str, name: str, creator: str) -> bool:
+        """Have the hub create a group on every worker; False if the ID is taken"""
+        reply = self._call({"op": "create", "group_id": group_id, "name": name, "creator": creator})
+        return reply["op"] != "refused"
+
+    def delete(self, group_id: str) -> bool:
+        """Have the hub delete a group on every worker; False if it is already gone"""
+        return self._call({"op": "delete", "group_id": group_id})["op"] != "refused"
+
+    def append(self, record: dict):
+        """Send a join or leave record to the hub, to be logged and passed on"""
+        self._send(record)
+
+    def notify(self, group_id: str, message: str, exclude: str = None):
+        """Have the other workers notify their members of a group"""
+        self._send({"op": "notify", "group_id": group_id, "message": message, "exclude": exclude})
+
+    def take(self, group_id: str) -> list:
+        """Remove and return a group's queued events, oldest first"""
+        with self.cond:
+            events = self.inbox.pop(group_id, None)
+        return list(events) if events else []
+
+    def put_back(self, group_id: str, events: list):
+        """Return events taken but not applied to the front of a group's queue"""
+        if not events:
+            return
+        with self.cond:
+            self.inbox.setdefault(group_id, deque()).extendleft(reversed(events))
+
+    def sync(self):
+        """Block until every record received so far is durable in the hub's log (LogError if it cannot be)"""
+        if self.durability == "none":
+            return
+        with self.cond:
+            target = self.appended
+            while self.synced < target and not self.closed and self.sync_error is None:
+                self.cond.wait()
+            if self.synced < target and self.sync_error is not None:
+                raise LogError(self.sync_error)
+
+    def close(self):
+        """Disconnect from the hub"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.sock.close()
+
+    def _send(self, event: dict):
+        """Write one event to the hub"""
+        frame = encode_frame(event)
+        try:
+            with self.send_lock:
+                self.sock.sendall(frame)
+        except OSError as e:
+            raise BusError(f"Lost the connection to the worker hub: {e}")
+
+    def _call(self, request: dict) -> dict:
+        """Send a request and wait for the hub's answer"""
+        ref = next(self.refs)
+        request["ref"] = ref
+        self._send(request)
+        with self.cond:
+            while ref not in self.replies:
+                if self.closed:
+                    raise BusError("Lost the connection to the worker hub")
+                self.cond.wait()
+            return self.replies.pop(ref)
+
+    def _read_loop(self):
+        """Queue events from the hub, answer waiting calls, and report ready groups"""
+        reader = FrameReader(self.sock)
+        try:
+            while True:
+                event = reader.read()
+                if event is None:
+                    break
+
+                op = event.get("op")
+                with self.cond:
+                    if op in ("claimed", "refused"):
+                        self.replies[event["ref"]] = event
+                    elif op == "synced":
+                        self.synced = event["position"]
+                    elif op == "sync_failed":
+                        self.sync_error = event["message"]
+                    else:
+                        self.inbox.setdefault(event["group_id"], deque()).append(event)
+                        self.appended = max(self.appended, event.get("position", 0))
+                        if op in ("post", "create", "delete") and event["origin"] == self.number:
+                            self.replies[event["ref"]] = event
+                    self.cond.notify_all()
+
+                if op not in ("claimed", "refused", "synced", "sync_failed") and self.ready:
+                    self.ready(event["group_id"])
+        except (OSError, FrameError):
+            pass
+
+        with self.cond:
+            was_closed = self.closed
+            self.closed = True
+            self.cond.notify_all()
+        if not was_closed and self.lost:
+            self.lost()
@@ -5,45 +5,93 @@ A client implementation for connecting to the bulletin board server
 and interacting with the message board system.
 """
 
+import itertools
+import queue
 import socket
-import json
 import threading
 import sys
+from concurrent.futures import Future
+from typing import Dict, Union
+
+from protocol import (
+    CODECS, COMPRESSION_METHODS, JSON_CODEC, REQUEST_ID, FrameCompressor, FrameReader,
+    encode_frame, send_frame
+)
+
+# Response delivered to waiting commands when the connection drops
+CONNECTION_ERROR = {"status": "ERROR", "message": "Connection error"}
 
 
 class BulletinBoardClient:
-    """Main bulletin board client class"""
+    """Main bulletin board client class
+
+    A single listener thread reads every frame from the server. Responses
+    are matched to their request by request ID and resolve the Future
+    returned by send_command_async(), or feed the iterator returned by
+    stream_command() for streamed responses; notifications go to
+    notification_handler. Any number of commands may be in flight at once.
+
+    codecs lists the wire codecs to offer at REGISTER, most preferred first;
+    the server picks one (servers that predate codecs always use JSON). With
+    compress set, zlib compression of large frames is offered as well.
+    """
 
-    def __init__(self):
+    def __init__(self, notification_handler=None, codecs=("binary", "json"), compress=True):
         self.socket = None
+        self.reader = None
+        self.codecs = list(codecs)
+        self.codec = JSON_CODEC
+        self.compress = compress
+        self.compressor = None  # used under send_lock, so frames are compressed in send order
         self.username = None
         self.connected = False
         self.running = True
+        self.notification_handler = notification_handler or self._print_notification
+
+        # request_id -> Future waiting for the response, or Queue collecting a stream
+        self.pending: Dict[int, Union[Future, queue.Queue]] = {}
+        self.pending_lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.request_ids = itertools.count(1)
 
     def connect(self, host: str, port: int, username: str):
         """Connect to the bulletin board server"""
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((host, port))
+            # Pipelined requests are small; don't let Nagle hold them back
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.reader = FrameReader(self.socket)
             self.username = username
 
             # Register with the server
             request = {
                 "command": "REGISTER",
-                "username": username
+                "username": username,
+                "codecs": self.codecs
             }
-            self.socket.send(json.dumps(request).encode('utf-8'))
+            if self.compress:
+                request["compression"] = list(COMPRESSION_METHODS)
+            send_frame(self.socket, request)
 
-            # Wait for response
-            response = self._receive_response()
+            # Wait for response (the listener thread is not running yet)
+            response = self.reader.read()
+            if response is None:
+                raise ConnectionError("Server closed the connection")
 
             if response.get("status") == "SUCCESS":
+                # Every later frame uses the codec the server picked
+                self.codec = CODECS.get(response.get("codec"), JSON_CODEC)
+                self.reader.codec = self.codec
+                if response.get("compression") in COMPRESSION_METHODS:
+                    self.reader.decoder.enable_decompression()
+                    self.compressor = FrameCompressor()
                 self.connected = True
                 print(f"\n{response.get('message')}")
                 print("Type 'help' for a list of available commands.\n")
 
-                # Start listening for notifications in a separate thread
-                listener_thread = threading.Thread(target=self._listen_for_notifications)
+                # Start listening for responses and notifications in a separate thread
+                listener_thread = threading.Thread(target=self._listen)
                 listener_thread.daemon = True
                 listener_thread.start()
 
@@ -57,28 +105,46 @@ class BulletinBoardClient:
             print(f"\nError connecting to server: {e}")
             return False
 
-    def _receive_response(self):
-        """Receive a response from the server"""
-        try:
-            data = self.socket.recv(4096).decode('utf-8')
-            return json.loads(data)
-        except Exception as e:
-            print(f"\nError receiving response: {e}")
-            return {"status": "ERROR", "message": "Connection error"}
+    def _print_notification(self, message: dict):
+        """Default notification handler: print it and redraw the prompt
+
+        Notifications that arrived close together come as one frame listing
+        them all in "messages"; a digest is labelled as such.
+        """
+        events = message.get("messages") or [message.get("message")]
+        if message.get("digest"):
+            print(f"\n[DIGEST] {len(events)} notification(s):")
+            for event in events:
+                print(f"  {event}")
+        else:
+            print()
+            for event in events:
+                print(f"[NOTIFICATION] {event}")
+        print(f"{self.username}> ", end="", flush=True)
 
-    def _listen_for_notifications(self):
-        """Listen for notifications from the server"""
+    def _listen(self):
+        """Read every frame from the server and route it to its destination"""
         while self.running and self.connected:
             try:
-                data = self.socket.recv(4096).decode('utf-8')
-                if not data:
-                    break
-
-                message = json.loads(data)
+                message = self.reader.read()
+                if message is None:
+                    raise ConnectionError("Server closed the connection")
 
                 if message.get("type") == "NOTIFICATION":
-                    print(f"\n[NOTIFICATION] {message.get('message')}")
-                    print(f"{self.username}> ", end="", flush=True)
+                    self.notification_handler(message)
+                    continue
+
+                request_id = message.get(REQUEST_ID)
+                with self.pending_lock:
+                    waiter = self.pending.get(request_id)
+                    # A stream stays registered until its last frame ("more" false)
+                    if isinstance(waiter, Future) or (waiter is not None and not message.get("more")):
+                        del self.pending[request_id]
+
+                if isinstance(waiter, Future):
+                    waiter.set_result(message)
+                elif waiter is not None:
+                    waiter.put(message)
 
             except Exception as e:
                 if self.running:
@@ -86,21 +152,92 @@ class BulletinBoardClient:
                     self.connected = False
                 break
 
-    def send_command(self, command: str, **kwargs):
-        """Send a command to the server"""
+        self._fail_pending()
+
+    def _fail_pending(self):
+        """Resolve every outstanding request with a connection error"""
+        with self.pending_lock:
+            waiting = list(self.pending.values())
+            self.pending.clear()
+        for waiter in waiting:
+            self._resolve(waiter, dict(CONNECTION_ERROR))
+
+    @staticmethod
+    def _resolve(waiter, message: dict):
+        """Deliver a final message to a Future or stream queue"""
+        if isinstance(waiter, Future):
+            waiter.set_result(message)
+        else:
+            waiter.put(message)
+
+    def _send_request(self, command: str, waiter, kwargs: dict):
+        """Register a waiter under a new request ID and send the request"""
         if not self.connected:
-            print("Error: Not connected to server. Use %connect first.")
+            self._resolve(waiter, {"status": "ERROR", "message": "Not connected to server"})
             return
 
-        request = {"command": command, **kwargs}
+        request_id = next(self.request_ids)
+        request = {"command": command, REQUEST_ID: request_id, **kwargs}
+
+        with self.pending_lock:
+            self.pending[request_id] = waiter
 
         try:
-            self.socket.send(json.dumps(request).encode('utf-8'))
-            response = self._receive_response()
-            return response
+            frame = encode_frame(request, self.codec)
+            with self.send_lock:
+                if self.compressor is not None:
+                    frame = self.compressor.compress(frame)
+                self.socket.sendall(frame)
         except Exception as e:
             print(f"Error sending command: {e}")
-            return {"status": "ERROR", "message": "Connection error"}
+            with self.pending_lock:
+                self.pending.pop(request_id, None)
+            self._resolve(waiter, dict(CONNECTION_ERROR))
+
+        # The listener may have exited while the request was being sent
+        if not self.connected:
+            self._fail_pending()
+
+    def send_command_async(self, command: str, **kwargs) -> Future:
+        """Send a command without waiting; the Future resolves to its response"""
+        future = Future()
+        self._send_request(command, future, kwargs)
+        return future
+
+    def stream_command(self, command: str, **kwargs):
+        """Send a command whose response is streamed, yielding each frame as it arrives"""
+        frames = queue.Queue()
+        self._send_request(command, frames, {**kwargs, "stream": True})
+        while True:
+            message = frames.get()
+            yield message
+            if not message.get("more"):
+                return
+
+    def send_command(self, command: str, **kwargs):
+        """Send a command to the server and wait for its response"""
+        if not self.connected:
+            print("Error: Not connected to server. Use %connect first.")
+            return
+
+        return self.send_command_async(command, **kwargs).result()
+
+    def send_batch(self, commands: list):
+        """Send several commands in one round trip and wait for all of their responses
+
+        commands is a list of (command, arguments) pairs, e.g.
+        [("GROUPJOIN", {"group_id": "tech"}), ("GROUPUSERS", {"group_id": "tech"})].
+        The server runs them in order and the responses come back in the
+        same order; if the batch itself is rejected, every command gets that error.
+        """
+        response = self.send_command(
+            "BATCH", commands=[{**arguments, "command": command} for command, arguments in commands]
+        )
+        if response is None:
+            return None
+        if response.get("status") != "SUCCESS" or "results" not in response:
+            return [response] * len(commands)
+        return response["results"]
 
     def cmd_join(self, args):
         """Join the public message board"""
@@ -187,16 +324,59 @@ class BulletinBoardClient:
             print(f"\nError: {response.get('message')}")
 
     def cmd_groups(self, args):
-        """Retrieve list of all available groups"""
-        response = self.send_command("GROUPS")
+        """Retrieve a page of the available groups"""
+        prefix = None
+        cursor = {}
+        for arg in args:
+            if arg.startswith("after="):
+                cursor["after"] = arg[len("after="):]
+            elif prefix is None:
+                prefix = arg
+            else:
+                print("Usage: %groups [prefix] [after=<group_id>]")
+                return
+        if prefix is not None:
+            cursor["prefix"] = prefix
+
+        response = self.send_command("GROUPS", **cursor)
 
         if response.get("status") == "SUCCESS":
             groups = response.get("groups", [])
-            print(f"\nAvailable groups ({len(groups)} total):")
+            print(f"\nAvailable groups ({len(groups)} shown):")
             print(f"{'ID':<15} {'Name':<30} {'Members':<10}")
             print(f"{'-'*55}")
             for group in groups:
                 print(f"{group['group_id']:<15} {group['name']:<30} {group['member_count']:<10}")
+
+            if response.get("more"):
+                next_page = f"after={groups[-1]['group_id']}"
+                print(f"\nMore available: %groups {prefix + ' ' if prefix else ''}{next_page}")
+        else:
+            print(f"\nError: {response.get('message')}")
+
+    def cmd_creategroup(self, args):
+        """Create a new group"""
+        if len(args) < 2:
+            print("Usage: %creategroup <group_id> <name...>")
+            return
+
+        response = self.send_command("CREATEGROUP", group_id=args[0], name=" ".join(args[1:]))
+
+        if response.get("status") == "SUCCESS":
+            print(f"\n{response.get('message')} (join it with %groupjoin {response.get('group_id')})")
+        else:
+            print(f"\nError: {response.get('message')}")
+
+    def cmd_deletegroup(self, args):
+        """Delete a group this user created"""
+        if len(args) < 1:
+            print("Usage: %deletegroup <group_id>")
+            return
+
+        response = self.send_command("DELETEGROUP", group_id=args[0])
+
+        if response.get("status") == "SUCCESS":
+            print(f"\n{response.get('message')}")
         else:
             print(f"\nError: {response.get('message')}")
 
@@ -302,6 +482,184 @@ class BulletinBoardClient:
         else:
             print(f"\nError: {response.get('message')}")
 
+    def cmd_history(self, args):
+        """Retrieve a page of message headers from a group"""
+        group_id = "public"
+        limit = None
+        cursor = {}
+
+        for arg in args:
+            if "=" in arg:
+                key, _, value = arg.partition("=")
+                if key not in ("before", "since") or not value.isdigit():
+                    print("Usage: %history [group_id] [limit] [before=<id> | since=<id>]")
+                    return
+                cursor[f"{key}_id"] = int(value)
+            elif arg.isdigit():
+                limit = int(arg)
+            else:
+                group_id = arg
+
+        if limit is not None:
+            cursor["limit"] = limit
+
+        response = self.send_command("GROUPHISTORY", group_id=group_id, **cursor)
+
+        if response.get("status") == "SUCCESS":
+            messages = response.get("messages", [])
+            if not messages:
+                print(f"\nNo messages in this range of '{group_id}'.")
+                return
+
+            print(f"\nMessages in '{group_id}' ({len(messages)} shown):")
+            for msg in messages:
+                print(f"  [{msg['msg_id']}] {msg['sender']} | {msg['post_date']} | {msg['subject']}")
+
+            if response.get("more"):
+                if "since_id" in cursor:
+                    next_page = f"since={messages[-1]['msg_id']}"
+                else:
+                    next_page = f"before={messages[0]['msg_id']}"
+                print(f"\nMore available: %history {group_id} {len(messages)} {next_page}")
+        else:
+            print(f"\nError: {response.get('message')}")
+
+    def cmd_search(self, args):
+        """Search a group's subjects and bodies"""
+        if len(args) < 2:
+            print("Usage: %search <group_id> <words...> [before=<id>]")
+            return
+
+        group_id = args[0]
+        words = []
+        cursor = {}
+        for arg in args[1:]:
+            if arg.startswith("before=") and arg[len("before="):].isdigit():
+                cursor["before_id"] = int(arg[len("before="):])
+            else:
+                words.append(arg)
+
+        query = " ".join(words)
+        response = self.send_command("GROUPSEARCH", group_id=group_id, query=query, **cursor)
+
+        if response.get("status") == "SUCCESS":
+            messages = response.get("messages", [])
+            if not messages:
+                print(f"\nNo messages in '{group_id}' match '{query}'.")
+                return
+
+            print(f"\nMatches in '{group_id}', newest first ({len(messages)} shown):")
+            for msg in messages:
+                print(f"  [{msg['msg_id']}] {msg['sender']} | {msg['post_date']} | {msg['subject']}")
+
+            if response.get("more"):
+                print(f"\nMore available: %search {group_id} {query} before={messages[-1]['msg_id']}")
+        else:
+            print(f"\nError: {response.get('message')}")
+
+    def cmd_digest(self, args):
+        """Receive notifications as a periodic digest, or turn the digest off"""
+        if len(args) != 1:
+            print("Usage: %digest <seconds | off>")
+            return
+
+        interval = 0 if args[0] == "off" else args[0]
+        response = self.send_command("DIGEST", interval=interval)
+
+        if response.get("status") == "SUCCESS":
+            print(f"\n{response.get('message')}")
+        else:
+            print(f"\nError: {response.get('message')}")
+
+    def cmd_lag(self, args):
+        """Show how far behind this client is in reading what the server sends"""
+        response = self.send_command("LAG")
+
+        if response.get("status") == "SUCCESS":
+            lag = response["lag"]
+            print(f"\n{lag['queued_bytes']} bytes ({lag['queued_frames']} frames) waiting, "
+                  f"behind for {lag['lag_seconds']}s, peak {lag['peak_bytes']} bytes, "
+                  f"{lag['dropped']} notification(s) dropped ({lag['policy']})")
+        else:
+            print(f"\nError: {response.get('message')}")
+
+    def cmd_replication(self, args):
+        """Show whether the server is a primary or a replica, and how far behind its replicas are"""
+        response = self.send_command("REPLICATION")
+
+        if response.get("status") != "SUCCESS":
+            print(f"\nError: {response.get('message')}")
+            return
+
+        report = response["replication"]
+        if report["role"] == "follower":
+            state = "connected" if report["connected"] else "disconnected"
+            print(f"\nRead-only replica of {report['primary_server'] or report['primary']} ({state}): "
+                  f"{report['lag_bytes']} bytes behind, last caught up {report['lag_seconds']}s ago")
+        elif report["role"] == "primary":
+            print(f"\nPrimary, log at byte {report['position']}, {len(report['followers'])} replica(s)")
+            for follower in report["followers"]:
+                print(f"  {follower['address']:<22} {follower['lag_bytes']} bytes behind")
+        else:
+            print("\nNot replicated")
+
+    def cmd_stats(self, args):
+        """Show the server's metrics (administrators only)"""
+        response = self.send_command("STATS")
+
+        if response.get("status") != "SUCCESS":
+            print(f"\nError: {response.get('message')}")
+            return
+
+        stats = response["stats"]
+        print(f"\nUp {stats.get('bulletin_uptime_seconds', 0):.0f}s, "
+              f"{stats.get('bulletin_connections', 0)} connection(s), {stats.get('bulletin_groups', 0)} group(s), "
+              f"{stats.get('bulletin_outbound_queued_bytes', 0)} bytes queued, "
+              f"{stats.get('bulletin_outbound_dropped', 0)} notification(s) dropped")
+
+        errors = stats.get("bulletin_command_errors_total", {})
+        print(f"\n{'Command':<14} {'count':>8} {'errors':>7} {'mean ms':>8} {'p50 ms':>8} {'p99 ms':>8}")
+        for command, row in stats.get("bulletin_command_seconds", {}).items():
+            print(f"{command:<14} {row['count']:>8} {errors.get(command, 0):>7} {row['mean'] * 1000:>8.3f} "
+                  f"{row['p50'] * 1000:>8.3f} {row['p99'] * 1000:>8.3f}")
+
+        holds = stats.get("bulletin_lock_hold_seconds", {})
+        print(f"\n{'Lock':<14} {'acquired':>8} {'wait p99 ms':>12} {'hold p99 ms':>12}")
+        for lock, row in stats.get("bulletin_lock_wait_seconds", {}).items():
+            hold = holds.get(lock, {}).get("p99", 0)
+            print(f"{lock:<14} {row['count']:>8} {row['p99'] * 1000:>12.3f} {hold * 1000:>12.3f}")
+
+        fanout = stats.get("bulletin_fanout_recipients")
+        if fanout:
+            seconds = stats.get("bulletin_fanout_seconds", {})
+            print(f"\nFan-out: {fanout['count']} notification(s), {fanout['mean']:.1f} recipients on average, "
+                  f"p99 {seconds.get('p99', 0) * 1000:.3f} ms")
+
+    def cmd_profile(self, args):
+        """Start, stop or check a profile of the server's commands (administrators only)"""
+        if not args or args[0] not in ("start", "stop", "status") or (args[0] != "start" and len(args) > 1) \
+                or len(args) > 3:
+            print("Usage: %profile start [seconds] [requests] | stop | status")
+            return
+
+        kwargs = {"action": args[0]}
+        if len(args) > 1:
+            kwargs["duration"] = args[1]
+        if len(args) > 2:
+            kwargs["requests"] = args[2]
+        response = self.send_command("PROFILE", **kwargs)
+
+        if response.get("status") != "SUCCESS":
+            print(f"\nError: {response.get('message')}")
+        elif args[0] == "status":
+            if response.get("profiling"):
+                print(f"\nProfiling: {response['requests']} request(s) so far, "
+                      f"{response['remaining_seconds']}s left")
+            else:
+                print("\nNot profiling")
+        else:
+            print(f"\n{response.get('message')}; report: {response.get('path')}")
+
     def cmd_help(self, args):
         """Display help information"""
         print("\n" + "="*60)
@@ -317,7 +675,11 @@ class BulletinBoardClient:
         print("  %leave                    - Leave the public group")
         print("  %message <id>             - Retrieve a message by ID")
         print("\nPart 2 - Private Groups Commands:")
-        print("  %groups                   - List all available groups")
+        print("  %groups [prefix] [after=<group_id>]")
+        print("                            - List a page of groups, optionally by ID prefix")
+        print("  %creategroup <group_id> <name...>")
+        print("                            - Create a new group")
+        print("  %deletegroup <group_id>   - Delete a group you created")
         print("  %groupjoin <group_id>     - Join a specific group")
         print("  %grouppost <group_id> <subject> <content>")
         print("                            - Post a message to a group")
@@ -325,7 +687,17 @@ class BulletinBoardClient:
         print("  %groupleave <group_id>    - Leave a specific group")
         print("  %groupmessage <group_id> <id>")
         print("                            - Retrieve a message from a group")
+        print("  %history [group_id] [limit] [before=<id> | since=<id>]")
+        print("                            - List a page of messages (default: newest, public)")
+        print("  %search <group_id> <words...> [before=<id>]")
+        print("                            - Find messages containing every word (word* = prefix)")
         print("\nOther Commands:")
+        print("  %digest <seconds | off>   - Get notifications as a periodic digest")
+        print("  %lag                      - Show how far behind the server this client is")
+        print("  %replication              - Show the server's replication role and lag")
+        print("  %stats                    - Show server metrics (administrators only)")
+        print("  %profile start [seconds] [requests] | stop | status")
+        print("                            - Profile the server's commands (administrators only)")
         print("  help                      - Display this help message")
         print("="*60 + "\n")
 
@@ -393,6 +765,10 @@ class BulletinBoardClient:
                     self.cmd_message(args)
                 elif command == "%groups":
                     self.cmd_groups(args)
+                elif command == "%creategroup":
+                    self.cmd_creategroup(args)
+                elif command == "%deletegroup":
+                    self.cmd_deletegroup(args)
                 elif command == "%groupjoin":
                     self.cmd_groupjoin(args)
                 elif command == "%grouppost":
@@ -403,6 +779,20 @@ class BulletinBoardClient:
                     self.cmd_groupleave(args)
                 elif command == "%groupmessage":
                     self.cmd_groupmessage(args)
+                elif command == "%history":
+                    self.cmd_history(args)
+                elif command == "%search":
+                    self.cmd_search(args)
+                elif command == "%digest":
+                    self.cmd_digest(args)
+                elif command == "%lag":
+                    self.cmd_lag(args)
+                elif command == "%replication":
+                    self.cmd_replication(args)
+                elif command == "%stats":
+                    self.cmd_stats(args)
+                elif command == "%profile":
+                    self.cmd_profile(args)
                 elif command == "%exit":
                     self.cmd_exit(args)
                 else:
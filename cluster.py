@@ -0,0 +1,664 @@
+#!/usr/bin/env python3
+"""
+Bulletin Board Cluster
+Spreads the groups over several server nodes (server.py --cluster-port).
+
+Every group is owned by one node, chosen by consistent hashing of its
+group_id over the nodes in the cluster. The owner keeps the group's
+messages and members and hands out its msg_ids, so each group's order is
+decided in one place. A node forwards the group commands of its own clients
+to the owner. The owner treats the user as a RemoteClient, and sends that
+user's notifications back to the node they are connected to. Usernames are
+reserved the same way, on the node that owns "user:<name>".
+
+Nodes talk over their cluster port using the client protocol's
+length-prefixed JSON framing. A new node joins through any member (--join).
+A node shutting down leaves the cluster and hands its groups on. Each
+change of members is a new view: every node switches to the new ring and
+hands over the groups and usernames that moved away from it. A node holds
+commands for a group moving to it until the handoff of that group arrives.
+Only the nodes losing or gaining groups pause, and only for those groups.
+Change the members one node at a time.
+"""
+
+import bisect
+import hashlib
+import itertools
+import socket
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Set
+
+from protocol import HEADER, JSON_CODEC, REQUEST_ID, FrameError, FrameReader, decode_payload, encode_frame
+
+# Points each node gets on the hash ring; more spread groups more evenly
+VIRTUAL_NODES = 64
+
+# Seconds a node waits for a group being handed to it before giving up on a command
+HANDOFF_TIMEOUT = 10
+
+# Messages per frame when handing a group to another node
+HANDOFF_CHUNK = 1000
+
+# Seconds to wait for another node to answer a request
+PEER_TIMEOUT = 30
+
+# Times a command may be forwarded while ownership is moving before it fails
+MAX_HOPS = 3
+
+# Threads answering requests from other nodes
+PEER_THREADS = 16
+
+# Bytes of relayed notifications queued for a node before more are dropped
+PEER_BUFFER_BYTES = 16 * 1024 * 1024
+
+
+class ClusterError(Exception):
+    """Another node could not be reached, or did not answer in time"""
+
+
+def _hash(key: str) -> int:
+    """Position of a key on the ring"""
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring: maps keys to nodes, moving few keys when nodes change"""
+
+    def __init__(self, nodes=(), replicas: int = VIRTUAL_NODES):
+        self.nodes = sorted(set(nodes))
+        points = sorted((_hash(f"{node}#{index}"), node) for node in self.nodes for index in range(replicas))
+        self.points = [point for point, _ in points]
+        self.owners = [node for _, node in points]
+
+    def owner(self, key: str):
+        """Node that owns a key (None on an empty ring)"""
+        return self._owner_at(_hash(key))
+
+    def _owner_at(self, point: int):
+        """Node owning the first ring point at or after point, wrapping around"""
+        if not self.points:
+            return None
+        index = bisect.bisect_left(self.points, point)
+        return self.owners[index % len(self.owners)]
+
+    def moves(self, other: "HashRing") -> Set[tuple]:
+        """(from, to) node pairs between which keys change hands going from this ring to other
+
+        Ownership only changes at the points of either ring, so checking both
+        rings at every such point finds every move.
+        """
+        moves = set()
+        for point in set(self.points) | set(other.points):
+            before, after = self._owner_at(point), other._owner_at(point)
+            if before is not None and after is not None and before != after:
+                moves.add((before, after))
+        return moves
+
+
+class RemoteClient:
+    """Stands in for a user connected to another node, on a node that owns one of their groups
+
+    Registered in the owner's clients like a local connection, so the
+    handlers work unchanged. Notifications queued on it are passed to the
+    user's own node, which sends them with the client's codec and buffer.
+    """
+
+    codec = JSON_CODEC
+
+    def __init__(self, cluster: "ClusterNode", node: str, username: str):
+        self.cluster = cluster
+        self.node = node  # the node the user is connected to
+        self.username = username
+        self.digest = None  # the client's digest interval, copied from each forwarded command
+
+    @property
+    def address(self):
+        return f"{self.username} via {self.node}"
+
+    def send(self, data: bytes):
+        self.notify(data)
+
+    def notify(self, data: bytes) -> bool:
+        return self.cluster.deliver(self.node, self.username, decode_payload(data[HEADER.size:]))
+
+    def lag(self) -> dict:
+        """Frames are not buffered here; the user's own node reports their lag"""
+        return {
+            "queued_bytes": 0,
+            "queued_frames": 0,
+            "lag_seconds": 0.0,
+            "peak_bytes": 0,
+            "dropped": 0,
+            "policy": f"relayed to {self.node}"
+        }
+
+    def close(self):
+        pass
+
+
+class PeerLink:
+    """Connection to another node's cluster port, shared by every request to it
+
+    Requests carry a request_id so their answers can come back in any order.
+    A broken connection fails the requests waiting on it, and the next
+    request opens a new one.
+
+    Every message is queued for the link's writer thread, so messages go out
+    in the order they were sent and no sender waits on a slow node. Relayed
+    notifications are dropped once PEER_BUFFER_BYTES of them are queued;
+    requests and the other messages are always kept.
+    """
+
+    def __init__(self, address: str):
+        self.address = address
+        self.sock = None
+        self.send_lock = threading.Lock()  # guards sock
+        self.cond = threading.Condition()  # guards the state below
+        self.replies = {}  # request_id -> answer (None if the connection broke first)
+        self.waiting = set()  # request_ids sent on the current connection
+        self.ids = itertools.count(1)
+
+        self.outbound_cond = threading.Condition()  # guards the outbound queue
+        self.outbound = deque()  # frames waiting for the writer
+        self.queued_bytes = 0  # bytes of droppable frames in outbound
+        self.lagging = False  # dropping since the queue last drained
+
+        writer = threading.Thread(target=self._write_loop)
+        writer.daemon = True
+        writer.start()
+
+    def send(self, message: dict, droppable: bool = False) -> bool:
+        """Queue one message without waiting; returns False if it was dropped
+
+        A droppable message (a relayed notification) is dropped while the
+        node is PEER_BUFFER_BYTES behind.
+        """
+        frame = encode_frame(message)
+        with self.outbound_cond:
+            if droppable:
+                if self.queued_bytes + len(frame) > PEER_BUFFER_BYTES:
+                    if not self.lagging:
+                        self.lagging = True
+                        print(f"[SERVER] Node {self.address} is not keeping up "
+                              f"({self.queued_bytes} bytes queued), dropping notifications")
+                    return False
+                self.queued_bytes += len(frame)
+            self.outbound.append(frame)
+            self.outbound_cond.notify()
+        return True
+
+    def _write_loop(self):
+        """Write queued frames, as many as have accumulated in one send, connecting first if needed"""
+        while True:
+            with self.outbound_cond:
+                while not self.outbound:
+                    self.outbound_cond.wait()
+                batch = list(self.outbound)
+                self.outbound.clear()
+                self.queued_bytes = 0
+                self.lagging = False
+
+            with self.send_lock:
+                try:
+                    if self.sock is None:
+                        self._connect()
+                    self.sock.sendall(batch[0] if len(batch) == 1 else b"".join(batch))
+                    continue
+                except OSError as e:
+                    self._close()
+                    print(f"[SERVER] Node {self.address} is unreachable: {e}")
+            self._fail_waiting()
+
+    def call(self, message: dict, timeout: float = PEER_TIMEOUT) -> dict:
+        """Send a request and wait for the answer"""
+        request_id = next(self.ids)
+        message[REQUEST_ID] = request_id
+        with self.cond:
+            self.waiting.add(request_id)
+        try:
+            self.send(message)
+            with self.cond:
+                if not self.cond.wait_for(lambda: request_id in self.replies, timeout):
+                    raise ClusterError(f"Node {self.address} did not answer")
+                reply = self.replies.pop(request_id)
+        finally:
+            with self.cond:
+                self.waiting.discard(request_id)
+                self.replies.pop(request_id, None)
+        if reply is None:
+            raise ClusterError(f"Lost the connection to node {self.address}")
+        return reply
+
+    def _connect(self):
+        """Open the connection and start reading answers from it (send_lock held)"""
+        host, port = self.address.rsplit(":", 1)
+        sock = socket.create_connection((host, int(port)), timeout=PEER_TIMEOUT)
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        reader = threading.Thread(target=self._read_loop, args=(sock,))
+        reader.daemon = True
+        reader.start()
+
+    def _close(self):
+        """Drop a broken connection (send_lock held)"""
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def _read_loop(self, sock):
+        """Hand each answer to the request waiting for it"""
+        reader = FrameReader(sock)
+        try:
+            while True:
+                reply = reader.read()
+                if reply is None:
+                    break
+                with self.cond:
+                    if reply.get(REQUEST_ID) in self.waiting:
+                        self.replies[reply[REQUEST_ID]] = reply
+                        self.cond.notify_all()
+        except (OSError, FrameError):
+            pass
+
+        with self.send_lock:
+            if self.sock is sock:
+                self._close()
+        self._fail_waiting()
+
+    def _fail_waiting(self):
+        """Answer every waiting request with None: its connection broke"""
+        with self.cond:
+            for request_id in self.waiting:
+                self.replies.setdefault(request_id, None)
+            self.cond.notify_all()
+
+
+class ClusterNode:
+    """This server's membership of the cluster
+
+    cond guards the view (members, ring, epoch), the usernames reserved
+    here, and the bookkeeping that lets a view change wait for commands
+    already running on this node's groups.
+    """
+
+    def __init__(self, server, host: str, port: int):
+        self.server = server
+        self.host = host
+        self.port = port
+        self.address = f"{host}:{port}"
+        self.listener = None
+        self.links: Dict[str, PeerLink] = {}
+        self.links_lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(PEER_THREADS, thread_name_prefix="cluster")
+
+        self.cond = threading.Condition()
+        self.members = []
+        self.epoch = 0
+        self.ring = HashRing()
+        self.previous_ring = HashRing()  # the ring before the latest view change
+        self.awaiting: Set[str] = set()  # nodes whose handoff to this node has not finished
+        self.handed_over: Set[tuple] = set()  # (node, epoch) of handoffs already finished
+        self.changing = False  # a view change is waiting for running commands
+        self.running = 0  # group commands running on this node's groups
+        self.claims: Dict[str, str] = {}  # username -> node it is connected to, for names owned here
+        self.view_lock = threading.Lock()  # one view change at a time
+        self.adopting: Dict[tuple, list] = {}  # (node, group_id) -> message records handed over so far
+
+    # ---- Joining and leaving ----
+
+    def start(self, seed: str = None):
+        """Listen for other nodes, then join the cluster through seed (or start a new one)"""
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((self.host, self.port))
+        self.listener.listen()
+        acceptor = threading.Thread(target=self._accept_loop)
+        acceptor.daemon = True
+        acceptor.start()
+
+        if seed is None:
+            self._apply_view([self.address], 1, previous=[])
+            return
+
+        view = self._link(seed).call({"op": "join", "address": self.address})
+        print(f"[SERVER] Joined the cluster through {seed}")
+        self._apply_view(view["members"], view["epoch"], previous=view["previous"])
+
+    def leave(self):
+        """Hand this node's groups and usernames to the other nodes and leave the cluster"""
+        with self.cond:
+            if self.address not in self.members:
+                return
+            members = [node for node in self.members if node != self.address]
+            epoch = self.epoch + 1
+        for node in members:
+            try:
+                self._link(node).call({"op": "view", "members": members, "epoch": epoch})
+            except ClusterError as e:
+                print(f"[SERVER] Could not tell {node} this node is leaving: {e}")
+        if members:
+            self._apply_view(members, epoch)
+        print("[SERVER] Left the cluster")
+
+    def _join(self, address: str) -> dict:
+        """Admit a new node: it applies the new view from the answer, every other node from a view message"""
+        with self.cond:
+            previous = list(self.members)
+            members = sorted(set(previous) | {address})
+            epoch = self.epoch + 1
+
+        def announce():
+            for node in members:
+                if node not in (self.address, address):
+                    try:
+                        self._link(node).call({"op": "view", "members": members, "epoch": epoch})
+                    except ClusterError as e:
+                        print(f"[SERVER] Could not tell {node} about {address}: {e}")
+            self._apply_view(members, epoch)
+
+        threading.Thread(target=announce, daemon=True).start()
+        return {"status": "SUCCESS", "members": members, "previous": previous, "epoch": epoch}
+
+    def _apply_view(self, members: list, epoch: int, previous: list = None):
+        """Switch to a new set of members and hand over whatever moved away from this node
+
+        Commands already running on this node's groups finish first; after the
+        switch, commands for a moved group are forwarded to its new owner,
+        which holds them until the handoff arrives.
+        """
+        with self.view_lock:
+            with self.cond:
+                if epoch <= self.epoch:
+                    return
+                old = self.ring if previous is None else HashRing(previous)
+                new = HashRing(members)
+                moves = old.moves(new)
+
+                self.changing = True
+                while self.running:
+                    self.cond.wait()
+                self.members, self.ring, self.previous_ring, self.epoch = sorted(members), new, old, epoch
+                self.awaiting = {
+                    source for source, target in moves
+                    if target == self.address and (source, epoch) not in self.handed_over
+                }
+                self.changing = False
+                self.cond.notify_all()
+
+            print(f"[SERVER] Cluster view {epoch}: {', '.join(self.members)}")
+            for target in sorted({target for source, target in moves if source == self.address}):
+                self._hand_off(target, old, new, epoch)
+
+    def _hand_off(self, target: str, old: HashRing, new: HashRing, epoch: int):
+        """Send target every group and username that moved to it from this node"""
+        link = self._link(target)
+        try:
+            for group_id in list(self.server.groups):
+                if old.owner(group_id) != self.address or new.owner(group_id) != target:
+                    continue
+                name, creator, counter, records, members = self.server.export_group(group_id)
+                for start in range(0, len(records), HANDOFF_CHUNK):
+                    link.call({"op": "adopt_messages", "from": self.address, "group_id": group_id,
+                               "records": records[start:start + HANDOFF_CHUNK]})
+                link.call({"op": "adopt_group", "from": self.address, "group_id": group_id, "name": name,
+                           "creator": creator, "counter": counter, "members": members})
+                self.server.drop_group(group_id)
+                print(f"[SERVER] Handed group {group_id} ({len(records)} messages) to {target}")
+
+            with self.cond:
+                claims = {username: node for username, node in self.claims.items()
+                          if new.owner("user:" + username) == target}
+                for username in claims:
+                    del self.claims[username]
+            link.call({"op": "adopt_claims", "claims": claims})
+            link.call({"op": "handed_over", "from": self.address, "epoch": epoch})
+        except ClusterError as e:
+            print(f"[SERVER] Handoff to {target} failed: {e}")
+
+    # ---- Routing ----
+
+    def owner(self, key: str) -> str:
+        """Node that owns a group_id or "user:<name>" key in the current view"""
+        with self.cond:
+            return self.ring.owner(key)
+
+    def dispatch(self, group_id: str, username: str, request: dict, run):
+        """Run a group command with run() if this node owns the group, or forward it to the owner"""
+        with self.cond:
+            while self.changing:
+                self.cond.wait()
+            owner = self.ring.owner(group_id)
+            if owner == self.address:
+                if not self._wait_for_handoff(group_id):
+                    return {"status": "ERROR", "message": f"Group {group_id} is moving; try again"}
+                self.running += 1
+
+        if owner != self.address:
+            return self.forward(owner, username, request)
+
+        try:
+            return run(username, request.get("command"), request)
+        finally:
+            with self.cond:
+                self.running -= 1
+                if not self.running:
+                    self.cond.notify_all()
+
+    def _wait_for_handoff(self, key: str) -> bool:
+        """Wait (cond held) until a key moving to this node has arrived; False on timeout"""
+        return self.cond.wait_for(lambda: self.previous_ring.owner(key) not in self.awaiting, HANDOFF_TIMEOUT)
+
+    def forward(self, node: str, username: str, request: dict):
+        """Run a command on the node that owns its group; returns that node's response"""
+        hops = request.get("hops", 0)
+        if hops >= MAX_HOPS:
+            return {"status": "ERROR", "message": "Group is moving; try again"}
+
+        with self.server.registry_lock:
+            connection = self.server.clients.get(username)
+        try:
+            reply = self._link(node).call({
+                "op": "command",
+                "origin": getattr(connection, "node", self.address),
+                "username": username,
+                "digest": getattr(connection, "digest", None),
+                "request": dict(request, hops=hops + 1)
+            })
+        except ClusterError as e:
+            print(f"[SERVER] {e}")
+            return {"status": "ERROR", "message": "The node holding this group is unavailable"}
+        return reply["response"]
+
+    def claim(self, username: str) -> bool:
+        """Reserve a username across the cluster; False if a client anywhere has it"""
+        owner = self.owner("user:" + username)
+        if owner == self.address:
+            return self._claim(username, self.address)
+        try:
+            return self._link(owner).call({"op": "claim", "username": username, "node": self.address})["ok"]
+        except ClusterError as e:
+            print(f"[SERVER] {e}")
+            return False
+
+    def _claim(self, username: str, node: str) -> bool:
+        """Reserve a username this node owns for a client of node"""
+        with self.cond:
+            self._wait_for_handoff("user:" + username)
+            if username in self.claims:
+                return False
+            self.claims[username] = node
+            return True
+
+    def disconnected(self, username: str):
+        """A client of this node has gone: drop it from other nodes' groups and free its name"""
+        with self.cond:
+            members = list(self.members)
+        for node in members:
+            if node != self.address:
+                self._tell(node, {"op": "disconnect", "username": username})
+        owner = self.owner("user:" + username)
+        if owner == self.address:
+            with self.cond:
+                self.claims.pop(username, None)
+        else:
+            self._tell(owner, {"op": "release", "username": username})
+
+    def deliver(self, node: str, username: str, notification: dict) -> bool:
+        """Pass a notification to the node a user is connected to; False if it was dropped"""
+        return self._link(node).send({"op": "deliver", "username": username, "notification": notification},
+                                     droppable=True)
+
+    def list_groups(self, prefix: str, after: str, limit: int):
+        """A page of GROUPS across the cluster: (groups, whether there are more)
+
+        Every node lists a page of the groups it owns, and the first limit of
+        them all, in group_id order, make the page.
+        """
+        groups, more = [], False
+        for node in list(self.members):
+            if node == self.address:
+                page, node_more = self._owned_groups(prefix, after, limit)
+            else:
+                try:
+                    reply = self._link(node).call({"op": "groups", "prefix": prefix, "after": after,
+                                                   "limit": limit})
+                except ClusterError as e:
+                    print(f"[SERVER] {e}")
+                    continue
+                page, node_more = reply["groups"], reply["more"]
+            groups.extend(page)
+            more = more or node_more
+
+        groups.sort(key=lambda group: group["group_id"])
+        return groups[:limit], more or len(groups) > limit
+
+    def _owned_groups(self, prefix: str, after: str, limit: int):
+        """A page of the groups this node owns"""
+        with self.cond:
+            ring = self.ring
+        return self.server.list_groups(prefix, after, limit, lambda group_id: ring.owner(group_id) == self.address)
+
+    # ---- Talking to other nodes ----
+
+    def _link(self, node: str) -> PeerLink:
+        """The connection to another node, created on first use"""
+        with self.links_lock:
+            link = self.links.get(node)
+            if link is None:
+                link = self.links[node] = PeerLink(node)
+            return link
+
+    def _tell(self, node: str, message: dict):
+        """Send a message that needs no answer"""
+        self._link(node).send(message)
+
+    def _accept_loop(self):
+        """Serve every node that connects to the cluster port"""
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            serve = threading.Thread(target=self._serve, args=(sock,))
+            serve.daemon = True
+            serve.start()
+
+    def _serve(self, sock):
+        """Read another node's messages until it disconnects
+
+        Deliveries and disconnects are handled here, in the order they were
+        sent; requests are answered from the pool, as they may wait.
+        """
+        reader = FrameReader(sock)
+        send_lock = threading.Lock()
+        try:
+            while True:
+                message = reader.read()
+                if message is None:
+                    break
+                op = message.get("op")
+                if op == "deliver":
+                    self.server.deliver_relayed(message["username"], message["notification"])
+                elif op == "disconnect":
+                    self.server.drop_remote_client(message["username"])
+                elif op == "release":
+                    with self.cond:
+                        self.claims.pop(message["username"], None)
+                else:
+                    try:
+                        self.pool.submit(self._answer, sock, send_lock, message)
+                    except RuntimeError:
+                        break  # the server is exiting
+        except (OSError, FrameError):
+            pass
+        finally:
+            sock.close()
+
+    def _answer(self, sock, send_lock: threading.Lock, message: dict):
+        """Handle a request and send the answer back on the connection it came from"""
+        try:
+            response = self._handle(message)
+        except Exception as e:
+            print(f"[SERVER] Error handling {message.get('op')} from another node: {e}")
+            response = {"status": "ERROR", "message": str(e)}
+        response[REQUEST_ID] = message.get(REQUEST_ID)
+        try:
+            with send_lock:
+                sock.sendall(encode_frame(response))
+        except OSError:
+            pass
+
+    def _handle(self, message: dict) -> dict:
+        """Answer one request from another node"""
+        op = message.get("op")
+
+        if op == "command":
+            response = self.server.handle_relayed(
+                message["origin"], message["username"], message.get("digest"), message["request"])
+            return {"status": "SUCCESS", "response": response}
+
+        elif op == "claim":
+            return {"status": "SUCCESS", "ok": self._claim(message["username"], message["node"])}
+
+        elif op == "groups":
+            groups, more = self._owned_groups(message["prefix"], message["after"], message["limit"])
+            return {"status": "SUCCESS", "groups": groups, "more": more}
+
+        elif op == "join":
+            return self._join(message["address"])
+
+        elif op == "view":
+            self._apply_view(message["members"], message["epoch"])
+            return {"status": "SUCCESS"}
+
+        elif op == "adopt_messages":
+            key = (message["from"], message["group_id"])
+            with self.cond:
+                self.adopting.setdefault(key, []).extend(message["records"])
+            return {"status": "SUCCESS"}
+
+        elif op == "adopt_group":
+            with self.cond:
+                records = self.adopting.pop((message["from"], message["group_id"]), [])
+            self.server.adopt_group(message["group_id"], message["name"], message["creator"], message["counter"],
+                                    records, message["members"])
+            return {"status": "SUCCESS"}
+
+        elif op == "adopt_claims":
+            with self.cond:
+                self.claims.update(message["claims"])
+            return {"status": "SUCCESS"}
+
+        elif op == "handed_over":
+            with self.cond:
+                self.handed_over.add((message["from"], message["epoch"]))
+                if message["epoch"] == self.epoch:
+                    self.awaiting.discard(message["from"])
+                self.cond.notify_all()
+            return {"status": "SUCCESS"}
+
+        return {"status": "ERROR", "message": f"Unknown cluster request {op}"}
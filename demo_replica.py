@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Read replica demo
+
+Starts a primary and a read replica, then checks that the replica serves
+the primary's posts while keeping group membership to its own clients: a
+replica user with the same name as a primary user joins, stays a member
+when the primary's user leaves, and hears nothing about the other's joins
+and leaves.
+
+Usage: python3 demo_replica.py [--port N]   (uses ports N to N+2)
+"""
+
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from protocol import FrameReader, send_frame
+
+
+class DemoClient:
+    """A registered connection that keeps the notifications it receives"""
+
+    def __init__(self, port: int, username: str):
+        self.username = username
+        self.sock = socket.create_connection(("localhost", port))
+        self.reader = FrameReader(self.sock)
+        self.notifications = []
+        response = self.call({"command": "REGISTER", "username": username})
+        assert response["status"] == "SUCCESS", response
+
+    def call(self, request: dict) -> dict:
+        """Send a request and return its response, keeping any notifications"""
+        send_frame(self.sock, request)
+        while True:
+            response = self.reader.read()
+            if response is None:
+                raise ConnectionError("Server closed the connection")
+            if response.get("type") != "NOTIFICATION":
+                return response
+            self.notifications.append(response["message"])
+
+    def drain(self, seconds: float = 0.5):
+        """Collect the notifications that arrive within seconds"""
+        self.sock.settimeout(seconds)
+        try:
+            while True:
+                notification = self.reader.read()
+                if notification is None:
+                    break
+                self.notifications.append(notification["message"])
+        except socket.timeout:
+            pass
+        self.sock.settimeout(None)
+        return self.notifications
+
+    def close(self):
+        """Disconnect"""
+        self.sock.close()
+
+
+def start(*args) -> subprocess.Popen:
+    """A server started with args, after giving it a moment to listen"""
+    server = subprocess.Popen([sys.executable, "server.py", *args],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    time.sleep(1)
+    return server
+
+
+def check(ok: bool, what: str):
+    """Report one check, stopping the demo if it failed"""
+    print(f"  {'ok  ' if ok else 'FAIL'} {what}")
+    if not ok:
+        raise SystemExit(1)
+
+
+def main():
+    """Main demo entry point"""
+    parser = argparse.ArgumentParser(description="Check a read replica against its primary")
+    parser.add_argument("--port", type=int, default=8890, help="primary port (replication on +1, replica on +2)")
+    args = parser.parse_args()
+    primary_port, replication_port, replica_port = args.port, args.port + 1, args.port + 2
+
+    with tempfile.TemporaryDirectory() as directory:
+        servers = [start(str(primary_port), "--log", os.path.join(directory, "primary.log"),
+                         "--replication-port", str(replication_port))]
+        servers.append(start(str(replica_port), "--follow", f"localhost:{replication_port}",
+                             "--log", os.path.join(directory, "replica.log")))
+        try:
+            bob = DemoClient(primary_port, "bob")
+            replica_bob = DemoClient(replica_port, "bob")
+            carol = DemoClient(replica_port, "carol")
+
+            print("Primary user bob and replica user bob join tech")
+            check(bob.call({"command": "GROUPJOIN", "group_id": "tech"})["status"] == "SUCCESS",
+                  "bob joins on the primary")
+            carol.call({"command": "GROUPJOIN", "group_id": "tech"})
+            time.sleep(0.5)
+            response = replica_bob.call({"command": "GROUPJOIN", "group_id": "tech"})
+            check(response["status"] == "SUCCESS", f"bob joins on the replica ({response['message']})")
+
+            print("A post on the primary reaches the replica")
+            msg_id = bob.call({"command": "GROUPPOST", "group_id": "tech", "subject": "Hi",
+                               "content": "Posted on the primary"})["msg_id"]
+            time.sleep(0.5)
+            response = carol.call({"command": "GROUPMESSAGE", "group_id": "tech", "msg_id": msg_id})
+            check(response.get("message", {}).get("content") == "Posted on the primary",
+                  "the replica serves the primary's post")
+
+            print("The primary's bob leaves; the replica's bob stays")
+            bob.call({"command": "GROUPLEAVE", "group_id": "tech"})
+            time.sleep(0.5)
+            response = replica_bob.call({"command": "GROUPUSERS", "group_id": "tech"})
+            check(response["status"] == "SUCCESS" and sorted(response["users"]) == ["bob", "carol"],
+                  f"replica members are its own clients ({response.get('users')})")
+            response = replica_bob.call({"command": "GROUPMESSAGE", "group_id": "tech", "msg_id": msg_id})
+            check(response["status"] == "SUCCESS", "the replica's bob can still read the group")
+
+            notes = carol.drain()
+            joins = [note for note in notes if "bob has joined" in note]
+            leaves = [note for note in notes if "bob has left" in note]
+            check(len(joins) == 1 and not leaves,
+                  "the replica's members hear of its own bob joining, not of the primary's bob")
+            check(any("New message posted" in note for note in notes), "but do hear of its posts")
+
+            for client in (bob, replica_bob, carol):
+                client.close()
+        finally:
+            for server in reversed(servers):
+                server.send_signal(signal.SIGINT)
+                server.wait(20)
+    print("Replica demo passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+"""
+In-process metrics for the bulletin board server
+
+Counters and histograms are recorded into a shard owned by the recording
+thread, so recording never takes a lock and never loses an update; readers
+merge the shards. Lock timings are kept on each lock and only changed while
+it is held; hold times are sampled. Histograms have fixed buckets, which makes a recording one
+bisect and two additions.
+
+Metrics can be read as a dict (for the STATS command) or rendered in the
+Prometheus text exposition format, optionally served over HTTP.
+"""
+
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram bucket upper bounds: seconds for latencies, counts for sizes
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+# TimedLock times how long the lock is held for one acquisition in this many
+HOLD_SAMPLE = 8
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Metrics:
+    """A set of named counters, histograms, lock timings and gauges
+
+    Every metric is declared once with its help text and at most one label
+    name, and recorded through the object the declaration returns, passing
+    just the label value. Gauges are only declared here; their current
+    values are passed in when the metrics are read.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.definitions = {}  # name -> (kind, help, label name, buckets)
+        self.recorders = []  # declared counters, histograms and lock timings
+
+    def counter(self, name: str, help: str, label: str = None) -> "Counter":
+        """Declare a counter"""
+        self.definitions[name] = ("counter", help, label, None)
+        return self._add(Counter(name))
+
+    def histogram(self, name: str, help: str, label: str = None,
+                  buckets: tuple = LATENCY_BUCKETS) -> "Histogram":
+        """Declare a histogram with the given bucket upper bounds"""
+        self.definitions[name] = ("histogram", help, label, buckets)
+        return self._add(Histogram(name, buckets))
+
+    def lock_timings(self, wait_name: str, hold_name: str, label: str) -> "LockTimings":
+        """Declare wait and hold time histograms for a family of TimedLocks"""
+        self.definitions[wait_name] = ("histogram", "Time spent waiting for a lock", label, LATENCY_BUCKETS)
+        self.definitions[hold_name] = ("histogram", f"Time a lock was held (1 in {HOLD_SAMPLE} acquisitions)",
+                                       label, LATENCY_BUCKETS)
+        return self._add(LockTimings(wait_name, hold_name, LATENCY_BUCKETS))
+
+    def gauge(self, name: str, help: str, label: str = None):
+        """Declare a gauge"""
+        self.definitions[name] = ("gauge", help, label, None)
+
+    def _add(self, recorder):
+        self.recorders.append(recorder)
+        return recorder
+
+    def collect(self) -> dict:
+        """Current value of every recorded metric: (name, label value) -> count, or bucket counts and sum"""
+        values = {}
+        for recorder in self.recorders:
+            values.update(recorder.samples())
+        return values
+
+    def summary(self, gauges: dict = None) -> dict:
+        """Metrics as plain data: counters and gauges as numbers, histograms as
+        count, sum, mean, p50 and p99, grouped by name and then label value"""
+        result = {}
+        for (name, label), value in sorted(self.collect().items(), key=_sort_key):
+            if isinstance(value, list):
+                buckets = self.definitions[name][3]
+                count = sum(value[:-1])
+                value = {
+                    "count": count,
+                    "sum": value[-1],
+                    "mean": value[-1] / count if count else 0.0,
+                    "p50": quantile(buckets, value, 0.5),
+                    "p99": quantile(buckets, value, 0.99),
+                }
+            _place(result, name, label, value)
+        for (name, label), value in (gauges or {}).items():
+            _place(result, name, label, value)
+        return result
+
+    def prometheus(self, gauges: dict = None) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        values = {}
+        for (name, label), value in list(self.collect().items()) + list((gauges or {}).items()):
+            values.setdefault(name, []).append((label, value))
+
+        lines = []
+        for name in sorted(values):
+            kind, help, label_name, buckets = self.definitions[name]
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for label, value in sorted(values[name], key=lambda item: str(item[0])):
+                labels = f'{label_name}="{_escape(label)}"' if label_name and label is not None else ""
+                if kind != "histogram":
+                    lines.append(f"{name}{_braces(labels)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + (float("inf"),), value):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else _number(bound)
+                    bucket_labels = f'{labels},le="{le}"' if labels else f'le="{le}"'
+                    lines.append(f"{name}_bucket{{{bucket_labels}}} {cumulative}")
+                lines.append(f"{name}_sum{_braces(labels)} {_number(value[-1])}")
+                lines.append(f"{name}_count{_braces(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+class _Sharded:
+    """Values kept per recording thread (label value -> value) and merged when read
+
+    Shards of threads that have exited are folded into one retired shard,
+    so short-lived threads do not leave shards behind.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._local = threading.local()
+        self._shards = []  # (thread, shard) for every thread that has recorded
+        self._retired = {}
+        self._lock = threading.Lock()  # guards _shards and _retired
+
+    def _new_shard(self) -> dict:
+        shard = self._local.shard = {}
+        with self._lock:
+            self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def samples(self) -> dict:
+        """Merged values: (name, label value) -> value"""
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    _merge(self._retired, shard)
+            self._shards = live
+            merged = {label: list(value) if isinstance(value, list) else value
+                      for label, value in self._retired.items()}
+            for _, shard in live:
+                _merge(merged, shard)
+        return {(self.name, label): value for label, value in merged.items()}
+
+
+class Counter(_Sharded):
+    """A counter, optionally per label value"""
+
+    def inc(self, label: str = None, amount: int = 1):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        shard[label] = shard.get(label, 0) + amount
+
+
+class Histogram(_Sharded):
+    """A fixed-bucket histogram, optionally per label value"""
+
+    def __init__(self, name: str, buckets: tuple):
+        super().__init__(name)
+        self.buckets = buckets
+
+    def observe(self, value: float, label: str = None):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        entry = shard.get(label)
+        if entry is None:
+            # One count per bucket, one for values above the last bucket, then the sum
+            entry = shard[label] = [0] * (len(self.buckets) + 2)
+        entry[bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+
+class LockTimings:
+    """Wait and hold time histograms for a family of TimedLocks
+
+    Each lock keeps its own bucket counts, changed only while it is held,
+    so recording needs no lock of its own. A lock joins the family the first
+    time it is acquired, so locks that are never used (the locks of idle
+    groups) cost no counts. Counts of locks that have been garbage collected
+    are kept in a retired total.
+    """
+
+    def __init__(self, wait_name: str, hold_name: str, buckets: tuple):
+        self.wait_name = wait_name
+        self.hold_name = hold_name
+        self.buckets = buckets
+        self._locks = weakref.WeakSet()
+        self._retired = {}  # (name, label value) -> bucket counts
+        self._lock = threading.Lock()
+
+    def lock(self, label: str, reentrant: bool = False) -> "TimedLock":
+        """A new lock whose timings are reported under the label value"""
+        return TimedLock(label, self.buckets, reentrant, self)
+
+    def _register(self, lock: "TimedLock"):
+        """Start reporting a lock's counts (called on its first acquisition)"""
+        with self._lock:
+            self._locks.add(lock)
+        weakref.finalize(lock, self._retire, lock.label, lock.wait_counts, lock.hold_counts)
+
+    def _retire(self, label: str, wait_counts: list, hold_counts: list):
+        with self._lock:
+            _merge(self._retired, {(self.wait_name, label): wait_counts, (self.hold_name, label): hold_counts})
+
+    def samples(self) -> dict:
+        with self._lock:
+            merged = {key: list(value) for key, value in self._retired.items()}
+            locks = list(self._locks)
+        for lock in locks:
+            _merge(merged, {(self.wait_name, lock.label): lock.wait_counts,
+                            (self.hold_name, lock.label): lock.hold_counts})
+        return merged
+
+
+class TimedLock:
+    """A lock that records how long callers wait for it and how long they hold it
+
+    Works as a drop-in for threading.Lock, or threading.RLock when reentrant;
+    for an RLock only the outermost acquire and release count. Every wait is
+    recorded, without timing it when the lock was free. Hold times are timed
+    for one acquisition in HOLD_SAMPLE, which keeps an uncontended
+    acquire/release pair within a few hundred nanoseconds of a plain lock's.
+    """
+
+    __slots__ = ("label", "buckets", "timings", "_lock", "_depth", "_acquisitions", "_acquired",
+                 "wait_counts", "hold_counts", "__weakref__")
+
+    def __init__(self, label: str, buckets: tuple = LATENCY_BUCKETS, reentrant: bool = False,
+                 timings: LockTimings = None):
+        self.label = label
+        self.buckets = buckets
+        self.timings = timings  # the family reporting this lock, told on first acquisition
+        self._lock = threading.RLock() if reentrant else threading.Lock()
+        self._depth = 0  # everything below is only changed by the thread holding the lock
+        self._acquisitions = 0
+        self._acquired = 0.0  # when a sampled acquisition got the lock, else 0
+        self.wait_counts = None  # allocated on first acquisition
+        self.hold_counts = None
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if self._lock.acquire(False):
+            waited = 0.0
+        elif not blocking:
+            return False
+        else:
+            start = time.perf_counter()
+            if not self._lock.acquire(True, timeout):
+                return False
+            waited = time.perf_counter() - start
+
+        self._depth += 1
+        if self._depth == 1:
+            if self.wait_counts is None:
+                self._start_counting()
+            if waited:
+                self.wait_counts[bisect_left(self.buckets, waited)] += 1
+                self.wait_counts[-1] += waited
+            else:
+                self.wait_counts[0] += 1
+            self._acquisitions += 1
+            self._acquired = 0.0 if self._acquisitions % HOLD_SAMPLE else time.perf_counter()
+        return True
+
+    def _start_counting(self):
+        """Allocate the counts (lock held) and join the family that reports them"""
+        self.wait_counts = [0] * (len(self.buckets) + 2)
+        self.hold_counts = [0] * (len(self.buckets) + 2)
+        if self.timings is not None:
+            self.timings._register(self)
+
+    def release(self):
+        self._depth -= 1
+        if not self._depth and self._acquired:
+            held = time.perf_counter() - self._acquired
+            self.hold_counts[bisect_left(self.buckets, held)] += 1
+            self.hold_counts[-1] += held
+        self._lock.release()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def start_http_server(port: int, render, host: str = "localhost") -> ThreadingHTTPServer:
+    """Serve render() as Prometheus text at /metrics from a background thread"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # scrapes are too frequent to log
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def quantile(buckets: tuple, counts: list, q: float) -> float:
+    """Estimate a quantile from histogram bucket counts by interpolating within its bucket"""
+    total = sum(counts[:-1])
+    if not total or not counts[-1]:
+        return 0.0  # nothing recorded, or every value was 0
+    rank = q * total
+    cumulative = 0
+    for i, count in enumerate(counts[:-1]):
+        if count and cumulative + count >= rank:
+            if i == len(buckets):
+                return buckets[-1]  # above the last bucket: report its bound
+            lower = buckets[i - 1] if i else 0.0
+            return lower + (buckets[i] - lower) * (rank - cumulative) / count
+        cumulative += count
+    return buckets[-1]
+
+
+def _merge(into: dict, shard: dict):
+    """Add a shard's values into another (copying, so the shard's owner can keep recording)"""
+    for key, value in list(shard.items()):
+        if isinstance(value, list):
+            existing = into.get(key)
+            if existing is None:
+                into[key] = list(value)
+            else:
+                for i, count in enumerate(value):
+                    existing[i] += count
+        else:
+            into[key] = into.get(key, 0) + value
+
+
+def _place(result: dict, name: str, label, value):
+    """Store a value under name, and under its label value if it has one"""
+    if label is None:
+        result[name] = value
+    else:
+        result.setdefault(name, {})[label] = value
+
+
+def _sort_key(item):
+    (name, label), _ = item
+    return name, str(label)
+
+
+def _braces(labels: str) -> str:
+    return f"{{{labels}}}" if labels else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value) -> str:
+    if isinstance(value, float):
+        return repr(value) if value == value and value not in (float("inf"), float("-inf")) else "NaN"
+    return str(value)
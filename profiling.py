@@ -0,0 +1,139 @@
+"""
+On-demand profiling of a running server
+
+A ProfileSession runs each command under cProfile until it has seen a
+number of requests or its time is up, then writes one report. A cProfile
+profiler only follows the thread that enabled it, so every thread gets its
+own profiler for each command type, enabled just while that thread runs a
+command; the profilers are merged when the session ends. Nothing is
+recorded for commands that run while no session is active.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+
+# Functions listed in the per-handler section of a report
+HANDLER_PATTERN = r"\((handle_\w+|process_command|broadcast_notification|_fan_out|_send_now|_commit_log)\)"
+
+# Rows printed per section of a report
+REPORT_ROWS = 30
+
+
+class ProfileSession:
+    """Profiles commands until max_requests have run or the deadline passes"""
+
+    def __init__(self, path: str, duration: float, max_requests: int = None):
+        self.path = path  # report is written to path + ".txt", merged stats to path + ".prof"
+        self.started = time.time()
+        self.deadline = self.started + duration
+        self.max_requests = max_requests
+        self.requests = 0
+        self.counts = {}  # command -> requests profiled
+        self.profiles = []  # (command, cProfile.Profile) for every thread and command
+        self.running = 0  # commands being profiled right now
+        self.finished = False
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self._local = threading.local()
+
+    def run(self, command: str, function, *args):
+        """Call function under this thread's profiler for command
+
+        Commands nested in one being profiled (a BATCH) are attributed to it.
+        """
+        if getattr(self._local, "active", False):
+            return function(*args)
+
+        with self.lock:
+            if self.finished:
+                return function(*args)
+            self.running += 1
+            self.requests += 1
+            self.counts[command] = self.counts.get(command, 0) + 1
+
+        profiles = getattr(self._local, "profiles", None)
+        if profiles is None:
+            profiles = self._local.profiles = {}
+        profile = profiles.get(command)
+        if profile is None:
+            profile = profiles[command] = cProfile.Profile()
+            with self.lock:
+                self.profiles.append((command, profile))
+
+        self._local.active = True
+        try:
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler owns the interpreter (Python 3.12+ allows one at a time)
+                return function(*args)
+            try:
+                return function(*args)
+            finally:
+                profile.disable()
+        finally:
+            self._local.active = False
+            with self.lock:
+                self.running -= 1
+                self.idle.notify_all()
+
+    def done(self) -> bool:
+        """Whether the session has reached its request limit or deadline"""
+        return (self.max_requests is not None and self.requests >= self.max_requests) \
+            or time.time() >= self.deadline
+
+    def finish(self, wait: float = 5.0) -> str:
+        """Stop profiling, wait for commands still running, and write the report; returns its path"""
+        with self.lock:
+            self.finished = True
+            deadline = time.time() + wait
+            while self.running and time.time() < deadline:
+                self.idle.wait(deadline - time.time())
+            profiles = list(self.profiles)
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        report = io.StringIO()
+        elapsed = time.time() - self.started
+        report.write(f"Profile of {self.requests} request(s) over {elapsed:.1f}s, "
+                     f"started {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started))}\n")
+
+        overall = self._merge(profile for _, profile in profiles)
+        if overall is None:
+            report.write("\nNo requests were profiled.\n")
+        else:
+            overall.dump_stats(self.path + ".prof")
+            self._section(report, "All commands", overall, REPORT_ROWS)
+            self._section(report, "Handlers", overall, HANDLER_PATTERN)
+            for command in sorted(self.counts, key=self.counts.get, reverse=True):
+                stats = self._merge(profile for name, profile in profiles if name == command)
+                if stats is not None:
+                    self._section(report, f"{command} ({self.counts[command]} requests)", stats, REPORT_ROWS)
+
+        with open(self.path + ".txt", "w") as output:
+            output.write(report.getvalue())
+        return self.path + ".txt"
+
+    @staticmethod
+    def _merge(profiles):
+        """Combine profilers into one pstats.Stats (None if none recorded anything)"""
+        stats = None
+        for profile in profiles:
+            profile.create_stats()
+            if not profile.stats:
+                continue
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        return stats
+
+    @staticmethod
+    def _section(report: io.StringIO, title: str, stats: pstats.Stats, restriction):
+        """Write one titled block of stats, slowest cumulative time first"""
+        report.write(f"\n{'=' * 20} {title} {'=' * 20}\n")
+        stats.stream = report
+        stats.sort_stats("cumulative").print_stats(restriction)
@@ -0,0 +1,568 @@
+#!/usr/bin/env python3
+"""
+Bulletin Board Wire Protocol
+Message framing shared by the server, the client and the test scripts.
+
+Every message on the wire is one frame: a 4-byte big-endian length followed
+by that many bytes of UTF-8 encoded JSON. TCP is a byte stream, so a single
+recv() may return part of a frame or several frames glued together; the
+FrameDecoder buffers incoming bytes and only hands out complete frames.
+
+Requests may carry a "request_id" chosen by the client. The server copies it
+onto the matching response so a client can have many requests in flight on
+one connection and still pair every response with its request.
+
+Frame bodies are JSON unless the REGISTER handshake negotiates another codec:
+the client lists the codecs it speaks in "codecs", the server names the one
+it picked in the REGISTER response's "codec", and every frame after that
+response uses it in both directions. The handshake itself is always JSON.
+
+Compression is negotiated the same way ("compression": ["zlib"] in the
+request, "compression": "zlib" in the response). After that, either side may
+send a frame whose body is compressed; the top bit of its length header marks
+it. Each direction of a connection is one zlib stream, so a frame can refer
+back to text sent in earlier ones.
+"""
+
+import json
+import socket
+import struct
+import zlib
+from collections import deque
+from typing import Union
+
+# Frame header: payload length as an unsigned 32-bit big-endian integer
+HEADER = struct.Struct("!I")
+
+# Largest payload either side will accept (guards against garbage lengths)
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+# Bytes requested from the socket per recv() call
+RECV_SIZE = 65536
+
+# Correlation field echoed from each request onto its response
+REQUEST_ID = "request_id"
+
+# Set in a frame's length header when its body is compressed
+COMPRESSED_FLAG = 0x80000000
+
+# Compression methods a connection can negotiate
+COMPRESSION_METHODS = ("zlib",)
+
+# Smallest body worth compressing (bytes); smaller frames skip the CPU cost
+COMPRESS_THRESHOLD = 512
+
+# Preset zlib dictionary: text that recurs in protocol messages, so even a
+# connection's first compressed frame has something to refer back to.
+# Both sides must use exactly these bytes.
+ZLIB_DICTIONARY = (
+    b'{"status": "ERROR", "message": "You are not a member of this group", '
+    b'"recent_messages": [], "users": [], "groups": [{"group_id": "public", '
+    b'"name": "", "member_count": 0}], "more": false, "request_id": 0, '
+    b'"results": [{"status": "SUCCESS", "messages": [{"msg_id": 0, "sender": "", '
+    b'"subject": "", "content": "", "post_date": "2025-01-01 00:00:00", '
+    b'"group_id": "tech"}]}]}'
+)
+
+
+class FrameError(Exception):
+    """Raised when the byte stream does not contain valid frames"""
+
+
+def encode_payload(payload: dict) -> bytes:
+    """Serialize a message to its JSON body"""
+    return json.dumps(payload).encode('utf-8')
+
+
+def decode_payload(body: bytes) -> dict:
+    """Deserialize a JSON frame body"""
+    try:
+        payload = json.loads(body)
+    except ValueError as e:  # includes JSONDecodeError and UnicodeDecodeError
+        raise FrameError(f"Malformed JSON frame: {e}")
+    if type(payload) is not dict:
+        raise FrameError("Malformed JSON frame")
+    return payload
+
+
+class JsonCodec:
+    """The default codec: UTF-8 JSON bodies"""
+
+    name = "json"
+    encode = staticmethod(encode_payload)
+    decode = staticmethod(decode_payload)
+
+
+# Binary codec value tags
+(_NONE, _FALSE, _TRUE, _INT8, _INT32, _INT64, _BIGINT, _FLOAT,
+ _STR8, _STR32, _WORD, _LIST8, _LIST32, _DICT8, _DICT32,
+ _STRS, _STRS_SIZED, _INTS32, _INTS64, _TABLE) = range(20)
+
+# Protocol field names, sent as a single byte. Append only: the index is the wire code.
+BINARY_KEYS = (
+    "command", "request_id", "status", "message", "type", "username", "group_id",
+    "msg_id", "subject", "content", "sender", "post_date", "users", "recent_messages",
+    "messages", "more", "since_id", "before_id", "limit", "stream", "query", "results",
+    "commands", "groups", "name", "member_count", "codecs", "codec",
+)
+
+# Common string values, sent as a tag and a single byte. Append only, like BINARY_KEYS.
+BINARY_WORDS = (
+    "SUCCESS", "ERROR", "NOTIFICATION", "REGISTER", "JOIN", "POST", "USERS", "LEAVE",
+    "MESSAGE", "GROUPS", "GROUPJOIN", "GROUPPOST", "GROUPUSERS", "GROUPLEAVE",
+    "GROUPMESSAGE", "HISTORY", "GROUPHISTORY", "SEARCH", "GROUPSEARCH", "BATCH",
+    "public", "tech", "sports", "music", "books", "movies", "json", "binary",
+)
+
+# A key byte of 255 means the key follows as a string value
+_OTHER_KEY = 255
+
+_KEY_CODES = {key: bytes((code,)) for code, key in enumerate(BINARY_KEYS)}
+_WORD_CODES = {word: bytes((_WORD, code)) for code, word in enumerate(BINARY_WORDS)}
+
+_STR_KINDS = {str}
+_INT_KINDS = {int}
+_DICT_KINDS = {dict}
+
+_U32 = struct.Struct("!I")
+_STRS_HEADER = struct.Struct("!II")  # string count, blob size
+_I32 = struct.Struct("!i")
+_I64 = struct.Struct("!q")
+_F64 = struct.Struct("!d")
+
+
+def _binary_encode(value, out: bytearray):
+    """Append the tagged encoding of one value to out"""
+    kind = type(value)
+    if kind is str:
+        word = _WORD_CODES.get(value)
+        if word is not None:
+            out += word
+            return
+        data = value.encode('utf-8')
+        if len(data) < 256:
+            out.append(_STR8)
+            out.append(len(data))
+        else:
+            out.append(_STR32)
+            out += _U32.pack(len(data))
+        out += data
+    elif kind is int:
+        if -128 <= value < 128:
+            out.append(_INT8)
+            out.append(value & 0xFF)
+        elif -2**31 <= value < 2**31:
+            out.append(_INT32)
+            out += _I32.pack(value)
+        elif -2**63 <= value < 2**63:
+            out.append(_INT64)
+            out += _I64.pack(value)
+        else:
+            data = str(value).encode('ascii')
+            out.append(_BIGINT)
+            out.append(len(data))
+            out += data
+    elif kind is dict:
+        if len(value) < 256:
+            out.append(_DICT8)
+            out.append(len(value))
+        else:
+            out.append(_DICT32)
+            out += _U32.pack(len(value))
+        for key, item in value.items():
+            _binary_encode_key(key, out)
+            _binary_encode(item, out)
+    elif kind is list or kind is tuple:
+        kinds = set(map(type, value)) if len(value) > 1 else None
+        if kinds == _STR_KINDS:
+            _binary_encode_strings(value, out)
+            return
+        if kinds == _INT_KINDS:
+            if -2**31 <= min(value) and max(value) < 2**31:
+                out.append(_INTS32)
+                out += _U32.pack(len(value))
+                out += struct.pack(f"!{len(value)}i", *value)
+                return
+            if -2**63 <= min(value) and max(value) < 2**63:
+                out.append(_INTS64)
+                out += _U32.pack(len(value))
+                out += struct.pack(f"!{len(value)}q", *value)
+                return
+        if kinds == _DICT_KINDS and _is_table(value):
+            _binary_encode_table(value, out)
+            return
+
+        if len(value) < 256:
+            out.append(_LIST8)
+            out.append(len(value))
+        else:
+            out.append(_LIST32)
+            out += _U32.pack(len(value))
+        for item in value:
+            _binary_encode(item, out)
+    elif value is None:
+        out.append(_NONE)
+    elif value is True:
+        out.append(_TRUE)
+    elif value is False:
+        out.append(_FALSE)
+    elif kind is float:
+        out.append(_FLOAT)
+        out += _F64.pack(value)
+    else:
+        raise TypeError(f"Object of type {kind.__name__} cannot be encoded")
+
+
+def _binary_encode_key(key, out: bytearray):
+    """Append a dict key: its BINARY_KEYS code, or _OTHER_KEY and the key as a string"""
+    code = _KEY_CODES.get(key)
+    if code is not None:
+        out += code
+    elif type(key) is str:
+        out.append(_OTHER_KEY)
+        _binary_encode(key, out)
+    else:
+        raise TypeError(f"Keys must be str, not {type(key).__name__}")
+
+
+def _binary_encode_strings(items, out: bytearray):
+    """Append a list of strings as one NUL-separated blob, so it decodes with a single split
+
+    Lists whose strings contain NUL themselves fall back to a table of byte
+    lengths followed by the concatenated strings.
+    """
+    joined = "\0".join(items)
+    if joined.count("\0") == len(items) - 1:
+        data = joined.encode('utf-8')
+        out.append(_STRS)
+        out += _STRS_HEADER.pack(len(items), len(data))
+        out += data
+        return
+
+    encoded = [item.encode('utf-8') for item in items]
+    out.append(_STRS_SIZED)
+    out += _U32.pack(len(encoded))
+    out += struct.pack(f"!{len(encoded)}I", *map(len, encoded))
+    out += b"".join(encoded)
+
+
+def _is_table(rows) -> bool:
+    """Whether a list holds dicts that all share the same (non-empty) keys"""
+    first = rows[0]
+    if type(first) is not dict or not 0 < len(first) < 256:
+        return False
+    keys = first.keys()
+    return all(type(row) is dict and row.keys() == keys for row in rows)
+
+
+def _binary_encode_table(rows, out: bytearray):
+    """Append a list of same-shaped dicts as their keys once, then one list per column
+
+    Columns of strings or integers then take the bulk list layouts.
+    """
+    keys = list(rows[0])
+    out.append(_TABLE)
+    out += _U32.pack(len(rows))
+    out.append(len(keys))
+    for key in keys:
+        _binary_encode_key(key, out)
+    for key in keys:
+        _binary_encode([row[key] for row in rows], out)
+
+
+def _binary_decode_key(data: bytes, offset: int):
+    """Decode the dict key starting at offset; returns (key, offset after it)"""
+    code = data[offset]
+    if code == _OTHER_KEY:
+        return _binary_decode(data, offset + 1)
+    return BINARY_KEYS[code], offset + 1
+
+
+def _binary_decode(data: bytes, offset: int):
+    """Decode the value starting at offset; returns (value, offset after it)"""
+    tag = data[offset]
+    offset += 1
+    if tag == _WORD:
+        return BINARY_WORDS[data[offset]], offset + 1
+    if tag == _STR8:
+        end = offset + 1 + data[offset]
+        return data[offset + 1:end].decode('utf-8'), end
+    if tag == _INT8:
+        value = data[offset]
+        return (value - 256 if value > 127 else value), offset + 1
+    if tag == _DICT8 or tag == _DICT32:
+        if tag == _DICT8:
+            count = data[offset]
+            offset += 1
+        else:
+            (count,) = _U32.unpack_from(data, offset)
+            offset += 4
+        result = {}
+        for _ in range(count):
+            key, offset = _binary_decode_key(data, offset)
+            result[key], offset = _binary_decode(data, offset)
+        return result, offset
+    if tag == _STRS:
+        count, size = _STRS_HEADER.unpack_from(data, offset)
+        offset += _STRS_HEADER.size
+        if offset + size > len(data):
+            raise FrameError("Truncated string list")
+        result = data[offset:offset + size].decode('utf-8').split("\0")
+        if len(result) != count:
+            raise FrameError("String list does not match its count")
+        return result, offset + size
+    if tag == _STRS_SIZED:
+        (count,) = _U32.unpack_from(data, offset)
+        lengths = struct.unpack_from(f"!{count}I", data, offset + 4)
+        offset += 4 + 4 * count
+        result = []
+        for length in lengths:
+            if offset + length > len(data):
+                raise FrameError("Truncated string list")
+            result.append(data[offset:offset + length].decode('utf-8'))
+            offset += length
+        return result, offset
+    if tag == _INTS32 or tag == _INTS64:
+        (count,) = _U32.unpack_from(data, offset)
+        layout = f"!{count}i" if tag == _INTS32 else f"!{count}q"
+        return list(struct.unpack_from(layout, data, offset + 4)), offset + 4 + struct.calcsize(layout)
+    if tag == _TABLE:
+        (count,) = _U32.unpack_from(data, offset)
+        width = data[offset + 4]
+        offset += 5
+        keys = []
+        columns = []
+        for _ in range(width):
+            key, offset = _binary_decode_key(data, offset)
+            keys.append(key)
+        for _ in range(width):
+            column, offset = _binary_decode(data, offset)
+            if type(column) is not list or len(column) != count:
+                raise FrameError("Table column does not match its row count")
+            columns.append(column)
+        if not columns:
+            raise FrameError("Table without columns")
+        return [dict(zip(keys, row)) for row in zip(*columns)], offset
+    if tag == _LIST8 or tag == _LIST32:
+        if tag == _LIST8:
+            count = data[offset]
+            offset += 1
+        else:
+            (count,) = _U32.unpack_from(data, offset)
+            offset += 4
+        result = []
+        for _ in range(count):
+            item, offset = _binary_decode(data, offset)
+            result.append(item)
+        return result, offset
+    if tag == _INT32:
+        return _I32.unpack_from(data, offset)[0], offset + 4
+    if tag == _STR32:
+        (length,) = _U32.unpack_from(data, offset)
+        end = offset + 4 + length
+        return data[offset + 4:end].decode('utf-8'), end
+    if tag == _NONE:
+        return None, offset
+    if tag == _TRUE:
+        return True, offset
+    if tag == _FALSE:
+        return False, offset
+    if tag == _INT64:
+        return _I64.unpack_from(data, offset)[0], offset + 8
+    if tag == _FLOAT:
+        return _F64.unpack_from(data, offset)[0], offset + 8
+    if tag == _BIGINT:
+        end = offset + 1 + data[offset]
+        return int(data[offset + 1:end]), end
+    raise FrameError(f"Unknown value tag {tag}")
+
+
+class BinaryCodec:
+    """Compact tagged binary bodies, built on struct
+
+    Each value is a one-byte type tag followed by its data: fixed-width
+    big-endian integers and floats, length-prefixed UTF-8 strings, and
+    count-prefixed lists and dicts. Known field names and common string
+    values (statuses, command names, default groups) are sent as single-byte
+    codes from BINARY_KEYS and BINARY_WORDS. The list shapes that dominate
+    large responses get bulk layouts that encode and decode in a few C calls:
+    lists of strings (user lists) are one NUL-separated blob, lists of
+    integers one struct-packed array, and lists of same-shaped dicts
+    (message pages, group lists) name their keys once and are stored column
+    by column.
+    """
+
+    name = "binary"
+
+    @staticmethod
+    def encode(payload: dict) -> bytes:
+        out = bytearray()
+        _binary_encode(payload, out)
+        return bytes(out)
+
+    @staticmethod
+    def decode(body: bytes) -> dict:
+        try:
+            payload, end = _binary_decode(body, 0)
+        except (IndexError, KeyError, RecursionError, UnicodeDecodeError, struct.error, ValueError) as e:
+            raise FrameError(f"Malformed binary frame: {e}")
+        if end != len(body) or type(payload) is not dict:
+            raise FrameError("Malformed binary frame")
+        return payload
+
+
+JSON_CODEC = JsonCodec()
+BINARY_CODEC = BinaryCodec()
+
+# Codecs by the name used to negotiate them, in order of preference
+CODECS = {codec.name: codec for codec in (BINARY_CODEC, JSON_CODEC)}
+
+
+def choose_codec(offered) -> Union[JsonCodec, BinaryCodec]:
+    """Pick the codec for a connection from the names its REGISTER offered (JSON if none fit)"""
+    if isinstance(offered, list):
+        for name in offered:
+            if isinstance(name, str) and name in CODECS:
+                return CODECS[name]
+    return JSON_CODEC
+
+
+class FrameCompressor:
+    """Compresses one connection's outgoing frames above a size threshold
+
+    Every compressed frame is flushed with Z_SYNC_FLUSH, so the peer can
+    decode it as soon as it arrives, while the zlib stream (and its window of
+    recently sent text) carries on across frames. Frames must therefore be
+    compressed in exactly the order they are written. The zlib stream is only
+    allocated once a frame needs it.
+    """
+
+    def __init__(self, threshold: int = COMPRESS_THRESHOLD, level: int = zlib.Z_DEFAULT_COMPRESSION):
+        self.threshold = threshold
+        self.level = level
+        self._stream = None
+
+    def compress(self, frame: bytes) -> bytes:
+        """Return a complete frame, compressed if its body is large enough"""
+        if len(frame) - HEADER.size < self.threshold:
+            return frame
+
+        if self._stream is None:
+            self._stream = zlib.compressobj(self.level, zdict=ZLIB_DICTIONARY)
+        body = self._stream.compress(memoryview(frame)[HEADER.size:]) + self._stream.flush(zlib.Z_SYNC_FLUSH)
+        return HEADER.pack(len(body) | COMPRESSED_FLAG) + body
+
+
+def choose_compression(offered):
+    """Pick a compression method from the names a REGISTER offered, or None"""
+    if isinstance(offered, list):
+        for name in offered:
+            if name in COMPRESSION_METHODS:
+                return name
+    return None
+
+
+def tag_response(request: dict, response: dict) -> dict:
+    """Copy the request's correlation ID (if any) onto its response"""
+    if REQUEST_ID in request:
+        response[REQUEST_ID] = request[REQUEST_ID]
+    return response
+
+
+def encode_frame(payload: dict, codec=JSON_CODEC) -> bytes:
+    """Serialize a message into a complete length-prefixed frame"""
+    body = codec.encode(payload)
+    return HEADER.pack(len(body)) + body
+
+
+def send_frame(sock: socket.socket, payload: dict, codec=JSON_CODEC):
+    """Send a message as one frame, blocking until it is fully written"""
+    sock.sendall(encode_frame(payload, codec))
+
+
+class FrameDecoder:
+    """Incremental decoder that turns a byte stream into frame bodies
+
+    Bytes are appended to an internal buffer and each frame is sliced out
+    exactly once, as soon as its last byte arrives. Compressed frames are only
+    accepted after enable_decompression(), and are inflated in arrival order.
+    """
+
+    def __init__(self, max_frame_size: int = MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+        self.decompression = False
+        self._inflater = None
+
+    def enable_decompression(self):
+        """Accept compressed frames from now on (once compression is negotiated)"""
+        self.decompression = True
+
+    def _inflate(self, body: bytes) -> bytes:
+        """Decompress one frame body, continuing the connection's zlib stream"""
+        if not self.decompression:
+            raise FrameError("Compressed frame on a connection without compression")
+        if self._inflater is None:
+            self._inflater = zlib.decompressobj(zdict=ZLIB_DICTIONARY)
+
+        try:
+            body = self._inflater.decompress(body, self.max_frame_size + 1)
+        except zlib.error as e:
+            raise FrameError(f"Corrupt compressed frame: {e}")
+        if len(body) > self.max_frame_size or self._inflater.unconsumed_tail:
+            raise FrameError(f"Decompressed frame exceeds limit of {self.max_frame_size}")
+        return body
+
+    def feed(self, data: bytes):
+        """Add received bytes and return the bodies of all completed frames"""
+        buffer = self._buffer
+        buffer += data
+
+        bodies = []
+        offset = 0
+        available = len(buffer)
+
+        while available - offset >= HEADER.size:
+            (length,) = HEADER.unpack_from(buffer, offset)
+            compressed = length & COMPRESSED_FLAG
+            length &= COMPRESSED_FLAG - 1
+            if length > self.max_frame_size:
+                raise FrameError(f"Frame of {length} bytes exceeds limit of {self.max_frame_size}")
+
+            end = offset + HEADER.size + length
+            if end > available:
+                break
+
+            body = bytes(buffer[offset + HEADER.size:end])
+            bodies.append(self._inflate(body) if compressed else body)
+            offset = end
+
+        # Drop consumed bytes once per call rather than once per frame
+        if offset:
+            del buffer[:offset]
+
+        return bodies
+
+    def pending(self) -> int:
+        """Number of buffered bytes that do not yet form a complete frame"""
+        return len(self._buffer)
+
+
+class FrameReader:
+    """Blocking reader that returns one decoded message per call"""
+
+    def __init__(self, sock: socket.socket, codec=JSON_CODEC):
+        self.sock = sock
+        self.codec = codec  # switched after the REGISTER handshake
+        self.decoder = FrameDecoder()
+        self._ready = deque()
+
+    def read(self):
+        """Return the next message, or None once the peer closes the connection"""
+        while not self._ready:
+            data = self.sock.recv(RECV_SIZE)
+            if not data:
+                return None
+            self._ready.extend(self.decoder.feed(data))
+
+        return self.codec.decode(self._ready.popleft())
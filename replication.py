@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Bulletin Board Replication
+Read replicas kept up to date by shipping the primary's message log.
+
+A server started with --replication-port serves its --log to followers. A
+follower (server.py --follow HOST:PORT) tells it how many bytes of the log
+it already has, and from then on receives the rest of the log as it grows,
+in the log's own record format. The follower applies each record the way a
+restart replays them, so it has the same groups, messages and msg_ids as
+the primary, a moment later. Only records the primary has made durable are
+shipped.
+
+A follower with its own --log writes the records there byte for byte, so
+its log is a copy of the primary's: after a restart it asks for the log
+from where its copy ends. That copy can be shipped on to more followers.
+
+Messages are length-prefixed JSON frames, as in the client protocol:
+
+  follow     follower -> primary: {"position": bytes of the log it has}
+  following  primary -> follower: {"server": the primary's client address}
+  log        primary -> follower: {"start": offset, "data": base64 log bytes,
+             "end": the primary's log end}; sent with no data every
+             HEARTBEAT_INTERVAL while the log is idle
+  error      primary -> follower: the position does not fit the log
+"""
+
+import base64
+import socket
+import threading
+import time
+from typing import Dict
+
+from protocol import FrameError, FrameReader, encode_frame, send_frame
+from storage import split_records
+
+# Seconds between log frames when there is nothing new to ship
+HEARTBEAT_INTERVAL = 1.0
+
+# Most log bytes shipped in one frame (base64 must stay under MAX_FRAME_SIZE)
+SHIP_CHUNK = 1024 * 1024
+
+# Seconds a follower waits before reconnecting to a primary it lost
+RECONNECT_DELAY = 1.0
+
+
+class ReplicationError(Exception):
+    """The follower's copy of the log cannot continue from what the primary sent"""
+
+
+class _Follower:
+    """The primary's view of one connected follower"""
+
+    def __init__(self, address: str, position: int):
+        self.address = address
+        self.position = position  # log bytes shipped to it
+        self.connected_at = time.time()
+
+
+class LogShipper:
+    """Serves the message log to followers on the replication port
+
+    Each follower has its own thread, which waits for the log to grow and
+    ships the new bytes once they are durable.
+    """
+
+    def __init__(self, log, host: str, port: int, server_address: str):
+        self.log = log
+        self.host = host
+        self.port = port
+        self.server_address = server_address  # where the primary's clients connect
+        self.listener = None
+        self.followers: Dict[int, _Follower] = {}  # id of its socket -> follower
+        self.lock = threading.Lock()  # guards followers
+
+    def start(self):
+        """Listen for followers"""
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((self.host, self.port))
+        self.listener.listen()
+        acceptor = threading.Thread(target=self._accept_loop)
+        acceptor.daemon = True
+        acceptor.start()
+        print(f"[SERVER] Shipping {self.log.path} to followers on port {self.port}")
+
+    def report(self) -> dict:
+        """The log's end and how far each follower has been shipped"""
+        end = self.log.end
+        with self.lock:
+            followers = [
+                {"address": follower.address, "position": follower.position,
+                 "lag_bytes": end - follower.position,
+                 "connected_seconds": round(time.time() - follower.connected_at, 3)}
+                for follower in self.followers.values()
+            ]
+        return {"role": "primary", "position": end, "followers": followers}
+
+    def _accept_loop(self):
+        """Serve every follower that connects"""
+        while True:
+            try:
+                sock, address = self.listener.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            serve = threading.Thread(target=self._serve, args=(sock, f"{address[0]}:{address[1]}"))
+            serve.daemon = True
+            serve.start()
+
+    def _serve(self, sock, address: str):
+        """Ship the log to one follower until it disconnects or the log closes"""
+        try:
+            request = FrameReader(sock).read()
+            if request is None or request.get("op") != "follow":
+                return
+            position = request.get("position")
+            problem = self._check(position)
+            if problem:
+                print(f"[SERVER] Refused follower {address}: {problem}")
+                send_frame(sock, {"op": "error", "message": problem})
+                return
+
+            follower = _Follower(address, position)
+            with self.lock:
+                self.followers[id(sock)] = follower
+            print(f"[SERVER] Follower {address} connected at byte {position}")
+            send_frame(sock, {"op": "following", "server": self.server_address})
+            self._ship(sock, follower)
+        except (OSError, FrameError):
+            pass  # the follower went away, or the log closed under it
+        finally:
+            with self.lock:
+                if self.followers.pop(id(sock), None) is not None:
+                    print(f"[SERVER] Follower {address} disconnected")
+            sock.close()
+
+    def _check(self, position) -> str:
+        """Why a follower cannot start at position, or None if it can"""
+        if not isinstance(position, int) or position < 0:
+            return "invalid position"
+        if position > self.log.end:
+            return f"it has {position} bytes of the log, but the log only has {self.log.end}"
+        if position < self.log.end:
+            try:
+                self.log.read(position)
+            except ValueError:
+                return f"byte {position} is not the start of a record"
+        return None
+
+    def _ship(self, sock, follower: _Follower):
+        """Send the log from the follower's position on, and a heartbeat whenever it is idle"""
+        while not self.log.closed:
+            end = self.log.wait_past(follower.position, HEARTBEAT_INTERVAL)
+            data = b""
+            if end > follower.position:
+                self.log.sync()  # only ship what the primary will still have after a crash
+                data = self.log.read_bytes(follower.position, min(end, follower.position + SHIP_CHUNK))
+            sock.sendall(encode_frame({
+                "op": "log",
+                "start": follower.position,
+                "data": base64.b64encode(data).decode("ascii"),
+                "end": end
+            }))
+            with self.lock:
+                follower.position += len(data)
+
+
+class LogFollower:
+    """A read replica's connection to its primary
+
+    Receives the primary's log and has the server apply it record by record
+    (server.apply_replicated), reconnecting whenever the primary goes away.
+    The state below is written by the follower's thread only.
+    """
+
+    def __init__(self, server, primary: str, position: int = 0):
+        self.server = server
+        self.primary = primary  # host:port of the primary's replication port
+        self.server_address = None  # where the primary's clients connect, once known
+        self.position = position  # log bytes applied
+        self.pending = b""  # bytes received after position, short of a whole record
+        self.primary_end = None  # the primary's log end when it last said
+        self.caught_up_at = None  # when this last had everything the primary had logged
+        self.connected = False
+        self.stopped = False
+        self.apply_lock = threading.Lock()  # held while applying, so stop() can wait it out
+
+    def start(self):
+        """Start following the primary"""
+        follower = threading.Thread(target=self._run)
+        follower.daemon = True
+        follower.start()
+
+    def stop(self):
+        """Stop applying the primary's log; once this returns, the server may close its own"""
+        with self.apply_lock:
+            self.stopped = True
+
+    def lag(self) -> dict:
+        """How far behind the primary this replica is"""
+        primary_end = self.primary_end
+        caught_up_at = self.caught_up_at
+        return {
+            "role": "follower",
+            "primary": self.primary,
+            "primary_server": self.server_address,
+            "connected": self.connected,
+            "position": self.position,
+            "primary_position": primary_end,
+            "lag_bytes": max(primary_end - self.position, 0) if primary_end is not None else None,
+            "lag_seconds": round(time.time() - caught_up_at, 3) if caught_up_at is not None else None
+        }
+
+    def _run(self):
+        """Follow the primary, reconnecting after a delay whenever the connection breaks"""
+        while not self.stopped:
+            try:
+                self._follow()
+            except (OSError, FrameError) as e:
+                if self.connected:
+                    print(f"[SERVER] Lost the primary {self.primary}: {e}")
+            except ReplicationError as e:
+                print(f"[SERVER] Stopped following {self.primary}: {e}")
+                self.stopped = True
+            self.connected = False
+            self.pending = b""
+            if not self.stopped:
+                time.sleep(RECONNECT_DELAY)
+
+    def _follow(self):
+        """Receive and apply the primary's log until the connection breaks"""
+        host, port = self.primary.rsplit(":", 1)
+        with socket.create_connection((host, int(port)), timeout=HEARTBEAT_INTERVAL * 5) as sock:
+            send_frame(sock, {"op": "follow", "position": self.position})
+            reader = FrameReader(sock)
+
+            reply = reader.read()
+            if reply is None:
+                raise OSError("the primary closed the connection")
+            if reply.get("op") == "error":
+                raise ReplicationError(reply["message"])
+            self.server_address = reply["server"]
+            self.connected = True
+            print(f"[SERVER] Following {self.primary} from byte {self.position}")
+
+            while True:
+                frame = reader.read()
+                if frame is None:
+                    raise OSError("the primary closed the connection")
+                if frame["start"] != self.position + len(self.pending):
+                    raise ReplicationError(f"expected the log from byte {self.position + len(self.pending)}, "
+                                           f"got it from byte {frame['start']}")
+                with self.apply_lock:
+                    if self.stopped:
+                        return
+                    self._apply(base64.b64decode(frame["data"]))
+                self.primary_end = frame["end"]
+                if self.position >= self.primary_end:
+                    self.caught_up_at = time.time()
+
+    def _apply(self, data: bytes):
+        """Apply every whole record received so far, keeping any partial one for the next frame"""
+        if not data:
+            return
+        self.pending += data
+        applied = 0
+        try:
+            for record, frame in split_records(self.pending):
+                self.server.apply_replicated(record, frame)
+                applied += len(frame)
+                self.position += len(frame)
+        except ValueError as e:
+            raise ReplicationError(str(e))
+        finally:
+            self.pending = self.pending[applied:]
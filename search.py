@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Bulletin Board Search
+Incremental inverted index over message subjects and bodies.
+
+Every term maps to a posting list of the msg_ids that contain it. Message IDs
+only ever grow, so each posting list is an append-only array already sorted
+by ID, and the newest matches are read from its end. A query never scans the
+messages themselves.
+
+Query syntax: whitespace-separated words, all of which must match (AND).
+A word ending in "*" matches any term starting with it (prefix query).
+"""
+
+import base64
+import bisect
+import heapq
+import re
+from array import array
+from typing import Dict, List
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str):
+    """Split text into lowercase index terms"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def _descending(postings: array, before_id: int = None):
+    """Yield the IDs in one posting list newest first, starting below before_id"""
+    end = len(postings) if before_id is None else bisect.bisect_left(postings, before_id)
+    for position in range(end - 1, -1, -1):
+        yield postings[position]
+
+
+def _contains(postings: array, msg_id: int) -> bool:
+    """Whether a sorted posting list contains an ID"""
+    position = bisect.bisect_left(postings, msg_id)
+    return position < len(postings) and postings[position] == msg_id
+
+
+class SearchIndex:
+    """Term and prefix search over one group's messages, newest results first"""
+
+    def __init__(self):
+        self.postings: Dict[str, array] = {}  # term -> msg_ids, ascending
+        self.terms: List[str] = []            # sorted vocabulary, for prefix lookups
+
+    def add(self, msg_id: int, *texts: str):
+        """Index a new message (IDs must be added in increasing order)"""
+        for term in set(tokenize(" ".join(texts))):
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = array("q")
+                bisect.insort(self.terms, term)
+            postings.append(msg_id)
+
+    def copy(self) -> "SearchIndex":
+        """An independent copy, to save while this index keeps changing"""
+        index = SearchIndex()
+        index.postings = {term: array("q", postings) for term, postings in self.postings.items()}
+        index.terms = list(self.terms)
+        return index
+
+    def state(self) -> dict:
+        """The index as JSON-friendly values for a snapshot (see restore())"""
+        msg_ids = array("q")
+        for term in self.terms:
+            msg_ids.extend(self.postings[term])
+        return {
+            "terms": self.terms,
+            "counts": [len(self.postings[term]) for term in self.terms],
+            "ids": base64.b64encode(msg_ids.tobytes()).decode("ascii")
+        }
+
+    @classmethod
+    def restore(cls, state: dict) -> "SearchIndex":
+        """Rebuild an index from state()"""
+        index = cls()
+        msg_ids = array("q")
+        msg_ids.frombytes(base64.b64decode(state["ids"]))
+        start = 0
+        for term, count in zip(state["terms"], state["counts"]):
+            index.postings[term] = msg_ids[start:start + count]
+            start += count
+        index.terms = state["terms"]
+        return index
+
+    def _expand(self, prefix: str):
+        """Posting lists of every term starting with prefix
+
+        All of them are merged, however many there are: leaving any out could
+        drop the newest matches from a page.
+        """
+        start = bisect.bisect_left(self.terms, prefix)
+        end = bisect.bisect_left(self.terms, prefix + "\U0010ffff", start)
+        return [self.postings[term] for term in self.terms[start:end]]
+
+    def _clauses(self, query: str):
+        """Parse a query into clauses, each a list of posting lists any of which may match"""
+        clauses = []
+        for word in query.split():
+            tokens = tokenize(word)
+            for position, token in enumerate(tokens):
+                if word.endswith("*") and position == len(tokens) - 1:
+                    clauses.append(self._expand(token))
+                else:
+                    postings = self.postings.get(token)
+                    clauses.append([postings] if postings is not None else [])
+        return clauses
+
+    def search(self, query: str, before_id: int = None, limit: int = 20, accept=None):
+        """Return (matching msg_ids newest first, whether more matches exist)
+
+        Only IDs below before_id are considered, so the last ID of one page is
+        the cursor for the next. accept, if given, filters out IDs whose
+        message no longer exists.
+        """
+        clauses = self._clauses(query)
+        if not clauses or not all(clauses):
+            return [], False
+
+        # Walk the rarest clause and probe the others
+        clauses.sort(key=lambda clause: sum(len(postings) for postings in clause))
+        driver, others = clauses[0], clauses[1:]
+
+        if len(driver) == 1:
+            candidates = _descending(driver[0], before_id)
+        else:
+            candidates = heapq.merge(*(_descending(p, before_id) for p in driver), reverse=True)
+
+        results = []
+        previous = None
+        for msg_id in candidates:
+            if msg_id == previous:
+                continue  # several prefix terms matched the same message
+            previous = msg_id
+
+            if all(any(_contains(postings, msg_id) for postings in clause) for clause in others):
+                if accept is None or accept(msg_id):
+                    results.append(msg_id)
+                    if len(results) > limit:
+                        break
+
+        return results[:limit], len(results) > limit
@@ -3,26 +3,155 @@
 Bulletin Board Server
 A multithreaded server implementation for a bulletin board system
 supporting public and private group messaging.
+
+Two engines are available: the default thread-per-client engine and an
+asyncio engine that serves every connection from a single event loop.
+Either can run as several worker processes (--workers) kept in step by
+the bus in bus.py, or as one node of a cluster that shares the groups out
+between several servers (--cluster-port, see cluster.py).
 """
 
+import argparse
+import asyncio
+import bisect
+import contextlib
+import heapq
+import itertools
+import os
+import re
+import shutil
+import signal
 import socket
+import sys
 import threading
-import json
 import time
+from collections import deque
 from datetime import datetime
-from typing import Dict, List, Set
+from typing import Dict, Set
+
+from bus import BusClient, BusHub
+from cluster import ClusterNode, RemoteClient
+from protocol import (
+    COMPRESS_THRESHOLD, JSON_CODEC, FrameCompressor, FrameDecoder, FrameReader,
+    choose_codec, choose_compression, encode_frame, tag_response
+)
+from metrics import SIZE_BUCKETS, Metrics, start_http_server
+from profiling import ProfileSession
+from replication import LogFollower, LogShipper
+from search import SearchIndex
+from storage import (
+    DEFAULT_COMMIT_WINDOW, DURABILITY_MODES, SEGMENT_MESSAGES, LogError, MessageLog, SegmentStore, Snapshot
+)
+
+# Pending connections the listening socket will queue before refusing new ones
+LISTEN_BACKLOG = 1024
+
+# Bytes a connection may have waiting to be written before its overflow policy applies
+OUTBOUND_BUFFER_BYTES = 1024 * 1024
+
+# What gives when a client falls that far behind
+OVERFLOW_POLICIES = ("drop-new", "drop-oldest", "disconnect")
+DEFAULT_OVERFLOW_POLICY = "drop-new"
+
+# Most frames the writer combines into a single send
+MAX_WRITE_BATCH = 64
+
+# How message post times are shown to users
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Most recent messages each group keeps in memory when cold storage is enabled
+DEFAULT_HOT_MESSAGES = 2048
+
+# Seconds between snapshots of the boards, taken if the log has grown since the last one
+DEFAULT_SNAPSHOT_INTERVAL = 300
+
+# Messages returned by a HISTORY or SEARCH request by default, and at most per page/frame
+DEFAULT_HISTORY_LIMIT = 20
+MAX_HISTORY_PAGE = 200
+
+# How long (seconds) a recipient's notifications are gathered into one frame
+DEFAULT_COALESCE_WINDOW = 0.005
+
+# Digest intervals (seconds) a client may ask for
+MIN_DIGEST_INTERVAL = 1
+MAX_DIGEST_INTERVAL = 3600
+
+# Most commands a single BATCH request may carry
+MAX_BATCH_COMMANDS = 256
+
+# How long (seconds) a PROFILE runs by default, and at most
+DEFAULT_PROFILE_SECONDS = 30
+MAX_PROFILE_SECONDS = 3600
+
+# Commands that act on the public board (every other group command names its group_id)
+PUBLIC_COMMANDS = {"JOIN", "POST", "USERS", "LEAVE", "MESSAGE", "HISTORY", "SEARCH"}
+
+# Commands that act on the group named by their group_id
+GROUP_COMMANDS = {
+    "GROUPJOIN", "GROUPPOST", "GROUPUSERS", "GROUPLEAVE", "GROUPMESSAGE", "GROUPHISTORY", "GROUPSEARCH",
+    "CREATEGROUP", "DELETEGROUP"
+}
+
+# Group IDs name segment directories, so they are limited to a safe alphabet
+GROUP_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+MAX_GROUP_NAME = 100
+
+# Groups listed per GROUPS page
+DEFAULT_GROUPS_PAGE = 100
+MAX_GROUPS_PAGE = 1000
+
+# Groups given their own bulletin_group_members series: only the largest, however many there are
+MAX_GROUP_GAUGES = 50
+
+# Every command process_command understands; others are counted as UNKNOWN in the metrics
+COMMANDS = PUBLIC_COMMANDS | GROUP_COMMANDS | {
+    "GROUPS", "DIGEST", "LAG", "BATCH", "STATS", "PROFILE", "REPLICATION"
+}
+
+# Commands that change the boards: a read replica refuses them, and with
+# --workers they wait for the worker hub to answer
+WRITE_COMMANDS = {"POST", "GROUPPOST", "CREATEGROUP", "DELETEGROUP"}
 
 
 class Message:
-    """Represents a message posted on the bulletin board"""
+    """Represents a message posted on the bulletin board
+
+    Kept compact because boards retain many messages: no per-instance
+    __dict__, sender and group IDs interned so every post by the same user
+    shares one string, and the post time stored as integer epoch seconds that
+    are only formatted when a message is displayed.
+
+    location is where the message's post record sits in the message log. A
+    message restored from a snapshot starts with content None, and its group
+    reads the body from there the first time it is needed.
+    """
 
-    def __init__(self, msg_id: int, sender: str, subject: str, content: str, group_id: str = "public"):
+    __slots__ = ("msg_id", "sender", "subject", "content", "group_id", "posted_at", "location")
+
+    def __init__(self, msg_id: int, sender: str, subject: str, content: str, group_id: str = "public",
+                 posted_at: int = None, location: int = None):
         self.msg_id = msg_id
-        self.sender = sender
+        self.sender = sys.intern(sender)
         self.subject = subject
         self.content = content
-        self.post_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.group_id = group_id
+        self.group_id = sys.intern(group_id)
+        self.posted_at = int(time.time()) if posted_at is None else posted_at
+        self.location = location
+
+    @classmethod
+    def from_record(cls, record, group_id: str):
+        """Rebuild a message from its storage record"""
+        msg_id, sender, subject, content, posted_at = record
+        return cls(msg_id, sender, subject, content, group_id, posted_at)
+
+    def to_record(self):
+        """Compact tuple form used by cold storage"""
+        return (self.msg_id, self.sender, self.subject, self.content, self.posted_at)
+
+    @property
+    def post_date(self):
+        """Post time formatted for display"""
+        return datetime.fromtimestamp(self.posted_at).strftime(DATE_FORMAT)
 
     def to_dict(self):
         """Convert message to dictionary for JSON serialization"""
@@ -41,76 +170,839 @@ class Message:
 
 
 class Group:
-    """Represents a message board group"""
+    """Represents a message board group
+
+    Messages are kept in a dict keyed by msg_id. IDs come from a monotonic
+    counter, so insertion order is ID order: lookups and removals are O(1) and
+    the most recent messages are read from the end without touching the rest.
+
+    With a SegmentStore attached, only the newest hot_limit messages (plus at
+    most one segment's worth waiting to spill) stay in memory; older ones are
+    written out to immutable segments and read back on demand, so memory use
+    does not grow with the length of the history.
+
+    When a MessageLog is attached, every post, join and leave is appended to
+    it as it happens; apply_record() replays those records.
 
-    def __init__(self, group_id: str, name: str):
-        self.group_id = group_id
+    Every stored message, hot or cold, is added to a SearchIndex as it
+    arrives, so search() never scans the messages.
+
+    There may be hundreds of thousands of groups, most of them idle, so a
+    group has no per-instance __dict__, and its search index and segment
+    store are only created once it has messages for them.
+
+    snapshot() and restore() save and reload the whole group. Restored
+    messages leave their bodies in the message log (bodies) until they are
+    read.
+    """
+
+    __slots__ = ("group_id", "name", "creator", "members", "messages", "message_counter", "lock",
+                 "log", "cold", "cold_dir", "hot_limit", "index", "bodies")
+
+    def __init__(self, group_id: str, name: str, log: MessageLog = None, cold_dir: str = None,
+                 hot_limit: int = DEFAULT_HOT_MESSAGES, lock=None, creator: str = None):
+        self.group_id = sys.intern(group_id)
         self.name = name
+        self.creator = creator  # who made it with CREATEGROUP; None for the built-in groups
         self.members: Set[str] = set()
-        self.messages: List[Message] = []
+        self.messages: Dict[int, Message] = {}  # hot tail: msg_id -> message, oldest first
         self.message_counter = 0
+        self.lock = lock if lock is not None else threading.RLock()  # guards members and messages
+        self.log = log
+        self.cold = None  # SegmentStore, opened in cold_dir when the first segment spills
+        self.cold_dir = cold_dir
+        self.hot_limit = hot_limit
+        self.index = None  # SearchIndex, from the first message on
+        self.bodies = None  # MessageLog holding the bodies of messages restored from a snapshot
 
     def add_member(self, username: str):
         """Add a member to the group"""
+        if username in self.members:
+            return
         self.members.add(username)
+        if self.log:
+            self.log.append({"op": "join", "group_id": self.group_id, "username": username})
 
     def remove_member(self, username: str):
         """Remove a member from the group"""
+        if username not in self.members:
+            return
         self.members.discard(username)
+        if self.log:
+            self.log.append({"op": "leave", "group_id": self.group_id, "username": username})
 
     def add_message(self, sender: str, subject: str, content: str):
         """Add a new message to the group"""
         self.message_counter += 1
         msg = Message(self.message_counter, sender, subject, content, self.group_id)
-        self.messages.append(msg)
+        self._store(msg)
+        if self.log:
+            msg.location = self.log.append({
+                "op": "post",
+                "group_id": self.group_id,
+                "msg_id": msg.msg_id,
+                "sender": msg.sender,
+                "subject": msg.subject,
+                "content": msg.content,
+                "posted_at": msg.posted_at
+            })
+        return msg
+
+    def apply_record(self, record: dict, location: int = None):
+        """Apply a logged event (found at location in the log) without logging it again"""
+        op = record["op"]
+        if op == "post":
+            msg = Message(record["msg_id"], record["sender"], record["subject"], record["content"],
+                          self.group_id, record["posted_at"], location)
+            self._store(msg)
+            self.message_counter = max(self.message_counter, msg.msg_id)
+        elif op == "join":
+            self.members.add(record["username"])
+        elif op == "leave":
+            self.members.discard(record["username"])
+
+    def _store(self, msg: Message):
+        """Add a message to the hot tail, spilling the oldest to cold storage when full"""
+        self.messages[msg.msg_id] = msg
+        if self.index is None:
+            self.index = SearchIndex()
+        self.index.add(msg.msg_id, msg.subject, msg.content)
+        if self.cold_dir is not None and len(self.messages) >= self.hot_limit + SEGMENT_MESSAGES:
+            if self.cold is None:
+                self.cold = SegmentStore(self.cold_dir)
+            oldest = list(itertools.islice(self.messages, SEGMENT_MESSAGES))
+            self.cold.append([self._loaded(self.messages.pop(msg_id)).to_record() for msg_id in oldest])
+
+    def _loaded(self, msg: Message):
+        """msg, with its body read from the log if it was restored without one"""
+        if msg.content is None:
+            msg.content = self.bodies.read(msg.location)["content"]
         return msg
 
+    def message_count(self):
+        """Number of messages currently stored (hot and cold)"""
+        return len(self.messages) + (len(self.cold) if self.cold is not None else 0)
+
     def get_last_n_messages(self, n: int = 2):
-        """Get the last N messages"""
-        return self.messages[-n:] if len(self.messages) >= n else self.messages
+        """Get the last N messages, oldest first"""
+        recent = [self._loaded(msg) for msg in itertools.islice(reversed(self.messages.values()), n)]
+        if len(recent) < n and self.cold is not None:
+            for record in itertools.islice(self.cold.newest_first(), n - len(recent)):
+                recent.append(Message.from_record(record, self.group_id))
+        recent.reverse()
+        return recent
 
     def get_message_by_id(self, msg_id: int):
         """Get a message by its ID"""
-        for msg in self.messages:
-            if msg.msg_id == msg_id:
-                return msg
-        return None
+        msg = self.messages.get(msg_id)
+        if msg is None and self.cold is not None:
+            record = self.cold.get(msg_id)
+            if record is not None:
+                msg = Message.from_record(record, self.group_id)
+        return msg if msg is None else self._loaded(msg)
+
+    def iter_messages(self, since_id: int = 0, before_id: int = None, newest_first: bool = False):
+        """Yield messages with since_id < msg_id < before_id, reading the store in place
+
+        IDs are dense, so the hot tail is walked by ID from the requested end
+        rather than scanned; cold messages are located through the segment index.
+        """
+        upper = self.message_counter + 1
+        if before_id is not None:
+            upper = min(upper, before_id)
+        hot_floor = next(iter(self.messages), upper)  # oldest ID still in memory
+
+        if newest_first:
+            for msg_id in range(upper - 1, max(hot_floor, since_id + 1) - 1, -1):
+                msg = self.messages.get(msg_id)
+                if msg is not None:
+                    yield self._loaded(msg)
+            if self.cold is not None:
+                for record in self.cold.newest_first(min(upper, hot_floor)):
+                    if record[0] <= since_id:
+                        return
+                    yield Message.from_record(record, self.group_id)
+        else:
+            if self.cold is not None:
+                for record in self.cold.oldest_first(since_id):
+                    if record[0] >= min(upper, hot_floor):
+                        break
+                    yield Message.from_record(record, self.group_id)
+            for msg_id in range(max(hot_floor, since_id + 1), upper):
+                msg = self.messages.get(msg_id)
+                if msg is not None:
+                    yield self._loaded(msg)
+
+    def search(self, query: str, before_id: int = None, limit: int = DEFAULT_HISTORY_LIMIT):
+        """Messages matching a query, newest first; returns (messages, more)
+
+        Removed and expired messages stay in the index and are skipped here.
+        """
+        if self.index is None:
+            return [], False
+        found = {}
+
+        def exists(msg_id):
+            msg = self.get_message_by_id(msg_id)
+            if msg is not None:
+                found[msg_id] = msg
+            return msg is not None
+
+        msg_ids, more = self.index.search(query, before_id, limit, accept=exists)
+        return [found[msg_id] for msg_id in msg_ids], more
+
+    def remove_message(self, msg_id: int):
+        """Delete a message; returns it, or None if it does not exist"""
+        msg = self.messages.pop(msg_id, None)
+        if msg is not None:
+            self._loaded(msg)
+        if msg is None and self.cold is not None:
+            record = self.cold.remove(msg_id)
+            if record is not None:
+                msg = Message.from_record(record, self.group_id)
+        return msg
+
+    def expire_messages(self, keep: int):
+        """Drop the oldest messages so that at most `keep` remain"""
+        excess = self.message_count() - keep
+        if excess <= 0:
+            return
+
+        # Cold messages are the oldest, so expire those first
+        if self.cold is not None and len(self.cold):
+            expired = list(itertools.islice(self.cold.oldest_first(), excess))
+            self.cold.expire_below(expired[-1][0] + 1)
+            excess -= len(expired)
+
+        for msg_id in list(itertools.islice(self.messages, max(excess, 0))):
+            del self.messages[msg_id]
+
+    def snapshot(self) -> dict:
+        """The group's state for a snapshot (call with the lock held)
+
+        Messages are saved without their bodies, which stay in the log at
+        their location. The search index is copied, to be encoded (index.state())
+        once the lock is released.
+        """
+        return {
+            "group_id": self.group_id,
+            "name": self.name,
+            "creator": self.creator,
+            "counter": self.message_counter,
+            "members": list(self.members),
+            "messages": [
+                [msg.msg_id, msg.sender, msg.subject, msg.posted_at,
+                 msg.location if msg.location is not None else msg.content]
+                for msg in self.messages.values()
+            ],
+            "index": self.index.copy() if self.index is not None else None,
+            "cold": self.cold.state() if self.cold is not None else None
+        }
+
+    def restore(self, state: dict, bodies: MessageLog):
+        """Load a snapshot() of this group, leaving message bodies in bodies until read"""
+        self.message_counter = state["counter"]
+        self.members = set(state["members"])
+        self.bodies = bodies
+        for msg_id, sender, subject, posted_at, body in state["messages"]:
+            if isinstance(body, int):
+                msg = Message(msg_id, sender, subject, None, self.group_id, posted_at, body)
+            else:
+                msg = Message(msg_id, sender, subject, body, self.group_id, posted_at)
+            self.messages[msg_id] = msg
+        if state["index"] is not None:
+            self.index = SearchIndex.restore(state["index"])
+        if state["cold"] is not None:
+            if self.cold_dir is None:
+                raise ValueError(f"group {self.group_id} has cold segments but there is no --data-dir")
+            self.cold = SegmentStore.restore(self.cold_dir, state["cold"])
+
+
+class ClientConnection:
+    """A client socket with a bounded outbound buffer drained by one writer thread
+
+    Every frame for the client (responses and notifications) goes through the
+    buffer, so writes to the socket are strictly ordered and never interleave.
+    The writer sends whatever has accumulated in one call. Once compression
+    is enabled, the writer also compresses large frames, since the zlib
+    stream must see frames in the order they are written.
+
+    The buffer holds at most buffer_limit bytes. When a client falls that far
+    behind, the overflow policy decides what gives: new notifications are
+    dropped (drop-new), queued notifications are dropped oldest first to make
+    room (drop-oldest), or the client is disconnected (disconnect). Responses
+    are never dropped; the client's own handler waits for room instead, so
+    a stalled client only ever slows itself down.
+    """
+
+    def __init__(self, client_socket: socket.socket, address, buffer_limit: int = OUTBOUND_BUFFER_BYTES,
+                 policy: str = DEFAULT_OVERFLOW_POLICY):
+        self.socket = client_socket
+        self.address = address
+        self.buffer_limit = buffer_limit
+        self.policy = policy
+        self.outbound = deque()  # (frame, is notification, time queued)
+        self.cond = threading.Condition()
+        self.codec = JSON_CODEC  # switched after the REGISTER handshake
+        self.compressor = None   # owned by the writer thread
+        self.digest = None       # digest interval in seconds, if the client asked for one
+        self.closed = False
+
+        # Lag counters
+        self.queued_bytes = 0
+        self.peak_bytes = 0
+        self.dropped = 0  # notifications dropped by the overflow policy
+        self.lagging = False  # dropping since the buffer last drained
+
+        self.writer = threading.Thread(target=self._write_loop)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def send(self, data: bytes):
+        """Queue a response frame, waiting for room if the client is behind"""
+        with self.cond:
+            while not self.closed and self._full(len(data)):
+                if self.policy == "disconnect":
+                    self._overflow()
+                elif not (self.policy == "drop-oldest" and self._evict(len(data))):
+                    self.cond.wait()
+            if not self.closed:
+                self._append(data, False)
+
+    def notify(self, data: bytes) -> bool:
+        """Queue a notification frame without blocking; returns False if it was dropped"""
+        with self.cond:
+            if self.closed:
+                return False
+            if self._full(len(data)):
+                if self.policy == "disconnect":
+                    self._overflow()
+                    return False
+                if not (self.policy == "drop-oldest" and self._evict(len(data))):
+                    self._dropped(1)
+                    return False
+            self._append(data, True)
+            return True
+
+    def enable_compression(self, compressor: FrameCompressor):
+        """Compress frames queued after this call; frames already queued go out as they are"""
+        with self.cond:
+            if not self.closed:
+                self.outbound.append((compressor, False, time.monotonic()))
+                self.cond.notify_all()
+
+    def lag(self) -> dict:
+        """How far behind the client is: buffered bytes/frames, age of the oldest, drops"""
+        with self.cond:
+            oldest = self.outbound[0][2] if self.outbound else None
+            return {
+                "queued_bytes": self.queued_bytes,
+                "queued_frames": len(self.outbound),
+                "lag_seconds": round(time.monotonic() - oldest, 3) if oldest is not None else 0,
+                "peak_bytes": self.peak_bytes,
+                "dropped": self.dropped,
+                "policy": self.policy,
+            }
+
+    def close(self):
+        """Close the connection once everything already queued has been written"""
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify_all()
+            if self.queued_bytes >= self.buffer_limit:
+                # The writer is stuck behind a client that stopped reading
+                self._close_socket()
+
+    def _full(self, size: int) -> bool:
+        """Whether a frame of size bytes would overflow the buffer (an empty buffer takes anything)"""
+        return bool(self.outbound) and self.queued_bytes + size > self.buffer_limit
+
+    def _append(self, data: bytes, notification: bool):
+        """Add a frame to the buffer and wake the writer (cond held)"""
+        self.outbound.append((data, notification, time.monotonic()))
+        self.queued_bytes += len(data)
+        if self.queued_bytes > self.peak_bytes:
+            self.peak_bytes = self.queued_bytes
+        self.cond.notify_all()
+
+    def _evict(self, size: int) -> bool:
+        """Drop queued notifications, oldest first, until size bytes fit (cond held)
+
+        Returns False, dropping nothing, if responses alone leave too little room.
+        """
+        responses = self.queued_bytes - sum(len(frame) for frame, notification, _ in self.outbound if notification)
+        if responses and responses + size > self.buffer_limit:
+            return False
+
+        kept = deque()
+        evicted = 0
+        for item in self.outbound:
+            frame, notification, _ = item
+            if notification and self._full(size):
+                self.queued_bytes -= len(frame)
+                evicted += 1
+            else:
+                kept.append(item)
+        self.outbound = kept
+        self._dropped(evicted)
+        return True
+
+    def _dropped(self, count: int):
+        """Count dropped notifications, logging once each time the client starts lagging (cond held)"""
+        self.dropped += count
+        if count and not self.lagging:
+            self.lagging = True
+            print(f"[SERVER] {self.address} is not keeping up ({self.queued_bytes} bytes buffered), "
+                  f"dropping notifications")
+
+    def _overflow(self):
+        """Disconnect a client that let its buffer overflow (cond held)"""
+        print(f"[SERVER] {self.address} overflowed its {self.buffer_limit} byte buffer, disconnecting")
+        self.closed = True
+        self.outbound.clear()
+        self.queued_bytes = 0
+        self.cond.notify_all()
+        self._close_socket()
+
+    def _write_loop(self):
+        """Drain the outbound buffer, batching queued frames into one send"""
+        try:
+            while True:
+                with self.cond:
+                    while not self.outbound and not self.closed:
+                        self.cond.wait()
+                    if not self.outbound:
+                        break
+
+                    batch = []
+                    while self.outbound and len(batch) < MAX_WRITE_BATCH:
+                        data = self.outbound.popleft()[0]
+                        if not isinstance(data, FrameCompressor):
+                            self.queued_bytes -= len(data)
+                        batch.append(data)
+                    if not self.outbound:
+                        self.lagging = False
+                    self.cond.notify_all()  # wake responses waiting for room
+
+                frames = []
+                for data in batch:
+                    if isinstance(data, FrameCompressor):
+                        self.compressor = data
+                    elif self.compressor is not None:
+                        frames.append(self.compressor.compress(data))
+                    else:
+                        frames.append(data)
+
+                if frames:
+                    self.socket.sendall(frames[0] if len(frames) == 1 else b"".join(frames))
+        except OSError as e:
+            if not self.closed:
+                print(f"[SERVER] Error writing to {self.address}: {e}")
+        finally:
+            with self.cond:
+                # Release any response still waiting for room
+                self.closed = True
+                self.outbound.clear()
+                self.queued_bytes = 0
+                self.cond.notify_all()
+            self._close_socket()
+
+    def _close_socket(self):
+        """Shut the socket down so a blocked reader or writer wakes up"""
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
 
 
 class BulletinBoardServer:
-    """Main bulletin board server class"""
+    """Main bulletin board server class
+
+    Locking: each Group has its own lock covering its members and messages,
+    and registry_lock covers clients and client_groups. When both are needed
+    the group lock is taken first, and no thread ever holds two group locks
+    at once. Notifications are queued only after every lock is released.
+    A BATCH holds one group lock across consecutive commands on that group,
+    so notifications raised inside it are deferred until the lock is released.
+
+    Notifications are coalesced per recipient: the first one opens a window
+    (coalesce_window, or the client's digest interval), and everything that
+    arrives for that recipient before it closes goes out as one frame.
+    notify_lock guards the pending notifications and is never held while
+    taking another lock.
+    """
+
+    def __init__(self, host: str = "localhost", port: int = 8888, log: MessageLog = None,
+                 data_dir: str = None, hot_messages: int = DEFAULT_HOT_MESSAGES,
+                 compress_threshold: int = COMPRESS_THRESHOLD,
+                 coalesce_window: float = DEFAULT_COALESCE_WINDOW,
+                 buffer_limit: int = OUTBOUND_BUFFER_BYTES, overflow_policy: str = DEFAULT_OVERFLOW_POLICY,
+                 admins: Set[str] = None, profile_dir: str = "profiles",
+                 snapshot_interval: float = DEFAULT_SNAPSHOT_INTERVAL, primary: str = None):
+        self.metrics = Metrics()
+        self._define_metrics()
 
-    def __init__(self, host: str = "localhost", port: int = 8888):
         self.host = host
         self.port = port
         self.server_socket = None
-        self.clients: Dict[str, socket.socket] = {}  # username -> socket
+        self.clients: Dict[str, ClientConnection] = {}  # username -> connection
         self.client_groups: Dict[str, Set[str]] = {}  # username -> set of group_ids
         self.groups: Dict[str, Group] = {}
-        self.lock = threading.Lock()
+        self.group_ids = []  # every key of groups, sorted, so GROUPS can page through them
+        self.groups_lock = self.lock_timings.lock("groups")  # guards adding and removing groups
+        self.registry_lock = self.lock_timings.lock("registry")  # guards clients and client_groups
+        self.batch = threading.local()  # state of the BATCH the current thread is running
         self.running = False
+        self.log = log
+        self.data_dir = data_dir  # cold message segments are kept here, if set
+        self.segment_root = os.path.join(data_dir, "segments") if data_dir else None
+        self.hot_messages = hot_messages
+        self.compress_threshold = compress_threshold  # None disables compression
+        self.coalesce_window = coalesce_window  # 0 sends every notification at once
+        self.buffer_limit = buffer_limit  # outbound bytes per connection before overflow_policy applies
+        self.overflow_policy = overflow_policy
+        self.admins = set(admins or ())  # usernames allowed to run admin commands
+        self.profile_dir = profile_dir  # PROFILE reports are written here
+        self.profile_session = None  # the running ProfileSession, if any
+        self.profile_lock = threading.Lock()  # guards starting and ending profile_session
+        self.snapshot_interval = snapshot_interval  # seconds between snapshots beside the log; 0 disables
+        self.snapshotter = None
+        self.snapshot_lock = threading.Lock()  # one snapshot is written at a time
+
+        # connection -> (username, notifications waiting for its window to close)
+        self.pending_notifications: Dict[object, tuple] = {}
+        self.notify_lock = threading.Lock()
+        self.flush_cond = threading.Condition(self.notify_lock)  # wakes the flusher
+        self.flush_schedule = []  # heap of (deadline, sequence, connections)
+        self.flush_sequence = itertools.count()
+        self.flusher = None
+
+        # With --workers: the bus to the other workers, and groups with events from it to apply
+        self.bus = None
+        self.reuse_port = False  # share the listening port with the other workers
+        self.apply_cond = threading.Condition()
+        self.apply_pending = deque()
+        self.applier = None
+        self.create_lock = threading.Lock()  # held applying bus events for a group that does not exist yet
+
+        # With --cluster-port: this node's place in the cluster that shares out the groups
+        self.cluster = None
+
+        # With --replication-port: the followers' feed of the log. With --follow: this
+        # server is a read-only replica, and primary is the replication port it follows.
+        self.shipper = None
+        self.primary = primary
 
         # Initialize groups
         self._initialize_groups()
 
+        # Rebuild the boards from the message log
+        if self.log:
+            self._recover()
+
+        self.follower = LogFollower(self, primary, self.log.end if self.log else 0) if primary else None
+
     def _initialize_groups(self):
         """Initialize the default groups"""
         # Public group for Part 1
-        self.groups["public"] = Group("public", "Public Message Board")
+        self._create_group("public", "Public Message Board")
 
         # Private groups for Part 2
-        self.groups["tech"] = Group("tech", "Technology Discussion")
-        self.groups["sports"] = Group("sports", "Sports Talk")
-        self.groups["music"] = Group("music", "Music Lovers")
-        self.groups["books"] = Group("books", "Book Club")
-        self.groups["movies"] = Group("movies", "Movie Reviews")
+        self._create_group("tech", "Technology Discussion")
+        self._create_group("sports", "Sports Talk")
+        self._create_group("music", "Music Lovers")
+        self._create_group("books", "Book Club")
+        self._create_group("movies", "Movie Reviews")
+
+    def _new_group(self, group_id: str, name: str, creator: str = None):
+        """Create a group wired to the server's storage settings"""
+        cold_dir = os.path.join(self.segment_root, group_id) if self.segment_root else None
+        # A replica's log only takes its primary's records; who joins it is not logged
+        log = self.log if self.primary is None else None
+        return Group(group_id, name, log, cold_dir, self.hot_messages,
+                     self.lock_timings.lock("group", reentrant=True), creator)
+
+    def _create_group(self, group_id: str, name: str, creator: str = None, log=None):
+        """Add a new group; returns it, or None if the ID is taken
+
+        With log, the creation is recorded before anyone can use the group,
+        so no event for it is logged ahead of it.
+        """
+        with self.groups_lock:
+            if group_id in self.groups:
+                return None
+            group = self.groups[group_id] = self._new_group(group_id, name, creator)
+            bisect.insort(self.group_ids, group_id)
+            if log:
+                log.append({"op": "create", "group_id": group_id, "name": name, "creator": creator})
+        return group
+
+    def _replace_group(self, group: Group):
+        """Put a group in place of the one with its ID, or add it"""
+        with self.groups_lock:
+            if group.group_id not in self.groups:
+                bisect.insort(self.group_ids, group.group_id)
+            self.groups[group.group_id] = group
+
+    def _remove_group(self, group_id: str, log=None):
+        """Remove a group, its members' memberships and its segments
+
+        Returns (group, former members), or None if there is no such group.
+        With log, the removal is recorded there.
+        """
+        with self.groups_lock:
+            group = self.groups.pop(group_id, None)
+            if group is None:
+                return None
+            del self.group_ids[bisect.bisect_left(self.group_ids, group_id)]
+            if log:
+                log.append({"op": "delete", "group_id": group_id})
+
+        with group.lock:
+            members = list(group.members)
+            group.members.clear()
+            if group.cold is not None:
+                group.cold.delete()
+        with self.registry_lock:
+            for member in members:
+                group_ids = self.client_groups.get(member)
+                if group_ids is not None:
+                    group_ids.discard(group_id)
+        return group, members
+
+    def _define_metrics(self):
+        """Declare the metrics the server records"""
+        metrics = self.metrics
+        self.command_seconds = metrics.histogram(
+            "bulletin_command_seconds", "Time to process a command", "command")
+        self.command_errors = metrics.counter(
+            "bulletin_command_errors_total", "Commands answered with an error", "command")
+        self.lock_timings = metrics.lock_timings(
+            "bulletin_lock_wait_seconds", "bulletin_lock_hold_seconds", "lock")
+        self.fanout_recipients = metrics.histogram(
+            "bulletin_fanout_recipients", "Recipients per notification", buckets=SIZE_BUCKETS)
+        self.fanout_seconds = metrics.histogram(
+            "bulletin_fanout_seconds", "Time to queue or hold a notification for its recipients")
+        metrics.gauge("bulletin_uptime_seconds", "Seconds since the server started")
+        metrics.gauge("bulletin_connections", "Registered connections")
+        metrics.gauge("bulletin_groups", "Groups")
+        metrics.gauge("bulletin_group_members", f"Members of the {MAX_GROUP_GAUGES} largest groups", "group")
+        metrics.gauge("bulletin_outbound_queued_bytes", "Bytes waiting to be written, all connections")
+        metrics.gauge("bulletin_outbound_queued_bytes_max", "Bytes waiting to be written, worst connection")
+        metrics.gauge("bulletin_outbound_lagging_connections", "Connections with frames waiting to be written")
+        metrics.gauge("bulletin_outbound_dropped", "Notifications dropped by the overflow policy, open connections")
+        metrics.gauge("bulletin_pending_notifications", "Connections with notifications held for coalescing")
+        metrics.gauge("bulletin_replication_connected", "Whether this replica is connected to its primary")
+        metrics.gauge("bulletin_replication_lag_bytes", "Bytes of the primary's log this replica has yet to apply")
+        metrics.gauge("bulletin_replication_lag_seconds",
+                      "Seconds since this replica last had everything its primary had logged")
+        metrics.gauge("bulletin_replication_followers", "Replicas following this server's log")
+
+    def _recover(self):
+        """Rebuild the groups from the snapshot and message log, then start logging new events"""
+        replayed = self._replay()
+        if self.primary is not None:
+            # A replica's log is a copy of its primary's, which logs out the members itself
+            self.log.open()
+            print(f"[SERVER] Replayed {replayed} records from {self.log.path}")
+            return
+        self._open_log()
+        print(f"[SERVER] Replayed {replayed} records from {self.log.path}")
+
+        if self.snapshot_interval:
+            self.snapshotter = threading.Thread(target=self._snapshot_loop, args=(replayed > 0,))
+            self.snapshotter.daemon = True
+            self.snapshotter.start()
+
+    def _replay(self):
+        """Load the latest snapshot, then apply the log records after it; returns how many were read
+
+        A record is skipped if its group's snapshot already includes it.
+        """
+        positions, start = self._load_snapshot()
+        replayed = 0
+        for offset, record in self.log.replay(start):
+            replayed += 1
+            if offset < positions.get(record.get("group_id"), 0):
+                continue
+            self._apply_logged(record, offset)
+        self._clean_segments()
+        return replayed
+
+    def _apply_logged(self, record: dict, location: int = None):
+        """Apply a message log record (found at location) to the boards
+
+        Returns (group, former members) for a delete that removed a group.
+        """
+        op = record["op"]
+        group = self.groups.get(record.get("group_id"))
+        if op == "create":
+            self._create_group(record["group_id"], record["name"], record["creator"])
+        elif op == "delete":
+            return self._remove_group(record["group_id"])
+        elif group and op == "reset":
+            # The group was handed to another cluster node; what came before is theirs
+            if group.creator is None:
+                self._replace_group(self._new_group(group.group_id, group.name))
+            else:
+                self._remove_group(group.group_id)
+        elif group and op in ("join", "leave") and self.primary is not None:
+            pass  # the primary's members; a replica's own members are its local clients
+        elif group:
+            group.apply_record(record, location)
+        return None
+
+    def apply_replicated(self, record: dict, frame: bytes):
+        """Apply a record of the primary's log on this replica (called by the follower's thread)
+
+        The record is written to this replica's log exactly as the primary
+        framed it, so the two logs stay identical. Then the members connected
+        here are notified, as the primary notifies its own. Joins and leaves
+        are only logged: membership on a replica belongs to its own clients.
+        """
+        group_id = record.get("group_id")
+        group = self.groups.get(group_id)
+        with group.lock if group is not None else self.create_lock:
+            location = self.log.append_frame(frame) if self.log else None
+            removed = self._apply_logged(record, location)
+
+        op = record["op"]
+        if removed:
+            self._notify_replicated(group_id, removed[1], f"Group '{removed[0].name}' has been deleted")
+        elif group is None:
+            return
+        elif op == "post":
+            msg = Message(record["msg_id"], record["sender"], record["subject"], None, group_id,
+                          record["posted_at"])
+            self._notify_replicated(group_id, None, f"New message posted: {msg.get_header()}", msg.sender)
+
+    def _notify_replicated(self, group_id: str, members, message: str, exclude: str = None):
+        """Notify members connected here of a change made on the primary (members None: the group's)"""
+        if members is None:
+            self._notify_members(group_id, message, exclude)
+        else:
+            self._notify_users(members, message)
+
+    def _snapshot_file(self) -> Snapshot:
+        return Snapshot(self.log.path + ".snapshot")
+
+    def _load_snapshot(self):
+        """Restore the groups from the snapshot beside the log, if there is a usable one
+
+        Returns {group_id: log position its state covers} and the position to
+        replay the log from. Message bodies stay in the log until read.
+        """
+        snapshot = self._snapshot_file()
+        if self.primary is not None or not snapshot.exists():
+            return {}, 0  # a replica writes none; one left from before would bring members
+
+        started = time.perf_counter()
+        positions = {}
+        try:
+            header, states = snapshot.read()
+            size = self.log.size()
+            if header.get("op") != "snapshot" or header["position"] > size:
+                raise ValueError("it is newer than the log")
+            for state in states:
+                if state["position"] > size:
+                    raise ValueError("it is newer than the log")
+                group = self._new_group(state["group_id"], state["name"], state["creator"])
+                group.restore(state, self.log)
+                self._replace_group(group)
+                positions[group.group_id] = state["position"]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[SERVER] Ignoring snapshot {snapshot.path}: {e}; replaying the whole log")
+            with self.groups_lock:
+                self.groups.clear()
+                self.group_ids.clear()
+            self._initialize_groups()
+            return {}, 0
+
+        print(f"[SERVER] Loaded a snapshot of {len(positions)} groups in "
+              f"{time.perf_counter() - started:.2f}s")
+        return positions, min([header["position"], *positions.values()])
+
+    def _clean_segments(self):
+        """Remove the segment directories no restored group is using"""
+        if not self.segment_root or not os.path.isdir(self.segment_root):
+            return
+        in_use = {group.cold.directory for group in self.groups.values() if group.cold is not None}
+        for name in os.listdir(self.segment_root):
+            directory = os.path.join(self.segment_root, name)
+            if directory not in in_use:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    def write_snapshot(self):
+        """Save every group beside the log, without stopping the handlers; returns how many
+
+        Each group is copied under its own lock, with the log position its
+        copy covers, so only that group's commands wait, and only while it
+        is copied. Replay later skips a group's records before its position.
+        Bodies are not copied: the snapshot points into the log for them.
+        """
+        with self.snapshot_lock:
+            return self._write_snapshot()
+
+    def _write_snapshot(self):
+        started = time.perf_counter()
+        with self.groups_lock:
+            position = self.log.end  # groups created after this are replayed from the log
+            group_ids = list(self.group_ids)
+
+        def states():
+            for group_id in group_ids:
+                group = self.groups.get(group_id)
+                if group is None:
+                    continue
+                with group.lock:
+                    group_position = self.log.end
+                    if self.groups.get(group_id) is not group:
+                        continue  # deleted or replaced since; the log has what happened
+                    state = group.snapshot()
+                state["position"] = group_position
+                if state["index"] is not None:
+                    state["index"] = state["index"].state()
+                yield state
+            # Every position named above must be on disk before this snapshot replaces the last
+            self.log.flush()
+
+        count = self._snapshot_file().write({"op": "snapshot", "position": position}, states())
+        print(f"[SERVER] Wrote a snapshot of {count} groups in {time.perf_counter() - started:.2f}s")
+        return count
+
+    def _snapshot_loop(self, now: bool):
+        """Write a snapshot every snapshot_interval seconds while the log grows (first at once if now)"""
+        written = None if now else self.log.end
+        while not self.log.closed:
+            if written != self.log.end:
+                written = self.log.end
+                try:
+                    self.write_snapshot()
+                except (OSError, ValueError) as e:
+                    print(f"[SERVER] Could not write a snapshot: {e}")
+            time.sleep(self.snapshot_interval)
+
+    def _open_log(self):
+        """Start logging new events, logging out the members a previous run left behind"""
+        self.log.open()
+
+        # Connections do not survive a restart, so log everyone out of their groups
+        for group in self.groups.values():
+            for member in list(group.members):
+                group.remove_member(member)
+        self.log.sync()
 
     def start(self):
         """Start the server"""
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(5)
+        self.server_socket.listen(LISTEN_BACKLOG)
         self.running = True
 
         print(f"[SERVER] Bulletin Board Server started on {self.host}:{self.port}")
@@ -119,6 +1011,8 @@ class BulletinBoardServer:
         while self.running:
             try:
                 client_socket, address = self.server_socket.accept()
+                # The writer already batches frames, so Nagle would only add delayed-ACK stalls
+                client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
                 print(f"[SERVER] New connection from {address}")
 
                 # Start a new thread for this client
@@ -135,52 +1029,47 @@ class BulletinBoardServer:
     def handle_client(self, client_socket: socket.socket, address):
         """Handle communication with a connected client"""
         username = None
+        connection = ClientConnection(client_socket, address, self.buffer_limit, self.overflow_policy)
+        reader = FrameReader(client_socket)
 
         try:
             # Receive username from client
-            data = client_socket.recv(4096).decode('utf-8')
-            request = json.loads(data)
+            request = reader.read()
+            if request is None:
+                return
 
             if request.get("command") == "REGISTER":
                 username = request.get("username")
-
-                with self.lock:
-                    if username in self.clients:
-                        # Username already exists
-                        response = {
-                            "status": "ERROR",
-                            "message": "Username already exists. Please choose another."
-                        }
-                        client_socket.send(json.dumps(response).encode('utf-8'))
-                        client_socket.close()
-                        return
-
-                    # Register the client
-                    self.clients[username] = client_socket
-                    self.client_groups[username] = set()
-
-                # Send success response
-                response = {
-                    "status": "SUCCESS",
-                    "message": f"Welcome to the Bulletin Board, {username}!"
-                }
-                client_socket.send(json.dumps(response).encode('utf-8'))
-                print(f"[SERVER] {username} registered successfully")
+                response = self.register_client(username, connection)
+                codec = self.negotiate_codec(request, response)
+                compressor = self.negotiate_compression(request, response)
+                connection.send(encode_frame(tag_response(request, response)))
+
+                if response["status"] != "SUCCESS":
+                    # Username already exists
+                    username = None
+                    return
+
+                # Everything after the handshake uses the negotiated codec and compression
+                reader.codec = connection.codec = codec
+                if compressor is not None:
+                    reader.decoder.enable_decompression()
+                    connection.enable_compression(compressor)
 
             # Main command loop
             while self.running:
-                data = client_socket.recv(4096).decode('utf-8')
-                if not data:
+                request = reader.read()
+                if request is None:
                     break
 
-                request = json.loads(data)
                 command = request.get("command")
 
                 # Process the command
                 response = self.process_command(username, command, request)
 
                 # Send response back to client
-                client_socket.send(json.dumps(response).encode('utf-8'))
+                for frame in self.encode_responses(request, response, connection.codec):
+                    connection.send(frame)
 
         except Exception as e:
             print(f"[SERVER] Error handling client {username}: {e}")
@@ -189,9 +1078,122 @@ class BulletinBoardServer:
             # Clean up when client disconnects
             if username:
                 self.disconnect_client(username)
+            connection.close()
+
+    def register_client(self, username: str, connection):
+        """Register a username for a newly connected client"""
+        with self.registry_lock:
+            # With --workers or --cluster-port the name must also be free on every other process
+            if username in self.clients or (self.bus is not None and not self.bus.claim(username)) \
+                    or (self.cluster is not None and not self.cluster.claim(username)):
+                return {
+                    "status": "ERROR",
+                    "message": "Username already exists. Please choose another."
+                }
+
+            # Register the client
+            self.clients[username] = connection
+            self.client_groups[username] = set()
+
+        print(f"[SERVER] {username} registered successfully")
+        return {
+            "status": "SUCCESS",
+            "message": f"Welcome to the Bulletin Board, {username}!"
+        }
+
+    def negotiate_codec(self, request: dict, response: dict):
+        """Choose the codec for the rest of a connection from those its REGISTER offered
+
+        The REGISTER response itself is always JSON; a successful one names
+        the chosen codec. Clients that offer nothing keep JSON.
+        """
+        if response["status"] != "SUCCESS":
+            return JSON_CODEC
+        codec = choose_codec(request.get("codecs"))
+        response["codec"] = codec.name
+        return codec
+
+    def negotiate_compression(self, request: dict, response: dict):
+        """Agree on compression if the REGISTER offered a method this server supports
+
+        Returns the FrameCompressor for the connection's outgoing frames, or
+        None to send everything uncompressed.
+        """
+        if response["status"] != "SUCCESS" or self.compress_threshold is None:
+            return None
+        method = choose_compression(request.get("compression"))
+        if method is None:
+            return None
+        response["compression"] = method
+        return FrameCompressor(self.compress_threshold)
 
     def process_command(self, username: str, command: str, request: dict):
-        """Process a command from the client"""
+        """Process a command from the client, recording its latency and outcome"""
+        start = time.perf_counter()
+        label = command if command in COMMANDS else "UNKNOWN"
+        session = self.profile_session
+        try:
+            if session is None or command == "PROFILE":
+                response = self._dispatch(username, command, request)
+            else:
+                response = session.run(label, self._dispatch, username, command, request)
+                if session.done():
+                    self._end_profile(session)
+        except LogError as e:
+            response = self.commit_failed(username, e)
+        self.command_seconds.observe(time.perf_counter() - start, label)
+        if isinstance(response, dict) and response.get("status") != "SUCCESS":
+            self.command_errors.inc(label)
+        return response
+
+    def commit_failed(self, username: str, error: LogError) -> dict:
+        """The response to a command whose changes could not be made durable"""
+        print(f"[SERVER] Could not make {username}'s change durable: {error}")
+        return {"status": "ERROR", "message": "The server could not save this change to disk"}
+
+    def _dispatch(self, username: str, command: str, request: dict):
+        """Run the handler for a command, on the node that owns its group if clustered"""
+        if self.primary is not None and command in WRITE_COMMANDS:
+            primary = self.follower.server_address or self.primary
+            return {"status": "ERROR",
+                    "message": f"This server is a read-only replica; send {command} to the primary at {primary}"}
+        if self.cluster is not None:
+            group_id = self._command_group(command, request)
+            if group_id is not None:
+                return self.cluster.dispatch(group_id, username, request, self._run_handler)
+        return self._run_handler(username, command, request)
+
+    def _command_group(self, command: str, request: dict):
+        """ID of the group a command acts on, or None
+
+        The group may not exist (yet): a cluster node only has the groups it
+        owns, so the owner is the one to say.
+        """
+        if command in PUBLIC_COMMANDS:
+            return "public"
+        if command in GROUP_COMMANDS:
+            group_id = request.get("group_id")
+            if isinstance(group_id, str) and GROUP_ID_PATTERN.fullmatch(group_id):
+                return group_id
+        return None
+
+    def waits_on_bus(self, command: str, request: dict) -> bool:
+        """Whether a command waits for the worker hub to answer (--workers)"""
+        if self.bus is None:
+            return False
+        if command == "BATCH":
+            commands = request.get("commands")
+            return isinstance(commands, list) and any(
+                isinstance(batched, dict) and batched.get("command") in WRITE_COMMANDS for batched in commands)
+        return command in WRITE_COMMANDS
+
+    def owned_elsewhere(self, command: str, request: dict) -> bool:
+        """Whether a command acts on a group another cluster node owns"""
+        group_id = self._command_group(command, request)
+        return group_id is not None and self.cluster.owner(group_id) != self.cluster.address
+
+    def _run_handler(self, username: str, command: str, request: dict):
+        """Run the handler for a command"""
 
         if command == "JOIN":
             return self.handle_join(username)
@@ -212,7 +1214,13 @@ class BulletinBoardServer:
             return self.handle_get_message(username, "public", msg_id)
 
         elif command == "GROUPS":
-            return self.handle_list_groups()
+            return self.handle_list_groups(request.get("prefix"), request.get("after"), request.get("limit"))
+
+        elif command == "CREATEGROUP":
+            return self.handle_create_group(username, request.get("group_id"), request.get("name"))
+
+        elif command == "DELETEGROUP":
+            return self.handle_delete_group(username, request.get("group_id"))
 
         elif command == "GROUPJOIN":
             group_id = request.get("group_id")
@@ -237,15 +1245,66 @@ class BulletinBoardServer:
             msg_id = request.get("msg_id")
             return self.handle_get_message(username, group_id, msg_id)
 
+        elif command == "HISTORY":
+            return self.handle_history(
+                username, "public", request.get("since_id"), request.get("before_id"),
+                request.get("limit"), request.get("stream", False)
+            )
+
+        elif command == "GROUPHISTORY":
+            group_id = request.get("group_id")
+            return self.handle_history(
+                username, group_id, request.get("since_id"), request.get("before_id"),
+                request.get("limit"), request.get("stream", False)
+            )
+
+        elif command == "DIGEST":
+            return self.handle_digest(username, request.get("interval"))
+
+        elif command == "LAG":
+            return self.handle_lag(username)
+
+        elif command == "STATS":
+            return self.handle_stats(username)
+
+        elif command == "REPLICATION":
+            return self.handle_replication()
+
+        elif command == "PROFILE":
+            return self.handle_profile(
+                username, request.get("action"), request.get("duration"), request.get("requests")
+            )
+
+        elif command == "BATCH":
+            return self.handle_batch(username, request.get("commands"))
+
+        elif command == "SEARCH":
+            return self.handle_search(
+                username, "public", request.get("query"), request.get("before_id"), request.get("limit")
+            )
+
+        elif command == "GROUPSEARCH":
+            group_id = request.get("group_id")
+            return self.handle_search(
+                username, group_id, request.get("query"), request.get("before_id"), request.get("limit")
+            )
+
         else:
             return {"status": "ERROR", "message": "Unknown command"}
 
+    def encode_responses(self, request: dict, response, codec=JSON_CODEC):
+        """Encode a command result as frames: one response, or every part of a streamed one"""
+        if isinstance(response, dict):
+            yield encode_frame(tag_response(request, response), codec)
+        else:
+            for part in response:
+                yield encode_frame(tag_response(request, part), codec)
+
     def handle_join(self, username: str):
         """Handle user joining the public group"""
-        with self.lock:
-            group = self.groups["public"]
+        group = self.groups["public"]
+        with group.lock:
             group.add_member(username)
-            self.client_groups[username].add("public")
 
             # Get list of users
             users = list(group.members)
@@ -254,32 +1313,36 @@ class BulletinBoardServer:
             recent_messages = group.get_last_n_messages(2)
             messages_headers = [msg.get_header() for msg in recent_messages]
 
-            # Notify other users
-            self.broadcast_notification(
-                "public",
-                f"{username} has joined the group",
-                exclude=username
-            )
+        with self.registry_lock:
+            self.client_groups[username].add("public")
 
-            return {
-                "status": "SUCCESS",
-                "message": "Joined public message board",
-                "users": users,
-                "recent_messages": messages_headers
-            }
+        # Notify other users
+        self.broadcast_notification(
+            "public",
+            f"{username} has joined the group",
+            exclude=username
+        )
+
+        return {
+            "status": "SUCCESS",
+            "message": "Joined public message board",
+            "users": users,
+            "recent_messages": messages_headers
+        }
 
     def handle_group_join(self, username: str, group_id: str):
         """Handle user joining a private group"""
-        with self.lock:
-            if group_id not in self.groups:
-                return {"status": "ERROR", "message": "Group does not exist"}
-
-            if group_id in self.client_groups[username]:
+        group = self.groups.get(group_id)
+        if group is None:
+            return {"status": "ERROR", "message": "Group does not exist"}
+
+        with group.lock:
+            if self.groups.get(group_id) is not group:
+                return {"status": "ERROR", "message": "Group does not exist"}  # deleted meanwhile
+            if username in group.members:
                 return {"status": "ERROR", "message": "Already a member of this group"}
 
-            group = self.groups[group_id]
             group.add_member(username)
-            self.client_groups[username].add(group_id)
 
             # Get list of users
             users = list(group.members)
@@ -288,207 +1351,1709 @@ class BulletinBoardServer:
             recent_messages = group.get_last_n_messages(2)
             messages_headers = [msg.get_header() for msg in recent_messages]
 
-            # Notify other users in the group
-            self.broadcast_notification(
-                group_id,
-                f"{username} has joined the group",
-                exclude=username
-            )
+        with self.registry_lock:
+            self.client_groups[username].add(group_id)
 
-            return {
-                "status": "SUCCESS",
-                "message": f"Joined group: {group.name}",
-                "users": users,
-                "recent_messages": messages_headers
-            }
+        # Notify other users in the group
+        self.broadcast_notification(
+            group_id,
+            f"{username} has joined the group",
+            exclude=username
+        )
+
+        return {
+            "status": "SUCCESS",
+            "message": f"Joined group: {group.name}",
+            "users": users,
+            "recent_messages": messages_headers
+        }
 
     def handle_post(self, username: str, group_id: str, subject: str, content: str):
         """Handle posting a message"""
-        with self.lock:
-            if group_id not in self.groups:
-                return {"status": "ERROR", "message": "Group does not exist"}
+        group = self.groups.get(group_id)
+        if group is None:
+            return {"status": "ERROR", "message": "Group does not exist"}
 
-            if group_id not in self.client_groups[username]:
+        with group.lock:
+            if username not in group.members:
                 return {"status": "ERROR", "message": "You are not a member of this group"}
 
-            group = self.groups[group_id]
-            msg = group.add_message(username, subject, content)
+            if self.bus is None:
+                msg = group.add_message(username, subject, content)
+
+        if self.bus is not None:
+            # The hub numbers every worker's posts; ours is stored in that order with the others
+            record = self.bus.post(group_id, username, subject, content)
+            if record["op"] == "refused":
+                return {"status": "ERROR", "message": "Group does not exist"}  # deleted by another worker
+            self._apply_bus(group_id)
+            msg = Message(record["msg_id"], username, subject, content, group_id, record["posted_at"])
+        header = msg.get_header()
+
+        # Only acknowledge the post once it is durable (a batch commits once, at its end)
+        if self._in_batch():
+            self.batch.commit = True
+        else:
+            self._commit_log()
 
-            # Broadcast the new message to all group members
-            self.broadcast_notification(
-                group_id,
-                f"New message posted: {msg.get_header()}",
-                exclude=username
-            )
+        # Broadcast the new message to all group members, once no crash can lose it
+        self._after_commit(lambda: self.broadcast_notification(
+            group_id,
+            f"New message posted: {header}",
+            exclude=username
+        ))
 
-            return {
-                "status": "SUCCESS",
-                "message": "Message posted successfully",
-                "msg_id": msg.msg_id
-            }
+        return {
+            "status": "SUCCESS",
+            "message": "Message posted successfully",
+            "msg_id": msg.msg_id
+        }
 
     def handle_users(self, username: str, group_id: str):
         """Handle retrieving list of users in a group"""
-        with self.lock:
-            if group_id not in self.groups:
-                return {"status": "ERROR", "message": "Group does not exist"}
+        group = self.groups.get(group_id)
+        if group is None:
+            return {"status": "ERROR", "message": "Group does not exist"}
 
-            if group_id not in self.client_groups[username]:
+        with group.lock:
+            if username not in group.members:
                 return {"status": "ERROR", "message": "You are not a member of this group"}
 
-            group = self.groups[group_id]
             users = list(group.members)
 
-            return {
-                "status": "SUCCESS",
-                "users": users
-            }
+        return {
+            "status": "SUCCESS",
+            "users": users
+        }
 
     def handle_leave(self, username: str, group_id: str):
         """Handle user leaving a group"""
-        with self.lock:
-            if group_id not in self.groups:
-                return {"status": "ERROR", "message": "Group does not exist"}
+        group = self.groups.get(group_id)
+        if group is None:
+            return {"status": "ERROR", "message": "Group does not exist"}
 
-            if group_id not in self.client_groups[username]:
+        with group.lock:
+            if username not in group.members:
                 return {"status": "ERROR", "message": "You are not a member of this group"}
 
-            group = self.groups[group_id]
             group.remove_member(username)
+
+        with self.registry_lock:
             self.client_groups[username].discard(group_id)
 
-            # Notify other users
-            self.broadcast_notification(
-                group_id,
-                f"{username} has left the group",
-                exclude=username
-            )
+        # Notify other users
+        self.broadcast_notification(
+            group_id,
+            f"{username} has left the group",
+            exclude=username
+        )
 
-            return {
-                "status": "SUCCESS",
-                "message": f"Left group: {group.name}"
-            }
+        return {
+            "status": "SUCCESS",
+            "message": f"Left group: {group.name}"
+        }
 
     def handle_get_message(self, username: str, group_id: str, msg_id: int):
         """Handle retrieving a message by ID"""
-        with self.lock:
-            if group_id not in self.groups:
-                return {"status": "ERROR", "message": "Group does not exist"}
+        group = self.groups.get(group_id)
+        if group is None:
+            return {"status": "ERROR", "message": "Group does not exist"}
 
-            if group_id not in self.client_groups[username]:
+        with group.lock:
+            if username not in group.members:
                 return {"status": "ERROR", "message": "You are not a member of this group"}
 
-            group = self.groups[group_id]
             msg = group.get_message_by_id(msg_id)
 
             if msg is None:
                 return {"status": "ERROR", "message": "Message not found"}
 
+            message = msg.to_dict()
+
+        return {
+            "status": "SUCCESS",
+            "message": message
+        }
+
+    def handle_history(self, username: str, group_id: str, since_id: int = None, before_id: int = None,
+                       limit: int = None, stream: bool = False):
+        """Handle retrieving a range of messages
+
+        With since_id, messages after it are returned oldest first; otherwise
+        the newest messages before before_id (or the newest overall) are
+        returned. Either way a page is listed in ID order, with "more" telling
+        whether the range continues. With stream set, the whole range (up to
+        limit) is sent as a sequence of frames, the last one with "more" false.
+        """
+        group = self.groups.get(group_id)
+        if group is None:
+            return {"status": "ERROR", "message": "Group does not exist"}
+
+        try:
+            since_id = None if since_id is None else int(since_id)
+            before_id = None if before_id is None else int(before_id)
+            limit = None if limit is None else int(limit)
+        except (TypeError, ValueError):
+            return {"status": "ERROR", "message": "Message IDs and limit must be numbers"}
+
+        if limit is not None and limit < 1:
+            return {"status": "ERROR", "message": "Limit must be at least 1"}
+
+        with group.lock:
+            if username not in group.members:
+                return {"status": "ERROR", "message": "You are not a member of this group"}
+
+        if stream:
+            return self._stream_history(group, since_id, before_id, limit)
+
+        limit = min(limit or DEFAULT_HISTORY_LIMIT, MAX_HISTORY_PAGE)
+        messages, more = self._history_page(group, since_id, before_id, limit)
+        return {
+            "status": "SUCCESS",
+            "messages": messages,
+            "more": more
+        }
+
+    def _history_page(self, group: Group, since_id: int, before_id: int, limit: int):
+        """Read up to limit messages of a range; returns (messages in ID order, more)"""
+        newest_first = since_id is None
+        with group.lock:
+            found = list(itertools.islice(
+                group.iter_messages(since_id or 0, before_id, newest_first), limit + 1
+            ))
+
+        more = len(found) > limit
+        messages = [msg.to_dict() for msg in found[:limit]]
+        if newest_first:
+            messages.reverse()
+        return messages, more
+
+    def _stream_history(self, group: Group, since_id: int, before_id: int, limit: int):
+        """Yield a range of messages one page per frame, taking the group lock per page"""
+        remaining = limit
+        while True:
+            page_size = MAX_HISTORY_PAGE if remaining is None else min(remaining, MAX_HISTORY_PAGE)
+            messages, more = self._history_page(group, since_id, before_id, page_size)
+
+            if remaining is not None:
+                remaining -= len(messages)
+                more = more and remaining > 0
+
+            yield {
+                "status": "SUCCESS",
+                "messages": messages,
+                "more": more
+            }
+            if not more:
+                return
+
+            # Continue from the edge of this page
+            if since_id is None:
+                before_id = messages[0]["msg_id"]
+            else:
+                since_id = messages[-1]["msg_id"]
+
+    def handle_search(self, username: str, group_id: str, query: str, before_id: int = None,
+                      limit: int = None):
+        """Handle a full-text search of a group's subjects and bodies
+
+        Every word of the query must match; a word ending in "*" matches as a
+        prefix. Results are newest first; pass the last msg_id of a page as
+        before_id to get the next one.
+        """
+        group = self.groups.get(group_id)
+        if group is None:
+            return {"status": "ERROR", "message": "Group does not exist"}
+
+        if not isinstance(query, str) or not query.strip():
+            return {"status": "ERROR", "message": "Search query is empty"}
+
+        try:
+            before_id = None if before_id is None else int(before_id)
+            limit = None if limit is None else int(limit)
+        except (TypeError, ValueError):
+            return {"status": "ERROR", "message": "Message IDs and limit must be numbers"}
+
+        if limit is not None and limit < 1:
+            return {"status": "ERROR", "message": "Limit must be at least 1"}
+        limit = min(limit or DEFAULT_HISTORY_LIMIT, MAX_HISTORY_PAGE)
+
+        with group.lock:
+            if username not in group.members:
+                return {"status": "ERROR", "message": "You are not a member of this group"}
+
+            found, more = group.search(query, before_id, limit)
+            messages = [msg.to_dict() for msg in found]
+
+        return {
+            "status": "SUCCESS",
+            "messages": messages,
+            "more": more
+        }
+
+    def handle_digest(self, username: str, interval):
+        """Handle switching between coalesced notifications and a periodic digest
+
+        With an interval (seconds), notifications are held and delivered as
+        one digest frame at most once per interval; 0 returns to the normal
+        coalescing window.
+        """
+        try:
+            interval = float(interval)
+        except (TypeError, ValueError):
+            return {"status": "ERROR", "message": "Interval must be a number of seconds"}
+
+        if interval and not MIN_DIGEST_INTERVAL <= interval <= MAX_DIGEST_INTERVAL:
+            return {
+                "status": "ERROR",
+                "message": f"Interval must be 0 or between {MIN_DIGEST_INTERVAL} and "
+                           f"{MAX_DIGEST_INTERVAL} seconds"
+            }
+
+        with self.registry_lock:
+            connection = self.clients.get(username)
+        if connection is None:
+            return {"status": "ERROR", "message": "Not registered"}
+
+        connection.digest = interval or None
+        return {
+            "status": "SUCCESS",
+            "message": f"Digest every {interval:g}s" if interval else "Digest off"
+        }
+
+    def handle_lag(self, username: str):
+        """Handle a client asking how far behind its own connection is"""
+        with self.registry_lock:
+            connection = self.clients.get(username)
+        if connection is None:
+            return {"status": "ERROR", "message": "Not registered"}
+        return {"status": "SUCCESS", "lag": connection.lag()}
+
+    def handle_replication(self):
+        """Handle a client asking how this server's replication stands"""
+        if self.follower is not None:
+            report = self.follower.lag()
+        elif self.shipper is not None:
+            report = self.shipper.report()
+        else:
+            report = {"role": "standalone"}
+        return {"status": "SUCCESS", "replication": report}
+
+    def lag_report(self):
+        """Lag counters of every connection, furthest behind first"""
+        with self.registry_lock:
+            clients = list(self.clients.items())
+        report = [dict(connection.lag(), username=username) for username, connection in clients]
+        report.sort(key=lambda lag: (lag["queued_bytes"], lag["dropped"]), reverse=True)
+        return report
+
+    def handle_stats(self, username: str):
+        """Handle an administrator asking for the server's metrics"""
+        if username not in self.admins:
+            return {"status": "ERROR", "message": "STATS is only available to administrators"}
+        return {"status": "SUCCESS", "stats": self.metrics.summary(self._gauges())}
+
+    def _gauges(self):
+        """Current values of the gauge metrics: (name, label value) -> value"""
+        with self.registry_lock:
+            connections = len(self.clients)
+        groups = list(self.groups.values())
+        lags = self.lag_report()
+        with self.notify_lock:
+            pending = len(self.pending_notifications)
+
+        gauges = {
+            ("bulletin_uptime_seconds", None): round(time.time() - self.metrics.started, 3),
+            ("bulletin_connections", None): connections,
+            ("bulletin_groups", None): len(groups),
+            ("bulletin_outbound_queued_bytes", None): sum(lag["queued_bytes"] for lag in lags),
+            ("bulletin_outbound_queued_bytes_max", None): lags[0]["queued_bytes"] if lags else 0,
+            ("bulletin_outbound_lagging_connections", None): sum(1 for lag in lags if lag["queued_bytes"]),
+            ("bulletin_outbound_dropped", None): sum(lag["dropped"] for lag in lags),
+            ("bulletin_pending_notifications", None): pending,
+        }
+        for group in heapq.nlargest(MAX_GROUP_GAUGES, groups, key=lambda group: len(group.members)):
+            gauges[("bulletin_group_members", group.group_id)] = len(group.members)
+        if self.follower is not None:
+            replication = self.follower.lag()
+            gauges[("bulletin_replication_connected", None)] = int(replication["connected"])
+            if replication["lag_bytes"] is not None:
+                gauges[("bulletin_replication_lag_bytes", None)] = replication["lag_bytes"]
+            if replication["lag_seconds"] is not None:
+                gauges[("bulletin_replication_lag_seconds", None)] = replication["lag_seconds"]
+        if self.shipper is not None:
+            gauges[("bulletin_replication_followers", None)] = len(self.shipper.report()["followers"])
+        return gauges
+
+    def render_metrics(self) -> str:
+        """Every metric in the Prometheus text format"""
+        return self.metrics.prometheus(self._gauges())
+
+    def handle_profile(self, username: str, action: str, duration=None, requests=None):
+        """Handle an administrator starting, stopping or checking a profile of live commands
+
+        A profile runs for a number of seconds or until a number of requests
+        have been profiled, whichever comes first, then its report is written
+        to profile_dir in the background.
+        """
+        if username not in self.admins:
+            return {"status": "ERROR", "message": "PROFILE is only available to administrators"}
+
+        if action == "status":
+            session = self.profile_session
+            if session is None:
+                return {"status": "SUCCESS", "profiling": False}
             return {
                 "status": "SUCCESS",
-                "message": msg.to_dict()
+                "profiling": True,
+                "requests": session.requests,
+                "remaining_seconds": round(max(0.0, session.deadline - time.time()), 1)
+            }
+
+        if action == "stop":
+            session = self.profile_session
+            path = self._end_profile(session) if session is not None else None
+            if path is None:
+                return {"status": "ERROR", "message": "No profile is running"}
+            return {"status": "SUCCESS", "message": f"Writing profile of {session.requests} requests",
+                    "path": path}
+
+        if action != "start":
+            return {"status": "ERROR", "message": "Action must be start, stop or status"}
+
+        try:
+            duration = float(DEFAULT_PROFILE_SECONDS if duration is None else duration)
+            requests = None if requests is None else int(requests)
+        except (TypeError, ValueError):
+            return {"status": "ERROR", "message": "Duration and requests must be numbers"}
+        if not 0 < duration <= MAX_PROFILE_SECONDS or (requests is not None and requests < 1):
+            return {
+                "status": "ERROR",
+                "message": f"Duration must be up to {MAX_PROFILE_SECONDS} seconds and requests at least 1"
             }
 
-    def handle_list_groups(self):
-        """Handle listing all available groups"""
+        path = os.path.join(self.profile_dir, time.strftime("profile-%Y%m%d-%H%M%S"))
+        with self.profile_lock:
+            if self.profile_session is not None:
+                return {"status": "ERROR", "message": "A profile is already running"}
+            session = self.profile_session = ProfileSession(path, duration, requests)
+
+        timer = threading.Timer(duration, self._end_profile, (session,))
+        timer.daemon = True
+        timer.start()
+
+        limit = f" or {requests} requests" if requests else ""
+        print(f"[SERVER] {username} started profiling for {duration:g}s{limit}")
+        return {"status": "SUCCESS", "message": f"Profiling for {duration:g}s{limit}",
+                "path": path + ".txt"}
+
+    def _end_profile(self, session: ProfileSession):
+        """End a profile and write its report in the background; returns the report path
+
+        Returns None if the session has already ended.
+        """
+        with self.profile_lock:
+            if self.profile_session is not session:
+                return None
+            self.profile_session = None
+
+        def write():
+            path = session.finish()
+            print(f"[SERVER] Profile of {session.requests} requests written to {path}")
+
+        writer = threading.Thread(target=write)
+        writer.daemon = True
+        writer.start()
+        return session.path + ".txt"
+
+    def handle_batch(self, username: str, commands: list):
+        """Handle a list of commands, run in order, in a single round trip
+
+        Consecutive commands on the same group run under one acquisition of
+        its lock (the handlers re-enter it). Their notifications are queued
+        once that lock is released, and posts are made durable together
+        before the batch is answered. The batch is not a transaction: every
+        command gets its own result, whether or not the others succeeded.
+        """
+        if not isinstance(commands, list) or not commands:
+            return {"status": "ERROR", "message": "BATCH needs a list of commands"}
+
+        if len(commands) > MAX_BATCH_COMMANDS:
+            return {"status": "ERROR", "message": f"BATCH is limited to {MAX_BATCH_COMMANDS} commands"}
+
+        results = []
+        self.batch.notifications = []
+        self.batch.commit = False
+        self.batch.after_commit = []
+        try:
+            for group_id, run in itertools.groupby(commands, key=self._batch_group):
+                group = self.groups.get(group_id) if group_id is not None else None
+                with group.lock if group is not None else contextlib.nullcontext():
+                    for request in run:
+                        results.append(self._run_batched(username, request))
+                self._flush_batch_notifications()
+            commit = self.batch.commit
+        finally:
+            self.batch.notifications = None
+            after_commit, self.batch.after_commit = self.batch.after_commit, None
+
+        if commit:
+            self._commit_log()
+        for callback in after_commit:
+            self._after_commit(callback)
+
+        return {
+            "status": "SUCCESS",
+            "results": results
+        }
+
+    def _batch_group(self, request):
+        """ID of the group a batched command acts on, or None"""
+        if not isinstance(request, dict):
+            return None
+        if request.get("command") in PUBLIC_COMMANDS:
+            return "public"
+        group_id = request.get("group_id")
+        return group_id if isinstance(group_id, str) else None
+
+    def _run_batched(self, username: str, request):
+        """Run one command of a batch and return its result"""
+        if not isinstance(request, dict):
+            return {"status": "ERROR", "message": "Invalid command"}
+
+        command = request.get("command")
+        if command in ("REGISTER", "BATCH"):
+            return {"status": "ERROR", "message": f"{command} cannot be batched"}
+
+        # Results are collected into one response, so nothing is streamed
+        return self.process_command(username, command, dict(request, stream=False))
+
+    def _in_batch(self):
+        """Whether the current thread is running a BATCH"""
+        return getattr(self.batch, "notifications", None) is not None
+
+    def _after_commit(self, callback):
+        """Run callback once the log records of the current command are durable
+
+        Notifications of a post wait for this, so no one hears of a message
+        a crash could still lose. In a BATCH, that is after the batch commits.
+        """
+        if self._in_batch():
+            self.batch.after_commit.append(callback)
+        else:
+            callback()  # _commit_log has already waited
+
+    def _flush_batch_notifications(self):
+        """Queue the notifications a batch deferred (no lock may be held)"""
+        notifications, self.batch.notifications = self.batch.notifications, []
+        for recipients, notification in notifications:
+            self._fan_out(recipients, notification)
+
+    def handle_list_groups(self, prefix: str = None, after: str = None, limit=None):
+        """Handle listing the groups, a page at a time in group_id order
+
+        prefix keeps only the group_ids starting with it; after continues
+        from the last group_id of the previous page.
+        """
+        if limit is None:
+            limit = DEFAULT_GROUPS_PAGE
+        if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+            return {"status": "ERROR", "message": "limit must be a positive integer"}
+        if not isinstance(prefix or "", str) or not isinstance(after or "", str):
+            return {"status": "ERROR", "message": "prefix and after must be strings"}
+        limit = min(limit, MAX_GROUPS_PAGE)
+
+        # In a cluster each group is known only to the node that owns it
+        if self.cluster is not None:
+            groups_list, more = self.cluster.list_groups(prefix or "", after or "", limit)
+        else:
+            groups_list, more = self.list_groups(prefix or "", after or "", limit)
+
+        return {
+            "status": "SUCCESS",
+            "groups": groups_list,
+            "more": more
+        }
+
+    def list_groups(self, prefix: str, after: str, limit: int, owned=None):
+        """Up to limit groups after the group_id after whose IDs start with prefix
+
+        Returns (groups, whether there are more). Only the groups owned(group_id)
+        accepts are listed, if given. Member counts are kept up to date as
+        members come and go, so listing costs the same however large the groups.
+        """
         groups_list = []
-        for group_id, group in self.groups.items():
-            if group_id != "public":  # Exclude public group from the list
+        with self.groups_lock:
+            start = bisect.bisect_left(self.group_ids, prefix)
+            if after:
+                start = max(start, bisect.bisect_right(self.group_ids, after))
+            for index in range(start, len(self.group_ids)):
+                group_id = self.group_ids[index]
+                if not group_id.startswith(prefix):
+                    break
+                if group_id == "public" or (owned is not None and not owned(group_id)):
+                    continue  # Exclude public group from the list
+                if len(groups_list) == limit:
+                    return groups_list, True
+                group = self.groups[group_id]
                 groups_list.append({
                     "group_id": group_id,
                     "name": group.name,
                     "member_count": len(group.members)
                 })
+        return groups_list, False
+
+    def handle_create_group(self, username: str, group_id: str, name: str):
+        """Handle a user creating a group; anyone may, and the ID must be new"""
+        if not isinstance(group_id, str) or not GROUP_ID_PATTERN.fullmatch(group_id):
+            return {"status": "ERROR", "message": "Group ID must be 1-64 letters, digits, '-' or '_'"}
+        if not isinstance(name, str) or not name.strip() or len(name) > MAX_GROUP_NAME:
+            return {"status": "ERROR", "message": f"Group name must be 1-{MAX_GROUP_NAME} characters"}
+        name = name.strip()
+
+        if self.bus is not None:
+            # The hub decides between workers creating the same ID at once
+            created = self.bus.create(group_id, name, username)
+            if created:
+                self._apply_bus(group_id)
+        else:
+            created = self._create_group(group_id, name, username, self.log) is not None
+        if not created:
+            return {"status": "ERROR", "message": "Group already exists"}
+
+        if self._in_batch():
+            self.batch.commit = True
+        else:
+            self._commit_log()
 
+        print(f"[SERVER] {username} created group {group_id}")
         return {
             "status": "SUCCESS",
-            "groups": groups_list
+            "message": f"Created group: {name}",
+            "group_id": group_id
+        }
+
+    def handle_delete_group(self, username: str, group_id: str):
+        """Handle deleting a group: only its creator or an administrator may"""
+        group = self.groups.get(group_id)
+        if group is None:
+            return {"status": "ERROR", "message": "Group does not exist"}
+        if group.creator is None:
+            return {"status": "ERROR", "message": "Built-in groups cannot be deleted"}
+        if username != group.creator and username not in self.admins:
+            return {"status": "ERROR", "message": "Only the group's creator can delete it"}
+
+        if self.bus is not None:
+            # Every worker removes it, and notifies its own members, as the hub passes the delete on
+            deleted = self.bus.delete(group_id)
+            if deleted:
+                self._apply_bus(group_id)
+        else:
+            removed = self._remove_group(group_id, self.log)
+            deleted = removed is not None
+        if not deleted:
+            return {"status": "ERROR", "message": "Group does not exist"}
+
+        if self._in_batch():
+            self.batch.commit = True
+        else:
+            self._commit_log()
+        if self.bus is None:
+            self._after_commit(lambda: self._notify_users(removed[1], f"Group '{group.name}' has been deleted"))
+
+        print(f"[SERVER] {username} deleted group {group_id}")
+        return {
+            "status": "SUCCESS",
+            "message": f"Deleted group: {group.name}"
         }
 
     def broadcast_notification(self, group_id: str, message: str, exclude: str = None):
-        """Broadcast a notification to all members of a group"""
-        if group_id not in self.groups:
+        """Broadcast a notification to all members of a group
+
+        Must be called without holding any lock: the member list is copied
+        under the group lock and the frames are queued after it is released.
+        Inside a BATCH the frames are queued when the batch releases the lock.
+        With --workers, the other workers notify the members connected to them.
+        """
+        if self.bus is not None:
+            self.bus.notify(group_id, message, exclude)
+        self._notify_members(group_id, message, exclude)
+
+    def _notify_members(self, group_id: str, message: str, exclude: str = None):
+        """Notify the members of a group that are connected to this process"""
+        group = self.groups.get(group_id)
+        if group is None:
             return
 
-        group = self.groups[group_id]
+        with group.lock:
+            members = [member for member in group.members if member != exclude]
+        self._notify_users(members, message)
+
+    def _notify_users(self, usernames: list, message: str):
+        """Notify the users connected to this process (no lock may be held)"""
+        with self.registry_lock:
+            recipients = [
+                (member, self.clients[member]) for member in usernames if member in self.clients
+            ]
+
         notification = {
             "type": "NOTIFICATION",
             "message": message
         }
+        if self._in_batch():
+            self.batch.notifications.append((recipients, notification))
+        else:
+            self._fan_out(recipients, notification)
 
-        for member in group.members:
-            if member != exclude and member in self.clients:
-                try:
-                    client_socket = self.clients[member]
-                    # Send notification asynchronously
-                    threading.Thread(
-                        target=self._send_notification,
-                        args=(client_socket, notification)
-                    ).start()
-                except Exception as e:
-                    print(f"[SERVER] Error sending notification to {member}: {e}")
-
-    def _send_notification(self, client_socket: socket.socket, notification: dict):
-        """Send a notification to a client (helper method)"""
+    def _fan_out(self, recipients: list, notification: dict):
+        """Deliver a notification to every recipient, now or when its coalescing window closes"""
+        if not recipients:
+            return
+        start = time.perf_counter()
+        self._deliver(recipients, notification)
+        self.fanout_seconds.observe(time.perf_counter() - start)
+        self.fanout_recipients.observe(len(recipients))
+
+    def _deliver(self, recipients: list, notification: dict):
+        """Send a notification now, or hold it for the recipients whose window is open"""
+
+        if self.coalesce_window:
+            held, immediate = recipients, []
+        else:
+            held = [(member, connection) for member, connection in recipients if connection.digest]
+            immediate = [(member, connection) for member, connection in recipients if not connection.digest]
+
+        if held:
+            opened = {}  # window -> connections whose window this notification opens
+            with self.notify_lock:
+                for member, connection in held:
+                    pending = self.pending_notifications.get(connection)
+                    if pending is None:
+                        self.pending_notifications[connection] = (member, [notification])
+                        window = connection.digest or self.coalesce_window
+                        opened.setdefault(window, []).append(connection)
+                    else:
+                        pending[1].append(notification)
+
+            for window, connections in opened.items():
+                self._schedule_flush(window, connections)
+
+        if immediate:
+            self._send_now(immediate, notification)
+
+    def _send_now(self, recipients: list, notification: dict):
+        """Encode a notification once per codec and queue the same frame for every recipient"""
+        frames = {}  # codec name -> encoded frame
+        for member, connection in recipients:
+            codec = connection.codec
+            frame = frames.get(codec.name)
+            if frame is None:
+                frame = frames[codec.name] = encode_frame(notification, codec)
+            self._notify(member, connection, frame)
+
+    def _notify(self, member: str, connection, frame: bytes):
+        """Queue a notification frame on one connection
+
+        A client that is behind has the frame handled by its overflow policy
+        (and counted in its lag) instead of delaying anyone else.
+        """
         try:
-            client_socket.send(json.dumps(notification).encode('utf-8'))
+            connection.notify(frame)
         except Exception as e:
-            print(f"[SERVER] Error sending notification: {e}")
+            print(f"[SERVER] Error sending notification to {member}: {e}")
+
+    def _send_notifications(self, batches: list):
+        """Queue one frame per (connection, member, notifications) batch
+
+        Recipients with the same notifications and codec share one encoded frame.
+        """
+        frames = {}  # (codec name, digest, notification ids) -> encoded frame
+        for connection, member, notifications in batches:
+            codec = connection.codec
+            digest = connection.digest is not None
+            key = (codec.name, digest, tuple(map(id, notifications)))
+            frame = frames.get(key)
+            if frame is None:
+                frame = frames[key] = encode_frame(self._merge_notifications(notifications, digest), codec)
+            self._notify(member, connection, frame)
+
+    @staticmethod
+    def _merge_notifications(notifications: list, digest: bool = False):
+        """Combine notifications into one frame body
+
+        A lone notification is sent unchanged. Several become one NOTIFICATION
+        whose "messages" lists them all and whose "message" joins them line by
+        line, so clients that only read "message" still see every event.
+        """
+        if len(notifications) == 1 and not digest:
+            return notifications[0]
+
+        messages = [notification["message"] for notification in notifications]
+        merged = {
+            "type": "NOTIFICATION",
+            "message": "\n".join(messages),
+            "messages": messages
+        }
+        if digest:
+            merged["digest"] = True
+        return merged
+
+    def _schedule_flush(self, delay: float, connections: list):
+        """Flush these connections' pending notifications after delay seconds"""
+        deadline = time.monotonic() + delay
+        with self.flush_cond:
+            heapq.heappush(self.flush_schedule, (deadline, next(self.flush_sequence), connections))
+            self.flush_cond.notify()
+            if self.flusher is None:
+                self.flusher = threading.Thread(target=self._flush_loop)
+                self.flusher.daemon = True
+                self.flusher.start()
+
+    def _flush_loop(self):
+        """Deliver pending notifications as their windows close"""
+        with self.flush_cond:
+            while True:
+                if not self.flush_schedule:
+                    self.flush_cond.wait()
+                    continue
+
+                delay = self.flush_schedule[0][0] - time.monotonic()
+                if delay > 0:
+                    self.flush_cond.wait(delay)
+                    continue
+
+                due = []
+                now = time.monotonic()
+                while self.flush_schedule and self.flush_schedule[0][0] <= now:
+                    due.extend(heapq.heappop(self.flush_schedule)[2])
+
+                self.flush_cond.release()
+                try:
+                    self._flush_notifications(due)
+                finally:
+                    self.flush_cond.acquire()
+
+    def _flush_notifications(self, connections: list):
+        """Send everything pending for these connections, one frame each"""
+        batches = []
+        with self.notify_lock:
+            for connection in connections:
+                pending = self.pending_notifications.pop(connection, None)
+                if pending is not None:
+                    batches.append((connection, pending[0], pending[1]))
+        self._send_notifications(batches)
+
+    def _commit_log(self):
+        """Wait until logged events are durable (per the log's durability mode)"""
+        if self.log:
+            self.log.sync()
+
+    def attach_bus(self, bus: BusClient, worker: int):
+        """Make this process one of several workers, linked to the others by bus
+
+        Called in a newly forked worker, before it accepts connections. No one
+        is connected yet, so every group starts without members. Membership
+        changes go to the bus instead of the log (the hub logs them), and new
+        cold segments and profiles go to this worker's own directories.
+        """
+        self.bus = bus
+        self.log = bus
+        self.reuse_port = True
+        for group in self.groups.values():
+            group.members.clear()
+            group.log = bus
+
+        if self.segment_root:
+            self.segment_root = os.path.join(self.data_dir, f"worker-{worker}", "segments")
+            shutil.rmtree(self.segment_root, ignore_errors=True)
+            for group_id, group in self.groups.items():
+                group.cold_dir = os.path.join(self.segment_root, group_id)
+                if group.cold is not None:
+                    group.cold.move_to(group.cold_dir)
+        self.profile_dir = os.path.join(self.profile_dir, f"worker-{worker}")
+
+        bus.start()
+
+    def _bus_ready(self, group_id: str):
+        """Have the applier thread apply a group's new bus events (called by the bus reader)"""
+        with self.apply_cond:
+            self.apply_pending.append(group_id)
+            self.apply_cond.notify()
+            if self.applier is None:
+                self.applier = threading.Thread(target=self._apply_loop)
+                self.applier.daemon = True
+                self.applier.start()
+
+    def _apply_loop(self):
+        """Apply bus events as they arrive
+
+        The bus reader never applies events itself: a handler holding a group
+        lock may be waiting on the reader for its post's msg_id.
+        """
+        while True:
+            with self.apply_cond:
+                while not self.apply_pending:
+                    self.apply_cond.wait()
+                group_ids = dict.fromkeys(self.apply_pending)
+                self.apply_pending.clear()
+
+            for group_id in group_ids:
+                self._apply_bus(group_id)
+
+    def _apply_bus(self, group_id: str):
+        """Apply the events the bus has queued for a group, in the hub's order
+
+        Records update the group under its lock (create_lock before it
+        exists); notifications are then delivered to the members connected
+        to this worker. Events after a create or delete belong to the group
+        as it is afterwards, so they are put back and taken again under the
+        new group's lock.
+        """
+        notices = []  # (members, or None for the group's, message, exclude)
+        while True:
+            group = self.groups.get(group_id)
+            with group.lock if group is not None else self.create_lock:
+                if self.groups.get(group_id) is not group:
+                    continue  # created or deleted while this waited for the lock
+                events = self.bus.take(group_id)
+                for position, event in enumerate(events):
+                    op = event["op"]
+                    if op == "notify":
+                        notices.append((None, event["message"], event.get("exclude")))
+                    elif op == "create":
+                        self._create_group(group_id, event["name"], event["creator"])
+                    elif op == "delete":
+                        removed = self._remove_group(group_id)
+                        if removed:
+                            notices.append((removed[1], f"Group '{removed[0].name}' has been deleted", None))
+                    elif group is not None:
+                        group.apply_record(event)
+                    if op in ("create", "delete"):
+                        self.bus.put_back(group_id, events[position + 1:])
+                        break
+                else:
+                    break
+
+        for members, message, exclude in notices:
+            if members is None:
+                self._notify_members(group_id, message, exclude)
+            else:
+                self._notify_users(members, message)
+
+    def handle_relayed(self, origin: str, username: str, digest, request: dict):
+        """Run a command another cluster node forwarded for one of its clients; returns the response
+
+        The client is registered here as a RemoteClient the first time, so the
+        handlers and notifications treat it like a local connection.
+        """
+        with self.registry_lock:
+            connection = self.clients.get(username)
+            if connection is None:
+                connection = self.clients[username] = RemoteClient(self.cluster, origin, username)
+                self.client_groups[username] = set()
+        if not isinstance(connection, RemoteClient):
+            return {"status": "ERROR", "message": f"{username} is connected to another node"}
+        connection.node = origin
+        connection.digest = digest
+
+        response = self.process_command(username, request.get("command"), request)
+        return response if isinstance(response, dict) else list(response)
+
+    def deliver_relayed(self, username: str, notification: dict):
+        """Send a notification from the node that owns a group to a client connected here"""
+        with self.registry_lock:
+            connection = self.clients.get(username)
+        if connection is not None and not isinstance(connection, RemoteClient):
+            self._notify(username, connection, encode_frame(notification, connection.codec))
+
+    def drop_remote_client(self, username: str):
+        """Log out a client of another node that has disconnected from it"""
+        with self.registry_lock:
+            remote = isinstance(self.clients.get(username), RemoteClient)
+        if remote:
+            self.disconnect_client(username)
+
+    def export_group(self, group_id: str):
+        """A group's state for handing it to another node
+
+        Returns its name, its creator, its msg_id counter, its message records
+        oldest first, and [member, node] pairs naming the node each member is
+        connected to.
+        """
+        group = self.groups[group_id]
+        with group.lock:
+            records = [msg.to_record() for msg in group.iter_messages()]
+            with self.registry_lock:
+                members = [[member, getattr(self.clients.get(member), "node", self.cluster.address)]
+                           for member in group.members]
+            return group.name, group.creator, group.message_counter, records, members
+
+    def adopt_group(self, group_id: str, name: str, creator: str, counter: int, records: list, members: list):
+        """Take over a group another node has handed to this one
+
+        The handed-over messages replace this node's copy, unless that copy is
+        the newer one (this node held the group before restarting). Members
+        connected to other nodes are registered as RemoteClients.
+        """
+        old = group = self.groups.get(group_id)
+        if old is None or counter >= old.message_counter:
+            group = self._new_group(group_id, name, creator)
+            # Logged and put in place in one step, so a snapshot holds the old copy or the new one
+            with old.lock if old is not None else contextlib.nullcontext(), self.groups_lock:
+                if self.log:
+                    self.log.append({"op": "reset", "group_id": group_id})
+                    if creator is not None:
+                        self.log.append({"op": "create", "group_id": group_id, "name": name, "creator": creator})
+                for msg_id, sender, subject, content, posted_at in records:
+                    record = {"op": "post", "group_id": group_id, "msg_id": msg_id, "sender": sender,
+                              "subject": subject, "content": content, "posted_at": posted_at}
+                    group.apply_record(record, self.log.append(record) if self.log else None)
+                group.message_counter = counter
+                if old is None:
+                    bisect.insort(self.group_ids, group_id)
+                self.groups[group_id] = group
+
+        with group.lock:
+            with self.registry_lock:
+                for member, node in members:
+                    if member not in self.clients:
+                        if node == self.cluster.address:
+                            continue  # they have disconnected from this node since
+                        self.clients[member] = RemoteClient(self.cluster, node, member)
+                        self.client_groups[member] = set()
+                    group.members.add(member)
+                    self.client_groups[member].add(group_id)
+
+        if self.log:
+            self.log.sync()
+
+    def drop_group(self, group_id: str):
+        """Forget a group this node has handed to another
+
+        A group made with CREATEGROUP is removed; a built-in group is left
+        empty, as every node has one.
+        """
+        old = self.groups[group_id]
+        # Logged and replaced in one step, so a snapshot holds the old copy or the new one
+        with old.lock:
+            if self.log:
+                self.log.append({"op": "reset", "group_id": group_id})
+            if old.creator is not None:
+                _, members = self._remove_group(group_id)
+            else:
+                self._replace_group(self._new_group(group_id, old.name))
+                members = list(old.members)
+                if old.cold is not None:
+                    old.cold.delete()
+        with self.registry_lock:
+            for member in members:
+                group_ids = self.client_groups.get(member)
+                if group_ids is None:
+                    continue
+                group_ids.discard(group_id)
+                # A user of another node only has a stand-in here while they are in one of its groups
+                if isinstance(self.clients.get(member), RemoteClient) and not group_ids:
+                    del self.clients[member]
+                    del self.client_groups[member]
+
+    def leave_cluster(self):
+        """Log this node's clients out everywhere, then hand its groups to the other nodes"""
+        self._disconnect_local_clients()
+        self.cluster.leave()
+
+    def _disconnect_local_clients(self):
+        """Disconnect every client connected to this node (not those of other nodes)"""
+        with self.registry_lock:
+            usernames = [username for username, connection in self.clients.items()
+                         if not isinstance(connection, RemoteClient)]
+        for username in usernames:
+            self.disconnect_client(username)
 
     def disconnect_client(self, username: str):
         """Handle client disconnection"""
-        with self.lock:
-            if username in self.clients:
-                # Remove from all groups
-                if username in self.client_groups:
-                    for group_id in list(self.client_groups[username]):
-                        group = self.groups.get(group_id)
-                        if group:
-                            group.remove_member(username)
-                            # Notify other users
-                            self.broadcast_notification(
-                                group_id,
-                                f"{username} has disconnected",
-                                exclude=username
-                            )
-
-                    del self.client_groups[username]
-
-                # Close socket and remove from clients
-                try:
-                    self.clients[username].close()
-                except:
-                    pass
-                del self.clients[username]
+        with self.registry_lock:
+            connection = self.clients.pop(username, None)
+            if connection is None:
+                return
+            group_ids = self.client_groups.pop(username, set())
+
+        # Remove from all groups
+        for group_id in group_ids:
+            group = self.groups.get(group_id)
+            if group:
+                with group.lock:
+                    group.remove_member(username)
+
+                # Notify other users
+                self.broadcast_notification(
+                    group_id,
+                    f"{username} has disconnected",
+                    exclude=username
+                )
+
+        # Pending notifications would only be dropped on the closed connection
+        with self.notify_lock:
+            self.pending_notifications.pop(connection, None)
 
-                print(f"[SERVER] {username} disconnected")
+        if self.bus is not None:
+            self.bus.release(username)
+        if self.cluster is not None and not isinstance(connection, RemoteClient):
+            self.cluster.disconnected(username)
+
+        # Close the connection
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+        print(f"[SERVER] {username} disconnected")
 
     def stop(self):
         """Stop the server"""
         self.running = False
         if self.server_socket:
             self.server_socket.close()
+        if self.follower is not None:
+            self.follower.stop()
+        if self.snapshotter:
+            self.write_snapshot()  # so the next start has next to nothing to replay
+        if self.log:
+            self.log.close()
+
+
+class _AsyncClientProtocol(asyncio.Protocol):
+    """Per-connection protocol used by the asyncio engine
+
+    Doubles as the connection object stored in ``clients`` so that the
+    shared handlers can send to and close it like a socket.
+
+    The transport's write buffer is capped at the server's buffer_limit.
+    While it is over the cap, the client's requests are not read (so it
+    cannot queue more responses) and notifications go through the overflow
+    policy: dropped (drop-new), held in a backlog capped at the same size
+    that sheds its oldest entries (drop-oldest), or the client is
+    disconnected (disconnect).
+    """
+
+    def __init__(self, server: "AsyncBulletinBoardServer"):
+        self.server = server
+        self.transport = None
+        self.username = None
+        self.codec = JSON_CODEC  # switched after the REGISTER handshake
+        self.compressor = None
+        self.digest = None  # digest interval in seconds, if the client asked for one
+        self.decoder = FrameDecoder()
+        self.waiting = None  # task sending the most recently held response
+        self.held = None  # requests that arrived while REGISTER waits on the worker hub
+
+        # Backpressure state and lag counters
+        self.paused_at = None  # when the write buffer went over the limit
+        self.backlog = deque()  # notifications held while paused (drop-oldest)
+        self.backlog_bytes = 0
+        self.peak_bytes = 0
+        self.dropped = 0
+        self.lagging = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.set_write_buffer_limits(high=self.server.buffer_limit)
+        print(f"[SERVER] New connection from {transport.get_extra_info('peername')}")
+
+    def data_received(self, data: bytes):
+        try:
+            for body in self.decoder.feed(data):
+                if self.held is not None:
+                    self.held.append(body)  # decoded once REGISTER has chosen the codec
+                    continue
+                self.handle_request(self.codec.decode(body))
+                if self.transport.is_closing():
+                    break
+
+        except Exception as e:
+            print(f"[SERVER] Error handling client {self.username}: {e}")
+            self.transport.close()
+
+    def handle_request(self, request: dict):
+        """Handle one complete request frame"""
+        command = request.get("command")
+
+        if self.username is None and command == "REGISTER":
+            if self.server.bus is not None:
+                self._register_off_loop(request)
+                return
+            self._registered(request, self.server.register_client(request.get("username"), self))
+            return
+
+        if self.server.cluster is not None and self.server.owned_elsewhere(command, request):
+            self._forward(command, request)
+            return
+
+        if self.server.waits_on_bus(command, request):
+            self._run_off_loop(command, request)
+            return
+
+        # Process the command
+        response = self.server.process_command(self.username, command, request)
+
+        durable = None
+        if self.server.commit_pending:
+            # Hold the response (and its notifications) until the log is durable, off the event loop
+            durable = self.server.start_commit()
+
+        frames = list(self.server.encode_responses(request, response, self.codec))
+        if durable is not None or self.waiting is not None:
+            self._send_after(durable, request, frames)
+        else:
+            for frame in frames:
+                self.send(frame)
+
+    def _registered(self, request: dict, response: dict):
+        """Answer a REGISTER and switch to the codec and compression it agreed"""
+        codec = self.server.negotiate_codec(request, response)
+        compressor = self.server.negotiate_compression(request, response)
+        self.send(encode_frame(tag_response(request, response)))
+
+        if response["status"] == "SUCCESS":
+            self.username = request.get("username")
+            self.codec = codec
+            if compressor is not None:
+                self.decoder.enable_decompression()
+                self.compressor = compressor
+        else:
+            self.transport.close()
+
+    def _register_off_loop(self, request: dict):
+        """Register in a worker thread while the worker hub checks the name is free
+        everywhere, holding the requests that arrive meanwhile"""
+        self.held = []
+        self.transport.pause_reading()
+
+        async def register():
+            response = await self.server.loop.run_in_executor(
+                None, self.server.register_client, request.get("username"), self)
+            if self.transport.is_closing():
+                if response["status"] == "SUCCESS":
+                    self.username = request.get("username")
+                    self.server.disconnect_client(self.username)  # it left while the hub answered
+                return
+            self._registered(request, response)
+            held, self.held = self.held, None
+            if self.transport.is_closing():
+                return
+            self.transport.resume_reading()
+            try:
+                for body in held:
+                    self.handle_request(self.codec.decode(body))
+                    if self.transport.is_closing():
+                        return
+            except Exception as e:
+                print(f"[SERVER] Error handling client {self.username}: {e}")
+                self.transport.close()
+
+        asyncio.ensure_future(register())
+
+    def _send_after(self, durable, request: dict, frames: list):
+        """Send a response once durable completes, after any response held before it
+
+        If the log cannot be made durable, an ERROR is sent in its place.
+        """
+        previous = self.waiting
+
+        async def send_in_order():
+            if previous is not None:
+                await asyncio.wait([previous])  # a response that failed has dealt with it
+            if durable is not None:
+                try:
+                    await durable
+                except LogError as e:
+                    failed = self.server.commit_failed(self.username, e)
+                    self._send_frames(self.server.encode_responses(request, failed, self.codec))
+                    return
+            self._send_frames(frames)
+
+        self.waiting = asyncio.ensure_future(send_in_order())
+        self.waiting.add_done_callback(self._response_sent)
+
+    def _forward(self, command: str, request: dict):
+        """Run a command for a group another node owns in a worker thread, so the
+        event loop never waits on that node; it runs and is answered in order
+        after any response held before it"""
+        self._run_off_loop(command, request)
+
+    def _run_off_loop(self, command: str, request: dict):
+        """Run a command in a worker thread, for commands that wait on another
+        process (a cluster node or the worker hub); it runs and is answered
+        in order after any response held before it"""
+        previous = self.waiting
+        loop = self.server.loop
+
+        async def run_in_order():
+            if previous is not None:
+                await asyncio.wait([previous])  # a response that failed has dealt with it
+            try:
+                response = await loop.run_in_executor(
+                    None, self.server.process_command, self.username, command, request)
+            except Exception as e:
+                print(f"[SERVER] Error handling client {self.username}: {e}")
+                self.transport.close()
+                return
+            self._send_frames(self.server.encode_responses(request, response, self.codec))
+
+        self.waiting = asyncio.ensure_future(run_in_order())
+        self.waiting.add_done_callback(self._response_sent)
+
+    def _send_frames(self, frames):
+        """Send a response's frames, unless the connection has closed meanwhile"""
+        if self.transport.is_closing():
+            return
+        for frame in frames:
+            self.send(frame)
+
+    def _response_sent(self, task):
+        """Forget the held-response chain once its last response is out"""
+        if self.waiting is task:
+            self.waiting = None
+
+    def pause_writing(self):
+        """The write buffer went over the limit: stop reading requests and hold notifications"""
+        self.paused_at = time.monotonic()
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        """The client caught up: send the held notifications and read requests again"""
+        self.paused_at = None
+        self.lagging = False
+        while self.backlog and self.paused_at is None:
+            frame = self.backlog.popleft()
+            self.backlog_bytes -= len(frame)
+            self.send(frame)
+        if self.paused_at is None and not self.transport.is_closing():
+            self.transport.resume_reading()
+
+    def connection_lost(self, exc):
+        self.backlog.clear()
+        self.backlog_bytes = 0
+
+        # Clean up when client disconnects
+        if self.username:
+            self.server.disconnect_client(self.username)
+
+    @property
+    def address(self):
+        """Peer address of the connection"""
+        return self.transport.get_extra_info('peername')
+
+    def send(self, data: bytes):
+        """Queue a frame on the transport (never blocks the event loop)"""
+        if self.compressor is not None:
+            # Frames reach the transport in order here, as the zlib stream requires
+            data = self.compressor.compress(data)
+        self.transport.write(data)
+        buffered = self.transport.get_write_buffer_size()
+        if buffered > self.peak_bytes:
+            self.peak_bytes = buffered
+
+    def notify(self, data: bytes) -> bool:
+        """Queue a notification frame; returns False if the overflow policy dropped it"""
+        if self.transport.is_closing():
+            return False
+        if self.paused_at is None:
+            self.send(data)
+            return True
+
+        policy = self.server.overflow_policy
+        if policy == "disconnect":
+            print(f"[SERVER] {self.address} overflowed its {self.server.buffer_limit} byte buffer, "
+                  f"disconnecting")
+            self.transport.abort()
+            return False
+        if policy != "drop-oldest":
+            self._dropped(1)
+            return False
+
+        self.backlog.append(data)
+        self.backlog_bytes += len(data)
+        evicted = 0
+        while self.backlog_bytes > self.server.buffer_limit and len(self.backlog) > 1:
+            self.backlog_bytes -= len(self.backlog.popleft())
+            evicted += 1
+        self._dropped(evicted)
+        return True
+
+    def _dropped(self, count: int):
+        """Count dropped notifications, logging once each time the client starts lagging"""
+        self.dropped += count
+        if count and not self.lagging:
+            self.lagging = True
+            print(f"[SERVER] {self.address} is not keeping up "
+                  f"({self.transport.get_write_buffer_size()} bytes buffered), dropping notifications")
+
+    def lag(self) -> dict:
+        """How far behind the client is: buffered bytes/frames, time over the limit, drops"""
+        return {
+            "queued_bytes": self.transport.get_write_buffer_size() + self.backlog_bytes,
+            "queued_frames": len(self.backlog),
+            "lag_seconds": round(time.monotonic() - self.paused_at, 3) if self.paused_at is not None else 0,
+            "peak_bytes": self.peak_bytes,
+            "dropped": self.dropped,
+            "policy": self.server.overflow_policy,
+        }
+
+    def close(self):
+        """Close the underlying transport, abandoning the buffer of a client that stopped reading"""
+        if self.paused_at is not None:
+            self.transport.abort()
+        else:
+            self.transport.close()
+
+
+class AsyncBulletinBoardServer(BulletinBoardServer):
+    """Bulletin board server that runs every connection on one asyncio event loop
+
+    Command handling is inherited unchanged from BulletinBoardServer; only the
+    connection handling differs. An idle connection costs a protocol object
+    and a socket instead of an OS thread and its stack.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loop = None
+        self.loop_thread = None
+        self.commit_pending = False  # set by _commit_log for the request being handled
+        self.commit_callbacks = []  # _after_commit callbacks waiting for that commit
+
+    def start(self):
+        """Start the server"""
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        """Accept connections and serve them until stopped"""
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.server_socket = await self.loop.create_server(
+            lambda: _AsyncClientProtocol(self),
+            self.host,
+            self.port,
+            reuse_address=True,
+            reuse_port=self.reuse_port,
+            backlog=LISTEN_BACKLOG
+        )
+        self.running = True
+
+        print(f"[SERVER] Bulletin Board Server (asyncio engine) started on {self.host}:{self.port}")
+        print(f"[SERVER] Waiting for connections...")
+
+        try:
+            await self.server_socket.serve_forever()
+        except asyncio.CancelledError:
+            if self.cluster is not None:
+                # Leave while the event loop can still deliver the departing clients' notices
+                self._disconnect_local_clients()
+                await self.loop.run_in_executor(None, self.cluster.leave)
+            raise  # asyncio.run turns this back into KeyboardInterrupt, so stop() runs as it does threaded
+
+    def _schedule_flush(self, delay: float, connections: list):
+        """Flush on the event loop, which owns every transport"""
+        if self.loop is None:
+            super()._schedule_flush(delay, connections)
+            return
+        self.loop.call_later(delay, self._flush_notifications, connections)
+
+    def _bus_ready(self, group_id: str):
+        """Apply bus events on the event loop, which owns every transport"""
+        if self.loop is None:
+            super()._bus_ready(group_id)
+            return
+        self.loop.call_soon_threadsafe(self._apply_bus, group_id)
+
+    def _commit_log(self):
+        """Defer the wait for durability so the event loop never blocks on fsync
+
+        A command run in a worker thread (_run_off_loop) waits there instead.
+        """
+        if not self._on_loop():
+            super()._commit_log()
+        elif self.log and self.log.durability != "none":
+            self.commit_pending = True
+
+    def _after_commit(self, callback):
+        """Hold callback until the deferred wait for durability completes (start_commit)"""
+        if self.commit_pending and not self._in_batch() and self._on_loop():
+            self.commit_callbacks.append(callback)
+        else:
+            super()._after_commit(callback)
+
+    def start_commit(self):
+        """Wait for the deferred commit in a worker thread; returns the future of that wait
+
+        The callbacks held for the commit run on the event loop once it is durable.
+        """
+        self.commit_pending = False
+        callbacks, self.commit_callbacks = self.commit_callbacks, []
+        durable = self.loop.run_in_executor(None, self.log.sync)
+
+        def committed(future):
+            if not future.cancelled() and future.exception() is None:
+                for callback in callbacks:
+                    callback()
+
+        if callbacks:
+            durable.add_done_callback(committed)
+        return durable
+
+    def _fan_out(self, recipients: list, notification: dict):
+        """Deliver on the event loop, which owns every transport"""
+        if self._on_loop():
+            super()._fan_out(recipients, notification)
+            return
+        self.loop.call_soon_threadsafe(super()._fan_out, recipients, notification)
+
+    def _on_loop(self) -> bool:
+        """Whether this is the event loop's thread (or the loop is not running yet)"""
+        return self.loop is None or self.loop_thread == threading.get_ident()
+
+    def handle_relayed(self, origin: str, username: str, digest, request: dict):
+        """Run a forwarded command on the event loop, answering once the log is durable"""
+        if self.loop is None:
+            return super().handle_relayed(origin, username, digest, request)
+        return asyncio.run_coroutine_threadsafe(
+            self._handle_relayed(origin, username, digest, request), self.loop).result()
+
+    async def _handle_relayed(self, origin: str, username: str, digest, request: dict):
+        """Run a forwarded command on the loop, waiting off it for durability"""
+        response = super().handle_relayed(origin, username, digest, request)
+        if self.commit_pending:
+            try:
+                await self.start_commit()
+            except LogError as e:
+                return self.commit_failed(username, e)
+        return response
+
+    def deliver_relayed(self, username: str, notification: dict):
+        """Deliver on the event loop, which owns every transport"""
+        if self.loop is None:
+            super().deliver_relayed(username, notification)
+            return
+        self.loop.call_soon_threadsafe(super().deliver_relayed, username, notification)
+
+    def _notify_replicated(self, group_id: str, members, message: str, exclude: str = None):
+        """Notify on the event loop, which owns every transport"""
+        if self.loop is None:
+            super()._notify_replicated(group_id, members, message, exclude)
+            return
+        self.loop.call_soon_threadsafe(super()._notify_replicated, group_id, members, message, exclude)
+
+    def drop_remote_client(self, username: str):
+        """Log the client out on the event loop, which owns every transport"""
+        if self.loop is None:
+            super().drop_remote_client(username)
+            return
+        self.loop.call_soon_threadsafe(super().drop_remote_client, username)
+
+    def stop(self):
+        """Stop the server"""
+        self.running = False
+        if self.loop and self.server_socket and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.server_socket.close)
+        if self.follower is not None:
+            self.follower.stop()
+        if self.snapshotter:
+            self.write_snapshot()  # so the next start has next to nothing to replay
+        if self.log:
+            self.log.close()
+
+
+ENGINES = {
+    "threaded": BulletinBoardServer,
+    "asyncio": AsyncBulletinBoardServer,
+}
+
+
+def run_workers(server: BulletinBoardServer, count: int, log: MessageLog = None, metrics_port: int = None):
+    """Serve from count worker processes sharing the port, linked by a bus hub in this process
+
+    The boards are rebuilt from the log once, here, and every worker is
+    forked from that copy; from then on only the hub writes to the log.
+    Workers share the listening port through SO_REUSEPORT, so the kernel
+    spreads new connections across them.
+    """
+    if log:
+        server.log = log
+        replayed = server._replay()
+        print(f"[SERVER] Replayed {replayed} records from {log.path}")
+
+    hub = BusHub({group_id: group.message_counter for group_id, group in server.groups.items()}, log)
+    durability = log.durability if log else "none"
+
+    for number in range(count):
+        hub_end, worker_end = socket.socketpair()
+        pid = os.fork()
+        if pid == 0:
+            hub.close()
+            hub_end.close()
+
+            def lost():
+                print(f"[SERVER] Worker {number} lost the hub, shutting down")
+                os.kill(os.getpid(), signal.SIGINT)
+
+            server.attach_bus(BusClient(worker_end, number, durability, server._bus_ready, lost), number)
+            if metrics_port:
+                start_http_server(metrics_port + number, server.render_metrics, server.host)
+            try:
+                server.start()
+            except KeyboardInterrupt:
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                server.stop()
+            os._exit(0)
+
+        worker_end.close()
+        hub.add_worker(hub_end, number, pid)
+
+    # Only now start logging: forked workers must not inherit the log's threads
+    if log:
+        server._open_log()
+    hub.start()
+    print(f"[SERVER] {count} worker processes serving port {server.port}")
+
+    numbers = {worker.pid: worker.number for worker in hub.workers}
+    while numbers:
+        try:
+            pid, _ = os.wait()
+        except KeyboardInterrupt:
+            # Pass the interrupt on (a Ctrl-C has already reached them) and wait for them to stop
+            print("\n[SERVER] Shutting down...")
+            for pid in numbers:
+                with contextlib.suppress(ProcessLookupError):
+                    os.kill(pid, signal.SIGINT)
+            continue
+        except ChildProcessError:
+            break
+        print(f"[SERVER] Worker {numbers.pop(pid, '?')} (pid {pid}) exited")
+
+    if log:
+        log.close()
 
 
 def main():
     """Main entry point for the server"""
-    import sys
+    parser = argparse.ArgumentParser(description="Bulletin Board Server")
+    parser.add_argument("port", nargs="?", type=int, default=8888,
+                        help="port to listen on (default: 8888)")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="threaded",
+                        help="connection engine: one thread per client, or a single "
+                             "asyncio event loop (default: threaded)")
+    parser.add_argument("--log", metavar="PATH",
+                        help="persist posts, joins and leaves to this append-only log "
+                             "and replay it at startup")
+    parser.add_argument("--durability", choices=DURABILITY_MODES, default="group",
+                        help="fsync policy for the log: none, once per post (always), "
+                             "or batched group commit (default: group)")
+    parser.add_argument("--commit-window", type=float, default=DEFAULT_COMMIT_WINDOW * 1000,
+                        metavar="MS", help="group commit batching window in milliseconds "
+                                           f"(default: {DEFAULT_COMMIT_WINDOW * 1000:g})")
+    parser.add_argument("--snapshot-interval", type=float, default=DEFAULT_SNAPSHOT_INTERVAL,
+                        metavar="SECONDS", help="snapshot the boards beside the log this often, so a "
+                                                "restart only replays the log since; 0 disables "
+                                                f"(default: {DEFAULT_SNAPSHOT_INTERVAL})")
+    parser.add_argument("--data-dir", metavar="PATH",
+                        help="spill messages beyond the hot tail to segment files here, "
+                             "keeping memory flat however long the history grows")
+    parser.add_argument("--hot-messages", type=int, default=DEFAULT_HOT_MESSAGES, metavar="N",
+                        help="newest messages per group kept in memory when --data-dir is set "
+                             f"(default: {DEFAULT_HOT_MESSAGES})")
+    parser.add_argument("--compress-threshold", type=int, default=COMPRESS_THRESHOLD, metavar="BYTES",
+                        help="compress frames at least this large for clients that negotiate it "
+                             f"(default: {COMPRESS_THRESHOLD})")
+    parser.add_argument("--no-compression", action="store_true",
+                        help="never agree to compress frames")
+    parser.add_argument("--coalesce-window", type=float, default=DEFAULT_COALESCE_WINDOW * 1000,
+                        metavar="MS", help="merge each client's notifications arriving within this "
+                                           f"many milliseconds into one frame; 0 disables "
+                                           f"(default: {DEFAULT_COALESCE_WINDOW * 1000:g})")
+    parser.add_argument("--outbound-buffer", type=int, default=OUTBOUND_BUFFER_BYTES // 1024, metavar="KB",
+                        help="outbound bytes buffered per client before the overflow policy applies "
+                             f"(default: {OUTBOUND_BUFFER_BYTES // 1024})")
+    parser.add_argument("--overflow-policy", choices=OVERFLOW_POLICIES, default=DEFAULT_OVERFLOW_POLICY,
+                        help="what to do with a client that falls that far behind: drop new "
+                             "notifications, drop the oldest queued ones, or disconnect it; "
+                             f"responses are never dropped (default: {DEFAULT_OVERFLOW_POLICY})")
+    parser.add_argument("--admin", action="append", default=[], metavar="USERNAME",
+                        help="let this user run admin commands such as STATS (repeatable)")
+    parser.add_argument("--profile-dir", default="profiles", metavar="PATH",
+                        help="directory PROFILE reports are written to (default: profiles)")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="serve metrics in Prometheus text format at "
+                             "http://localhost:PORT/metrics (worker N uses PORT+N)")
+    parser.add_argument("--workers", type=int, default=1, metavar="N",
+                        help="serve from N processes sharing the port, each with a copy of the "
+                             "boards kept in step over a local bus (default: 1)")
+    parser.add_argument("--cluster-port", type=int, metavar="PORT",
+                        help="run as a cluster node: share the groups out with other nodes, "
+                             "which reach this one on PORT")
+    parser.add_argument("--join", metavar="HOST:PORT",
+                        help="cluster port of a node already in the cluster to join through "
+                             "(without it, --cluster-port starts a new cluster)")
+    parser.add_argument("--replication-port", type=int, metavar="PORT",
+                        help="ship the --log to read replicas that connect to PORT")
+    parser.add_argument("--follow", metavar="HOST:PORT",
+                        help="run as a read-only replica of the server whose --replication-port "
+                             "this is, applying its log as it grows")
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        parser.error("--workers needs SO_REUSEPORT, which this platform does not have")
+    if args.join and not args.cluster_port:
+        parser.error("--join needs --cluster-port")
+    if args.cluster_port and args.workers > 1:
+        parser.error("--cluster-port cannot be combined with --workers")
+    if args.replication_port and not args.log:
+        parser.error("--replication-port needs --log")
+    if (args.replication_port or args.follow) and args.workers > 1:
+        parser.error("--replication-port and --follow cannot be combined with --workers")
+    if args.follow and args.cluster_port:
+        parser.error("--follow cannot be combined with --cluster-port")
 
     # Default values
     host = "localhost"
-    port = 8888
 
-    # Parse command line arguments
-    if len(sys.argv) > 1:
-        port = int(sys.argv[1])
+    log = None
+    if args.log:
+        log = MessageLog(args.log, args.durability, args.commit_window / 1000)
 
     # Create and start the server
-    server = BulletinBoardServer(host, port)
+    compress_threshold = None if args.no_compression else args.compress_threshold
+    # Worker processes replay the log in run_workers instead
+    server = ENGINES[args.engine](host, args.port, log if args.workers == 1 else None, args.data_dir,
+                                  args.hot_messages, compress_threshold, args.coalesce_window / 1000,
+                                  args.outbound_buffer * 1024, args.overflow_policy, set(args.admin),
+                                  args.profile_dir, args.snapshot_interval, args.follow)
+
+    if args.workers > 1:
+        run_workers(server, args.workers, log, args.metrics_port)
+        return
+
+    if args.metrics_port:
+        start_http_server(args.metrics_port, server.render_metrics, host)
+        print(f"[SERVER] Metrics at http://{host}:{args.metrics_port}/metrics")
+
+    if args.cluster_port:
+        server.cluster = ClusterNode(server, host, args.cluster_port)
+        server.cluster.start(args.join)
+
+    if args.replication_port:
+        server.shipper = LogShipper(log, host, args.replication_port, f"{host}:{args.port}")
+        server.shipper.start()
+    if server.follower is not None:
+        server.follower.start()
 
     try:
         server.start()
     except KeyboardInterrupt:
         print("\n[SERVER] Shutting down...")
+        if server.cluster is not None:
+            server.leave_cluster()
         server.stop()
 
 
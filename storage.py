@@ -0,0 +1,576 @@
+#!/usr/bin/env python3
+"""
+Bulletin Board Storage
+Durable append-only log of board events (posts, joins and leaves), the
+memory-mapped segment files that hold messages too old to keep in memory,
+and snapshots of the boards that let a restart skip most of the log.
+
+Each record is an 8-byte header (body length and CRC-32 of the body, both
+big-endian) followed by the JSON body. A crash can leave a half-written
+record at the end of the file; replay stops at the first incomplete or
+corrupt record and truncates the file there.
+
+Durability modes:
+  none    records are handed to the OS on every append but never fsynced
+  always  every post is fsynced before it is acknowledged
+  group   a background thread fsyncs batches of records; a post is
+          acknowledged once the batch containing it is on disk
+"""
+
+import bisect
+import contextlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+# Record header: body length and CRC-32 of the body
+RECORD_HEADER = struct.Struct("!II")
+
+DURABILITY_MODES = ("none", "always", "group")
+
+# How long the group-commit thread gathers records before each fsync (seconds)
+DEFAULT_COMMIT_WINDOW = 0.002
+
+
+class LogError(Exception):
+    """The log could not make records durable"""
+
+
+class MessageLog:
+    """Append-only write-ahead log with configurable fsync policy
+
+    Call replay() to read back existing records, then open() before the first
+    append(). append() only writes; sync() blocks until everything appended
+    so far is as durable as the configured mode promises, and raises
+    LogError if an fsync fails. If the group committer's fsync fails, it
+    stops, and every sync() waiting for records it had not yet made durable
+    fails from then on: the kernel may have dropped them.
+
+    Readers can follow the log as it grows: wait_past() blocks until
+    something is appended, and read_bytes() returns records as written.
+    """
+
+    def __init__(self, path: str, durability: str = "group", commit_window: float = DEFAULT_COMMIT_WINDOW):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {durability}")
+
+        self.path = path
+        self.durability = durability
+        self.commit_window = commit_window
+        self.file = None
+        self.closed = False
+
+        self.write_lock = threading.Lock()   # serializes appends
+        self.grown = threading.Condition(self.write_lock)  # wakes wait_past() on every append
+        self.sync_cond = threading.Condition()  # guards synced and wakes the flusher
+        self.appended = 0  # records written to the OS since open()
+        self.synced = 0    # records known to be on disk
+        self.error = None  # the fsync failure that stopped the group committer
+        self.end = 0       # byte offset the next record will be written at
+        self.flusher = None
+        self.reader = None  # read-only descriptor for read(), opened on first use
+
+    def size(self) -> int:
+        """Bytes in the log file"""
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def replay(self, start: int = 0):
+        """Yield (offset, record) for every intact record from byte offset start on, oldest first"""
+        if not os.path.exists(self.path):
+            return
+
+        good_offset = start
+        with open(self.path, "rb") as log_file:
+            log_file.seek(start)
+            for record, length in _read_records(log_file):
+                yield good_offset, record
+                good_offset += length
+
+        # Cut off a torn record left by a crash so new appends follow intact data
+        if os.path.getsize(self.path) > good_offset:
+            print(f"[STORAGE] Truncating damaged tail of {self.path} at byte {good_offset}")
+            with open(self.path, "r+b") as log_file:
+                log_file.truncate(good_offset)
+
+    def read(self, offset: int) -> dict:
+        """The record written at a byte offset (one replay() or append() reported)"""
+        reader = self._reader()
+        header = os.pread(reader, RECORD_HEADER.size, offset)
+        if len(header) < RECORD_HEADER.size:
+            raise ValueError(f"No intact record at byte {offset} of {self.path}")
+        length, checksum = RECORD_HEADER.unpack(header)
+        body = os.pread(reader, length, offset + RECORD_HEADER.size)
+        if len(body) < length or zlib.crc32(body) != checksum:
+            raise ValueError(f"No intact record at byte {offset} of {self.path}")
+        return json.loads(body)
+
+    def read_bytes(self, start: int, end: int) -> bytes:
+        """The log's bytes from offset start up to end, as written (whole records if both are boundaries)"""
+        return os.pread(self._reader(), end - start, start)
+
+    def _reader(self) -> int:
+        """The read-only descriptor, opened on first use"""
+        if self.reader is None:
+            with self.write_lock:
+                if self.reader is None:
+                    self.reader = os.open(self.path, os.O_RDONLY)
+        return self.reader
+
+    def wait_past(self, position: int, timeout: float = None) -> int:
+        """Block until the log extends past byte offset position, it closes, or timeout passes; returns its end"""
+        with self.grown:
+            if self.end <= position and not self.closed:
+                self.grown.wait(timeout)
+            return self.end
+
+    def open(self):
+        """Open the log for appending"""
+        self.file = open(self.path, "ab", buffering=0)
+        self.end = self.file.tell()
+        if self.durability == "group":
+            self.flusher = threading.Thread(target=self._flush_loop)
+            self.flusher.daemon = True
+            self.flusher.start()
+
+    def append(self, record: dict) -> int:
+        """Write one record to the end of the log; returns its byte offset"""
+        return self.append_frame(_frame(record))
+
+    def append_frame(self, frame: bytes) -> int:
+        """Write one record exactly as another log framed it (see split_records()); returns its byte offset"""
+        with self.write_lock:
+            self.file.write(frame)
+            self.appended += 1
+            offset = self.end
+            self.end += len(frame)
+            self.grown.notify_all()
+        return offset
+
+    def flush(self):
+        """Force everything appended so far to disk, whatever the durability mode"""
+        with self.write_lock:
+            os.fsync(self.file.fileno())
+
+    def sync(self):
+        """Block until every record appended so far is durable"""
+        if self.durability == "none":
+            return
+
+        target = self.appended
+
+        if self.durability == "always":
+            try:
+                os.fsync(self.file.fileno())
+            except OSError as e:
+                raise LogError(f"fsync of {self.path} failed: {e}")
+            with self.sync_cond:
+                self.synced = max(self.synced, target)
+            return
+
+        with self.sync_cond:
+            self.sync_cond.notify_all()
+            while self.synced < target and not self.closed and self.error is None:
+                self.sync_cond.wait()
+            if self.synced < target and self.error is not None:
+                raise LogError(f"fsync of {self.path} failed: {self.error}")
+
+    def _flush_loop(self):
+        """Group commit: fsync whatever has accumulated, then wake the waiters"""
+        while True:
+            with self.sync_cond:
+                while self.synced >= self.appended and not self.closed:
+                    self.sync_cond.wait()
+                if self.closed:
+                    return
+
+            # Let concurrent posts join this batch
+            if self.commit_window:
+                time.sleep(self.commit_window)
+
+            target = self.appended
+            try:
+                os.fsync(self.file.fileno())
+            except OSError as e:
+                # Retrying could report success for pages the kernel has already dropped
+                print(f"[STORAGE] fsync of {self.path} failed, posts can no longer be made durable: {e}")
+                with self.sync_cond:
+                    self.error = e
+                    self.sync_cond.notify_all()
+                return
+
+            with self.sync_cond:
+                self.synced = target
+                self.sync_cond.notify_all()
+
+    def close(self):
+        """Flush everything to disk and close the log"""
+        if self.file is None or self.closed:
+            return
+
+        with self.sync_cond:
+            self.closed = True
+            self.sync_cond.notify_all()
+        with self.grown:
+            self.grown.notify_all()
+        if self.flusher:
+            self.flusher.join()
+
+        with self.write_lock:
+            os.fsync(self.file.fileno())
+            self.file.close()
+            if self.reader is not None:
+                os.close(self.reader)
+                self.reader = None
+
+
+def _fsync_directory(directory: str):
+    """Make the names of files created or renamed in a directory durable"""
+    descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def _frame(record: dict) -> bytes:
+    """A record as written to a log or snapshot: header, then JSON body"""
+    body = json.dumps(record, separators=(",", ":")).encode('utf-8')
+    return RECORD_HEADER.pack(len(body), zlib.crc32(body)) + body
+
+
+def _read_records(stream):
+    """Yield (record, bytes it took) for each intact record in a file, stopping at a torn one"""
+    while True:
+        header = stream.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return
+
+        length, checksum = RECORD_HEADER.unpack(header)
+        body = stream.read(length)
+        if len(body) < length or zlib.crc32(body) != checksum:
+            return
+
+        yield json.loads(body), RECORD_HEADER.size + length
+
+
+def split_records(data: bytes):
+    """Yield (record, frame) for each whole record at the start of data, stopping at a partial one
+
+    A record that is all there but fails its checksum raises ValueError.
+    """
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        length, checksum = RECORD_HEADER.unpack_from(data, offset)
+        end = offset + RECORD_HEADER.size + length
+        if end > len(data):
+            return
+        body = data[offset + RECORD_HEADER.size:end]
+        if zlib.crc32(body) != checksum:
+            raise ValueError(f"Corrupt record {offset} bytes into the data")
+        yield json.loads(body), data[offset:end]
+        offset = end
+
+
+class Snapshot:
+    """A point-in-time copy of the boards, kept in one file beside the message log
+
+    The file holds a header record, then any number of records, then an
+    "end" record counting them, in the log's record format. It is written
+    to a temporary file and renamed into place, so a crash while writing
+    leaves the previous snapshot untouched.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def write(self, header: dict, records) -> int:
+        """Replace the snapshot with header and records; returns how many records were written"""
+        temporary = self.path + ".tmp"
+        count = 0
+        with open(temporary, "wb") as snapshot_file:
+            snapshot_file.write(_frame(header))
+            for record in records:
+                snapshot_file.write(_frame(record))
+                count += 1
+            snapshot_file.write(_frame({"op": "end", "records": count}))
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temporary, self.path)
+        _fsync_directory(os.path.dirname(os.path.abspath(self.path)))
+        return count
+
+    def read(self):
+        """Return (header, records); records yields every record and raises ValueError if any are missing"""
+        snapshot_file = open(self.path, "rb")
+        entries = _read_records(snapshot_file)
+        first = next(entries, None)
+        if first is None:
+            snapshot_file.close()
+            raise ValueError(f"{self.path} has no header")
+
+        def records():
+            count = 0
+            with snapshot_file:
+                for record, _ in entries:
+                    if record.get("op") == "end":
+                        if record["records"] != count:
+                            break
+                        return
+                    yield record
+                    count += 1
+            raise ValueError(f"{self.path} is incomplete")
+
+        return first[0], records()
+
+
+# Cold segment index entry: msg_id, offset of the record in the data file, record length
+INDEX_ENTRY = struct.Struct("!qQI")
+
+# Messages written to each cold segment
+SEGMENT_MESSAGES = 1024
+
+
+class Segment:
+    """An immutable run of messages on disk, read through mmap
+
+    A segment is two files: "<first_id>.seg" holds the JSON records back to
+    back and "<first_id>.idx" holds one fixed-size INDEX_ENTRY per record in
+    msg_id order. Both are memory-mapped, so lookups binary-search the index
+    and slice the record straight out of the page cache. write() fsyncs both
+    files and their directory, so a snapshot written later can list them.
+    """
+
+    def __init__(self, base_path: str):
+        self.base_path = base_path
+        self.data = self._map(base_path + ".seg")
+        self.index = self._map(base_path + ".idx")
+        self.count = len(self.index) // INDEX_ENTRY.size
+        self.first_id = self._entry(0)[0]
+        self.last_id = self._entry(self.count - 1)[0]
+
+    @staticmethod
+    def _map(path: str):
+        """Map a whole file read-only"""
+        with open(path, "rb") as segment_file:
+            return mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @classmethod
+    def write(cls, directory: str, records: list):
+        """Write records (tuples starting with msg_id, in msg_id order) as a new segment"""
+        base_path = os.path.join(directory, str(records[0][0]))
+        index = bytearray()
+        offset = 0
+
+        with open(base_path + ".seg", "wb") as data_file:
+            for record in records:
+                body = json.dumps(record, separators=(",", ":")).encode('utf-8')
+                data_file.write(body)
+                index += INDEX_ENTRY.pack(record[0], offset, len(body))
+                offset += len(body)
+            data_file.flush()
+            os.fsync(data_file.fileno())
+
+        with open(base_path + ".idx", "wb") as index_file:
+            index_file.write(index)
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        _fsync_directory(directory)
+
+        return cls(base_path)
+
+    def check(self):
+        """Raise ValueError unless the index and data files look whole
+
+        Checks the last index entry against the data file's size and decodes
+        the last record, which is what a crash would have cut short.
+        """
+        if not self.count or len(self.index) != self.count * INDEX_ENTRY.size:
+            raise ValueError(f"{self.base_path}.idx is damaged")
+        _, offset, length = self._entry(self.count - 1)
+        if offset + length != len(self.data) or self.read(self.count - 1)[0] != self.last_id:
+            raise ValueError(f"{self.base_path}.seg is damaged")
+
+    def _entry(self, position: int):
+        """Index entry (msg_id, offset, length) at a position"""
+        return INDEX_ENTRY.unpack_from(self.index, position * INDEX_ENTRY.size)
+
+    def read(self, position: int):
+        """Decode the record at an index position"""
+        _, offset, length = self._entry(position)
+        return tuple(json.loads(self.data[offset:offset + length]))
+
+    def position(self, msg_id: int):
+        """Index position of the first entry with an ID >= msg_id"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._entry(middle)[0] < msg_id:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get(self, msg_id: int):
+        """Record with the given ID, or None"""
+        position = self.position(msg_id)
+        if position < self.count and self._entry(position)[0] == msg_id:
+            return self.read(position)
+        return None
+
+    def newest_first(self, before_id: int = None):
+        """Yield records newest first, optionally only those with IDs below before_id"""
+        position = self.count if before_id is None else self.position(before_id)
+        for position in range(position - 1, -1, -1):
+            yield self.read(position)
+
+    def delete(self):
+        """Unmap the segment and remove its files"""
+        self.data.close()
+        self.index.close()
+        os.remove(self.base_path + ".seg")
+        os.remove(self.base_path + ".idx")
+
+
+class SegmentStore:
+    """Cold message tier: a directory of immutable segments
+
+    The store is derived data (the message log is the source of truth), so
+    any segments left in the directory by a previous run are discarded,
+    unless restore() reopens the ones a snapshot lists.
+    Deleted or expired messages are hidden rather than rewritten.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._clear_directory()
+
+        self.segments = []      # oldest first
+        self.first_ids = []     # first_id of each segment, for bisect
+        self.deleted = set()    # IDs removed after their segment was written
+        self.expired_below = 0  # every ID below this has expired
+        self.live = 0           # visible records
+
+    @classmethod
+    def restore(cls, directory: str, state: dict):
+        """Reopen the segments a snapshot listed (see state()), removing any others in the directory
+
+        Raises ValueError (or OSError) if a listed segment is missing or damaged.
+        """
+        store = cls.__new__(cls)
+        store.directory = directory
+        store.segments = [Segment(os.path.join(directory, str(first_id))) for first_id in state["segments"]]
+        for first_id, segment in zip(state["segments"], store.segments):
+            segment.check()
+            if segment.first_id != first_id:
+                raise ValueError(f"{segment.base_path}.idx is damaged")
+        store.first_ids = [segment.first_id for segment in store.segments]
+        store.deleted = set(state["deleted"])
+        store.expired_below = state["expired_below"]
+        store.live = state["live"]
+
+        listed = {f"{first_id}{suffix}" for first_id in state["segments"] for suffix in (".seg", ".idx")}
+        for name in os.listdir(directory):
+            if name.endswith((".seg", ".idx")) and name not in listed:
+                os.remove(os.path.join(directory, name))
+        return store
+
+    def state(self) -> dict:
+        """What restore() needs to reopen this store (its segments are immutable)"""
+        return {
+            "segments": list(self.first_ids),
+            "deleted": sorted(self.deleted),
+            "expired_below": self.expired_below,
+            "live": self.live
+        }
+
+    def __len__(self):
+        return self.live
+
+    def _clear_directory(self):
+        """Create the directory, removing segments left in it by a previous run"""
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            if name.endswith((".seg", ".idx")):
+                os.remove(os.path.join(self.directory, name))
+
+    def move_to(self, directory: str):
+        """Write new segments to another directory; existing ones stay readable where they are"""
+        self.directory = directory
+        self._clear_directory()
+
+    def append(self, records: list):
+        """Spill records (all newer than anything already stored) into a new segment"""
+        segment = Segment.write(self.directory, records)
+        self.segments.append(segment)
+        self.first_ids.append(segment.first_id)
+        self.live += segment.count
+
+    def _visible(self, msg_id: int) -> bool:
+        return msg_id >= self.expired_below and msg_id not in self.deleted
+
+    def get(self, msg_id: int):
+        """Record with the given ID, or None"""
+        if not self._visible(msg_id):
+            return None
+        position = bisect.bisect_right(self.first_ids, msg_id) - 1
+        if position < 0:
+            return None
+        return self.segments[position].get(msg_id)
+
+    def remove(self, msg_id: int):
+        """Hide a record; returns it, or None if it was not stored"""
+        record = self.get(msg_id)
+        if record is not None:
+            self.deleted.add(msg_id)
+            self.live -= 1
+        return record
+
+    def delete(self):
+        """Remove every segment and the directory (the group itself is gone)"""
+        for segment in self.segments:
+            segment.delete()
+        self.segments, self.first_ids = [], []
+        self.deleted = set()
+        self.live = 0
+        with contextlib.suppress(OSError):
+            os.rmdir(self.directory)
+
+    def expire_below(self, msg_id: int):
+        """Expire every record with an ID below msg_id, deleting whole segments"""
+        for record in self.oldest_first():
+            if record[0] >= msg_id:
+                break
+            self.live -= 1
+
+        self.expired_below = max(self.expired_below, msg_id)
+        while self.segments and self.segments[0].last_id < self.expired_below:
+            self.segments.pop(0).delete()
+            self.first_ids.pop(0)
+        self.deleted = {deleted for deleted in self.deleted if deleted >= self.expired_below}
+
+    def oldest_first(self, after_id: int = 0):
+        """Yield visible records oldest first, optionally only IDs above after_id"""
+        first = max(bisect.bisect_right(self.first_ids, after_id) - 1, 0)
+        for segment in self.segments[first:]:
+            for position in range(segment.position(after_id + 1), segment.count):
+                record = segment.read(position)
+                if self._visible(record[0]):
+                    yield record
+
+    def newest_first(self, before_id: int = None):
+        """Yield visible records newest first, optionally only IDs below before_id"""
+        for segment in reversed(self.segments):
+            if before_id is not None and segment.first_id >= before_id:
+                continue
+            for record in segment.newest_first(before_id):
+                if record[0] < self.expired_below:
+                    return
+                if record[0] not in self.deleted:
+                    yield record
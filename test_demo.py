@@ -4,10 +4,22 @@ Simple test script to demonstrate the bulletin board system functionality
 """
 
 import socket
-import json
 import time
 import threading
 
+from protocol import FrameReader, send_frame
+
+
+def send_request(sock, reader, request):
+    """Send a request and return its response, skipping any notifications"""
+    send_frame(sock, request)
+    while True:
+        response = reader.read()
+        if response is None:
+            raise ConnectionError("Server closed the connection")
+        if response.get("type") != "NOTIFICATION":
+            return response
+
 
 def test_client(username, port=8888):
     """Test client function"""
@@ -15,11 +27,11 @@ def test_client(username, port=8888):
         # Connect to server
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.connect(("localhost", port))
+        reader = FrameReader(sock)
 
         # Register
         request = {"command": "REGISTER", "username": username}
-        sock.send(json.dumps(request).encode('utf-8'))
-        response = json.loads(sock.recv(4096).decode('utf-8'))
+        response = send_request(sock, reader, request)
         print(f"[{username}] {response.get('message')}")
 
         if response.get("status") != "SUCCESS":
@@ -28,8 +40,7 @@ def test_client(username, port=8888):
 
         # Join public group
         request = {"command": "JOIN"}
-        sock.send(json.dumps(request).encode('utf-8'))
-        response = json.loads(sock.recv(4096).decode('utf-8'))
+        response = send_request(sock, reader, request)
         print(f"[{username}] Joined public group. Users: {response.get('users')}")
 
         # Post a message
@@ -39,8 +50,7 @@ def test_client(username, port=8888):
             "subject": f"Hello from {username}",
             "content": f"This is a test message from {username}!"
         }
-        sock.send(json.dumps(request).encode('utf-8'))
-        response = json.loads(sock.recv(4096).decode('utf-8'))
+        response = send_request(sock, reader, request)
         print(f"[{username}] Posted message ID: {response.get('msg_id')}")
 
         # Keep connection alive for a bit
@@ -48,8 +58,7 @@ def test_client(username, port=8888):
 
         # Leave
         request = {"command": "LEAVE"}
-        sock.send(json.dumps(request).encode('utf-8'))
-        response = json.loads(sock.recv(4096).decode('utf-8'))
+        response = send_request(sock, reader, request)
         print(f"[{username}] {response.get('message')}")
 
         sock.close()
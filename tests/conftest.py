@@ -0,0 +1,6 @@
+"""Let the tests import the project's modules from the directory above"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
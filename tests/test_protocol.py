@@ -0,0 +1,108 @@
+"""Unit tests for the wire codecs and frame decoding"""
+
+import json
+
+import pytest
+
+from protocol import (BINARY_CODEC, HEADER, JSON_CODEC, FrameCompressor, FrameDecoder, FrameError,
+                      encode_frame)
+
+PAYLOADS = [
+    {"command": "REGISTER", "username": "alice", "codecs": ["binary", "json"], "request_id": 1},
+    {"status": "ERROR", "message": "You are not a member of this group"},
+    {"status": "SUCCESS", "users": ["alice", "bob", "zoë", "日本"], "more": False},
+    {"status": "SUCCESS", "ids": [0, 1, -5, 2 ** 40], "ratio": 0.25, "missing": None},
+    {"status": "SUCCESS", "messages": [
+        {"msg_id": 1, "sender": "alice", "subject": "Hi", "content": "Hello\nworld",
+         "post_date": "2025-01-01 00:00:00", "group_id": "tech"},
+        {"msg_id": 2, "sender": "bob", "subject": "Re: Hi", "content": "😀 ünïcode",
+         "post_date": "2025-01-01 00:00:01", "group_id": "tech"},
+    ]},
+    {"nested": {"list": [1, "two", [3.5, {"four": True}], {}], "empty": []}},
+]
+
+
+@pytest.mark.parametrize("payload", PAYLOADS)
+def test_codecs_round_trip(payload):
+    from_binary = BINARY_CODEC.decode(BINARY_CODEC.encode(payload))
+    from_json = JSON_CODEC.decode(JSON_CODEC.encode(payload))
+    assert from_binary == payload
+    assert from_json == payload
+
+
+@pytest.mark.parametrize("payload", PAYLOADS)
+def test_binary_decodes_to_what_json_carries(payload):
+    as_json = json.loads(JSON_CODEC.encode(payload))
+    assert BINARY_CODEC.decode(BINARY_CODEC.encode(as_json)) == as_json
+
+
+@pytest.mark.parametrize("body", [b"", b"\x00", b"\xff" * 16, b"not a frame", b'{"a": 1}'])
+def test_binary_rejects_garbage(body):
+    with pytest.raises(FrameError):
+        BINARY_CODEC.decode(body)
+
+
+def test_binary_rejects_truncated_and_padded_bodies():
+    body = BINARY_CODEC.encode(PAYLOADS[4])
+    for cut in range(len(body)):
+        with pytest.raises(FrameError):
+            BINARY_CODEC.decode(body[:cut])
+    with pytest.raises(FrameError):
+        BINARY_CODEC.decode(body + b"\x00")
+
+
+@pytest.mark.parametrize("body", [b"", b"\xff\xfe", b"{not json", b"[1, 2]", b'"text"'])
+def test_json_rejects_garbage(body):
+    with pytest.raises(FrameError):
+        JSON_CODEC.decode(body)
+
+
+def compressed_stream(payloads, codec=JSON_CODEC):
+    compressor = FrameCompressor(threshold=0)
+    return b"".join(compressor.compress(encode_frame(payload, codec)) for payload in payloads)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64, 1 << 20])
+def test_compressed_frames_split_across_reads(chunk_size):
+    payloads = PAYLOADS * 3
+    stream = compressed_stream(payloads)
+
+    decoder = FrameDecoder()
+    decoder.enable_decompression()
+    bodies = []
+    for start in range(0, len(stream), chunk_size):
+        bodies.extend(decoder.feed(stream[start:start + chunk_size]))
+
+    assert [JSON_CODEC.decode(body) for body in bodies] == payloads
+    assert decoder.pending() == 0
+
+
+def test_compressed_and_plain_frames_mix():
+    compressor = FrameCompressor(threshold=200)
+    payloads = [{"short": 1}, PAYLOADS[4], {"short": 2}, PAYLOADS[4]]
+    stream = b"".join(compressor.compress(encode_frame(payload, BINARY_CODEC)) for payload in payloads)
+
+    decoder = FrameDecoder()
+    decoder.enable_decompression()
+    bodies = []
+    for byte in range(len(stream)):
+        bodies.extend(decoder.feed(stream[byte:byte + 1]))
+    assert [BINARY_CODEC.decode(body) for body in bodies] == payloads
+
+
+def test_compressed_frame_needs_negotiation():
+    with pytest.raises(FrameError):
+        FrameDecoder().feed(compressed_stream([PAYLOADS[0]]))
+
+
+def test_oversize_frame_is_rejected():
+    decoder = FrameDecoder(max_frame_size=100)
+    with pytest.raises(FrameError):
+        decoder.feed(HEADER.pack(101))
+
+
+def test_oversize_after_decompression_is_rejected():
+    decoder = FrameDecoder(max_frame_size=100)
+    decoder.enable_decompression()
+    with pytest.raises(FrameError):
+        decoder.feed(compressed_stream([{"content": "x" * 1000}]))
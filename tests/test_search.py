@@ -0,0 +1,60 @@
+"""Unit tests for the search index"""
+
+from search import SearchIndex
+
+
+def all_pages(index, query, limit):
+    """Every result of a query, fetched one page at a time"""
+    results, before_id = [], None
+    while True:
+        page, more = index.search(query, before_id=before_id, limit=limit)
+        results.extend(page)
+        if not more:
+            return results
+        assert len(page) == limit
+        before_id = page[-1]
+
+
+def test_term_search_is_newest_first():
+    index = SearchIndex()
+    for msg_id in range(1, 11):
+        index.add(msg_id, "subject", "even" if msg_id % 2 == 0 else "odd")
+    assert index.search("even", limit=3) == ([10, 8, 6], True)
+    assert all_pages(index, "even", limit=3) == [10, 8, 6, 4, 2]
+    assert index.search("missing") == ([], False)
+
+
+def test_prefix_search_merges_every_matching_term():
+    # Each message uses its own term, so a prefix query spans 1000 terms
+    index = SearchIndex()
+    for msg_id in range(1, 1001):
+        index.add(msg_id, f"word{msg_id:04d}")
+
+    page, more = index.search("word*", limit=20)
+    assert page == list(range(1000, 980, -1))
+    assert more
+    assert all_pages(index, "word*", limit=20) == list(range(1000, 0, -1))
+
+
+def test_prefix_search_reports_each_message_once():
+    index = SearchIndex()
+    for msg_id in range(1, 51):
+        index.add(msg_id, "apple apricot avocado")
+    assert all_pages(index, "a*", limit=7) == list(range(50, 0, -1))
+
+
+def test_prefix_and_term_must_both_match():
+    index = SearchIndex()
+    for msg_id in range(1, 101):
+        index.add(msg_id, f"tag{msg_id}", "urgent" if msg_id % 10 == 0 else "later")
+    assert all_pages(index, "urgent tag*", limit=4) == list(range(100, 0, -10))
+    assert all_pages(index, "tag5*", limit=4) == [59, 58, 57, 56, 55, 54, 53, 52, 51, 50, 5]
+
+
+def test_accept_filters_deleted_messages():
+    index = SearchIndex()
+    for msg_id in range(1, 11):
+        index.add(msg_id, "hello")
+    page, more = index.search("hello", limit=3, accept=lambda msg_id: msg_id % 3 != 0)
+    assert page == [10, 8, 7]
+    assert more
@@ -0,0 +1,74 @@
+"""Unit tests for the message log"""
+
+import os
+
+from storage import MessageLog
+
+
+def write_log(path, records):
+    log = MessageLog(path, durability="none")
+    log.open()
+    for record in records:
+        log.append(record)
+    log.close()
+
+
+def test_replay_returns_records_in_order(tmp_path):
+    path = str(tmp_path / "board.log")
+    records = [{"type": "post", "msg_id": n, "content": f"message {n}"} for n in range(1, 6)]
+    write_log(path, records)
+
+    log = MessageLog(path, durability="none")
+    assert [record for _, record in log.replay()] == records
+
+
+def test_replay_truncates_torn_final_record(tmp_path):
+    path = str(tmp_path / "board.log")
+    records = [{"type": "post", "msg_id": n, "content": f"message {n}"} for n in range(1, 4)]
+    write_log(path, records)
+    intact = os.path.getsize(path)
+
+    # A crash in the middle of writing the fourth record
+    write_log(path, [{"type": "post", "msg_id": 4, "content": "never finished"}])
+    with open(path, "r+b") as log_file:
+        log_file.truncate(os.path.getsize(path) - 5)
+
+    log = MessageLog(path, durability="none")
+    assert [record for _, record in log.replay()] == records
+    assert os.path.getsize(path) == intact
+
+    # New appends follow the intact records
+    log.open()
+    log.append({"type": "post", "msg_id": 4, "content": "written again"})
+    log.close()
+    replayed = [record for _, record in MessageLog(path, durability="none").replay()]
+    assert replayed == records + [{"type": "post", "msg_id": 4, "content": "written again"}]
+
+
+def test_replay_stops_at_corrupt_record(tmp_path):
+    path = str(tmp_path / "board.log")
+    records = [{"type": "post", "msg_id": n} for n in range(1, 4)]
+    write_log(path, records)
+    offsets = [offset for offset, _ in MessageLog(path, durability="none").replay()]
+
+    # Flip a byte in the last record's body so its checksum no longer matches
+    with open(path, "r+b") as log_file:
+        log_file.seek(os.path.getsize(path) - 2)
+        byte = log_file.read(1)
+        log_file.seek(-1, os.SEEK_CUR)
+        log_file.write(bytes([byte[0] ^ 0xff]))
+
+    log = MessageLog(path, durability="none")
+    assert [record for _, record in log.replay()] == records[:2]
+    assert os.path.getsize(path) == offsets[2]
+
+
+def test_read_returns_record_at_offset(tmp_path):
+    path = str(tmp_path / "board.log")
+    write_log(path, [{"msg_id": 1}, {"msg_id": 2}])
+
+    log = MessageLog(path, durability="none")
+    entries = list(log.replay())
+    log.open()
+    assert [log.read(offset) for offset, _ in entries] == [record for _, record in entries]
+    log.close()